@@ -17,6 +17,7 @@ from .core import pos2speed, argmax_2d_tensor, spk_time_to_scv, firing_pos_from_
 from .core import sliding_window_to_feature
 from .manifold import FA
 from ..base import SPKTAG
+from ..base.SpikeTable import read_spike_table
 from ..utils import colorbar
 from ..utils.plotting import colorline
 from ..realtime import bmi_packet
@@ -470,17 +471,27 @@ class place_field(Dataset):
         gkern2d /= gkern2d.sum()
         return gkern2d
 
-    def _get_firing_pos(self, spk_times):
+    def _get_firing_idx(self, spk_times):
+        '''
+        the ts index of every spike, -1 for the spikes that are not counted (before the first ts, low speed),
+        it only reads pc, so the spikes of a group can be indexed ahead (see MainView.prepare)
+        '''
         spk_ts_idx = np.searchsorted(self.ts, spk_times) - 1
-        spk_ts_idx = spk_ts_idx[spk_ts_idx>0]
         # idx = np.array([_ for _ in spk_ts_idx if _ not in self.low_speed_idx], dtype=np.int)
-        idx = spk_ts_idx[~np.in1d(spk_ts_idx, self.low_speed_idx)]
-        # idx = np.setdiff1d(spk_ts_idx, self.low_speed_idx)
+        spk_ts_idx[(spk_ts_idx <= 0) | np.in1d(spk_ts_idx, self.low_speed_idx)] = -1
+        return spk_ts_idx
+
+    def _get_firing_pos(self, spk_times, firing_idx=None):
+        '''
+        firing_idx: the output of _get_firing_idx for spk_times, if it is already known
+        '''
+        idx = self._get_firing_idx(spk_times) if firing_idx is None else firing_idx
+        idx = idx[idx >= 0]
         firing_ts  = self.ts[idx]
         firing_pos = self.pos[idx]
         return firing_pos
 
-    def _get_field(self, spk_times):
+    def _get_field(self, spk_times, firing_idx=None):
         '''
         spk_times: spike times in seconds (an Numpy array), for example:
         array([   1.38388,    1.6384 ,    1.7168 , ..., 2393.72648, 2398.52484, 2398.538  ])
@@ -490,7 +501,7 @@ class place_field(Dataset):
 
         Used by `get_fields` method to calculate the place fields for all neurons in pc.spk_time_dict.
         '''
-        self.firing_pos = self._get_firing_pos(spk_times)     
+        self.firing_pos = self._get_firing_pos(spk_times, firing_idx)     
         self.firing_map, x_edges, y_edges = np.histogram2d(x=self.firing_pos[:,0], y=self.firing_pos[:,1], 
                                                            bins=self.nbins, range=self.maze_range)
         self.firing_map = self.firing_map.T
@@ -915,8 +926,8 @@ class place_field(Dataset):
         pc.report()
         '''
         print('--------------- place cell object: load spktag dataframe ---------------\r\n')
-        self.spike_df = pd.read_pickle(df_file)
-        self.spike_df['frame_id'] /= fs
+        self.spike_df = read_spike_table(df_file)
+        self.spike_df['frame_id'] = self.spike_df['frame_id'] / fs
         self.spike_df.set_index('spike_id', inplace=True)
         self.spike_df.index = self.spike_df.index.astype(int)
         self.spike_df.index -= self.spike_df.index.min()
@@ -96,6 +96,235 @@ class status_manager(EventEmitter):
 
 
 
+class global_label_lut(object):
+    '''
+    look up table of (group_id, local clu_id) -> global label across the clus of all groups
+
+    global label = offset[group_id] + clu_id for clu_id > 0, noise (clu_id 0) is always 0,
+    the offset of a group is the number of non-noise clusters in all groups before it.
+    The table is rebuilt lazily (O(ngroup)) after `cluster` or `delete` events of any clu.
+
+    lut = global_label_lut(clu_dict)
+    lut.to_global(g, clu[g].membership)      # global labels of one group (a single gather)
+    lut.to_global(grp_ids, clu_ids)          # global labels of (group, clu) pairs (a single gather)
+    g, clu_id, spk_idx = lut.locate(label)   # reverse look up
+    '''
+    def __init__(self, clu, groups=None):
+        self.clu = clu
+        self.groups = groups
+        self._watched = {}   # {group_id: (clu, handlers connected to it)}
+        self._dirty = True
+
+    def _watch(self):
+        for g in self._groups:
+            if g not in self._watched or self._watched[g][0] is not self.clu[g]:
+                self._unwatch(g)
+                self._dirty = True
+                def on_cluster(*args, **kwargs):
+                    self._dirty = True
+                def on_delete(*args, **kwargs):
+                    self._dirty = True
+                self._watched[g] = (self.clu[g], [self.clu[g].connect(on_cluster), self.clu[g].connect(on_delete)])
+
+    def _unwatch(self, g):
+        if g in self._watched:
+            clu, handlers = self._watched.pop(g)
+            clu.unconnect(*handlers)
+
+    def disconnect(self):
+        '''
+        stop watching the clus (the table is no longer used)
+        '''
+        for g in list(self._watched):
+            self._unwatch(g)
+
+    def _build(self):
+        self._groups = list(self.clu.keys()) if self.groups is None else list(self.groups)
+        self._watch()
+        if not self._dirty:
+            return
+        nclus = np.array([self.clu[g].nclu - 1 for g in self._groups], dtype=np.int64)   # exclude noise
+        self._offset = np.hstack(([0], np.cumsum(nclus)[:-1])).astype(np.int64)
+        # flat table: the row of (g, clu_id) is start[g] + clu_id
+        self._start = np.zeros(max(self._groups, default=-1) + 1, dtype=np.int64)
+        self._start[self._groups] = np.hstack(([0], np.cumsum(nclus + 1)[:-1]))
+        self._table = np.zeros((nclus + 1).sum(), dtype=np.int64)
+        self._grp = np.zeros(nclus.sum() + 1, dtype=np.int64)    # reverse: global label -> group
+        self._clu = np.zeros(nclus.sum() + 1, dtype=np.int64)    # reverse: global label -> clu_id
+        for g, offset, n in zip(self._groups, self._offset, nclus):
+            labels = offset + np.arange(1, n + 1)
+            self._table[self._start[g] + 1:self._start[g] + n + 1] = labels
+            self._grp[labels] = g
+            self._clu[labels] = np.arange(1, n + 1)
+        self._n_units = int(nclus.sum())
+        self._dirty = False
+
+    @property
+    def offset(self):
+        self._build()
+        return self._offset
+
+    @property
+    def n_units(self):
+        self._build()
+        return self._n_units
+
+    def __getitem__(self, group_id):
+        '''
+        (nclu,) array, local clu_id -> global label of the group
+        '''
+        self._build()
+        start = self._start[group_id]
+        return self._table[start:start + self.clu[group_id].nclu]
+
+    def to_global(self, grp_ids, clu_ids):
+        self._build()
+        return self._table[self._start[grp_ids] + clu_ids]
+
+    def locate(self, label):
+        '''
+        return (group_id, clu_id, spike indices in the group) of a global label
+        '''
+        self._build()
+        assert 0 < label <= self._n_units, "global label {} out of range [1, {}]".format(label, self._n_units)
+        g, clu_id = int(self._grp[label]), int(self._clu[label])
+        return g, clu_id, self.clu[g].index[clu_id]
+
+    def as_dict(self):
+        '''
+        {group_id: {local label: global label}}
+        '''
+        self._build()
+        return {g: dict(enumerate(self[g])) for g in self._groups}
+
+
+class unit_spike_index(object):
+    '''
+    spike times of every unit (non-noise cluster) of the selected groups in one CSR layout
+
+    idx = unit_spike_index(clu_dict, spk_time_dict, fs)
+    idx.groups = [0, 3, 5]                   # the groups whose units are indexed (e.g. the `done` groups)
+    idx[u]                                   # spike times (sec) of unit u, a view of idx.times
+    idx.times, idx.offsets                   # unit u is times[offsets[u]:offsets[u+1]]
+    idx.units                                # (n_units, 2) (group_id, clu_id) of every unit
+    idx.group_times(g)                       # {clu_id: spike times} of all clusters of one group (noise included)
+
+    Every group is kept as its spike times sorted by cluster (stable, so the times of a cluster keep 
+    their spike order) with per-cluster counts. Only the groups changed by a `cluster` or `delete` 
+    event of their clu, or whose spike times were replaced, are sorted again; the CSR arrays are then
+    re-assembled from the group blocks. `version` increases whenever the index changed.
+    '''
+    def __init__(self, clu, spk_times, fs, groups=None):
+        self.clu = clu
+        self.spk_times = spk_times
+        self.fs = float(fs)
+        self._groups = [] if groups is None else list(groups)
+        self._blocks = {}    # {group_id: (times sorted by cluster, offsets of every clu_id)}
+        self._source = {}    # {group_id: (clu, spike times) the block was built from}
+        self._handlers = {}  # {group_id: (clu, handlers connected to it)}
+        self._dirty = set()
+        self._stale = True
+        self.version = 0
+
+    @property
+    def groups(self):
+        return self._groups
+
+    @groups.setter
+    def groups(self, groups):
+        groups = list(groups)
+        if groups != self._groups:
+            self._groups = groups
+            self._stale = True
+
+    def _watch(self, g):
+        self._unwatch(g)
+        clu = self.clu[g]
+        def on_cluster(*args, **kwargs):
+            self._dirty.add(g)
+        def on_delete(*args, **kwargs):
+            self._dirty.add(g)
+        self._handlers[g] = (clu, [clu.connect(on_cluster), clu.connect(on_delete)])
+
+    def _unwatch(self, g):
+        if g in self._handlers:
+            clu, handlers = self._handlers.pop(g)
+            clu.unconnect(*handlers)
+
+    def disconnect(self):
+        '''
+        stop watching the clus (the index is no longer used)
+        '''
+        for g in list(self._handlers):
+            self._unwatch(g)
+
+    def _block(self, g):
+        clu, times = self.clu[g], self.spk_times[g]
+        source = self._source.get(g)
+        if source is None or source[0] is not clu:
+            self._watch(g)
+            self._dirty.add(g)
+        elif source[1] is not times:
+            self._dirty.add(g)
+        if g in self._dirty or g not in self._blocks:
+            order = np.argsort(clu.membership, kind='stable')
+            counts = np.bincount(clu.membership, minlength=clu.nclu)
+            self._blocks[g] = (np.asarray(times)[order] / self.fs,
+                               np.hstack(([0], np.cumsum(counts))).astype(np.int64))
+            self._source[g] = (clu, times)
+            self._dirty.discard(g)
+            self._stale = True
+        return self._blocks[g]
+
+    def _build(self):
+        for g in self._groups:
+            self._block(g)
+        if not self._stale:
+            return
+        times, counts, units = [], [], []
+        for g in self._groups:
+            _times, _offsets = self._blocks[g]
+            times.append(_times[_offsets[1]:])                         # noise (clu_id 0) first, left out
+            counts.append(np.diff(_offsets)[1:])
+            units.append(np.vstack((np.full(len(_offsets)-2, g), np.arange(1, len(_offsets)-1))).T)
+        self._times = np.hstack(times) if times else np.zeros((0,))
+        self._offsets = np.hstack(([0], np.cumsum(np.hstack(counts)) if counts else [])).astype(np.int64)
+        self._units = np.vstack(units).astype(np.int64) if units else np.zeros((0, 2), dtype=np.int64)
+        self._stale = False
+        self.version += 1
+
+    @property
+    def times(self):
+        self._build()
+        return self._times
+
+    @property
+    def offsets(self):
+        self._build()
+        return self._offsets
+
+    @property
+    def units(self):
+        self._build()
+        return self._units
+
+    @property
+    def n_units(self):
+        self._build()
+        return self._units.shape[0]
+
+    def __len__(self):
+        return self.n_units
+
+    def __getitem__(self, u):
+        self._build()
+        return self._times[self._offsets[u]:self._offsets[u+1]]
+
+    def group_times(self, g):
+        _times, _offsets = self._block(g)
+        return {clu_id: _times[_offsets[clu_id]:_offsets[clu_id+1]] for clu_id in range(len(_offsets)-1)}
+
+
 class CLU(EventEmitter):
     """docstring for Clu"""
     def __init__(self, clu, method=None, clusterer=None, treeinfo=None, probmatrix=None):
@@ -193,6 +422,7 @@ class CLU(EventEmitter):
         - force the cluster id to be continous: 0,1,2,3,4,5,6......N
         '''
         self.membership -= self.membership.min()
+        self.index_id = np.unique(self.membership)
         if self._is_id_discontineous():
             for i in range(1, self.index_id.size):
                 self.membership[self.membership==self.index_id[i]] = i
@@ -414,6 +644,15 @@ class CLU(EventEmitter):
         #     self._membership_stack.pop() 
         return self._id
 
+    @instack_membership
+    def relabel(self, global_idx, labels):
+        '''
+        relabel a subset of spikes (e.g. after reclustering), undoable
+        '''
+        self.membership[global_idx] = labels
+        self.__construct__()
+        self.emit('cluster', action='relabel')
+
     def refill(self, global_idx, labels):
         assert len(global_idx) == len(labels)
 
@@ -452,6 +691,34 @@ class CLU(EventEmitter):
         for i in range(len(self._membership_stack)):
             self._membership_stack[i] = np.delete(self._membership_stack[i], global_ids)
 
+    def _compact(self, keep):
+        '''
+        keep only the spikes where `keep` is True, both in membership and in every undo snapshot
+        return the labels that were removed: [(compacted membership, its removed labels), 
+                                              (compacted snapshot0, its removed labels), ...]
+        '''
+        removed = [(m[keep], m[~keep]) for m in [self.membership] + self._membership_stack]
+        self.membership = removed[0][0]
+        self._membership_stack = [m for m, _ in removed[1:]]
+        self.__construct__()
+        return removed
+
+    def _expand(self, keep, removed):
+        '''
+        inverse of _compact, the removed labels are found by the identity of the compacted arrays,
+        so an undo between _compact and _expand (the membership is then a compacted snapshot) is
+        restored right. Snapshots pushed after _compact get the labels removed from the membership.
+        '''
+        def expand(m):
+            r = next((r for _m, r in removed if _m is m), removed[0][1])
+            _m = np.empty(keep.shape, dtype=m.dtype)
+            _m[keep] = m
+            _m[~keep] = r
+            return _m
+        self._membership_stack = [expand(m) for m in self._membership_stack]
+        self.membership = expand(self.membership)
+        self.__construct__()
+
     def mask(self, global_ids):
         self.membership = np.delete(self.__membership, global_ids)
         self.__construct__()
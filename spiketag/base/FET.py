@@ -8,7 +8,7 @@ import ipyparallel as ipp
 from time import time
 from ..utils.utils import Timer
 from ..utils.conf import info, warning
-from .CLU import CLU
+from .CLU import CLU, global_label_lut
 
 def correct_label_order(labels):
     '''
@@ -24,6 +24,41 @@ def correct_label_order(labels):
         new_labels[new_labels == _original_label] = correct_label[i]
     return new_labels
 
+
+def _dpgmm_estimator(n_comp=8, max_iter=100):
+    '''
+    the DPGMM of spiketag (cluster._dpgmm and FET.recluster), unfitted
+    '''
+    from sklearn.mixture import BayesianGaussianMixture as DPGMM
+    dpgmm = DPGMM(
+        n_components=n_comp, covariance_type='full', weight_concentration_prior=1e-3,
+        weight_concentration_prior_type='dirichlet_process', init_params="kmeans",
+        max_iter=max_iter, random_state=0, verbose=0, verbose_interval=10) # init can be "kmeans" or "random"
+    return dpgmm
+
+
+def _gmm_from_labels(fet, labels, clu_ids, max_iter=50, reg_covar=1e-6):
+    '''
+    GMM whose EM starts from the weights, means and covariances of the
+    existing clusters `clu_ids` (labels is the membership of fet), one component per cluster
+    '''
+    from sklearn.mixture import GaussianMixture as GMM
+    ndim = fet.shape[1]
+    weights, means, precisions = [], [], []
+    for clu_id in clu_ids:
+        X = fet[labels == clu_id]
+        mean = X.mean(axis=0)
+        cov = (X - mean).T @ (X - mean) / max(X.shape[0] - 1, 1) + reg_covar * np.eye(ndim)
+        weights.append(X.shape[0])
+        means.append(mean)
+        precisions.append(np.linalg.inv(cov))
+    weights = np.array(weights, dtype=np.float64)
+    gmm = GMM(n_components=len(clu_ids), covariance_type='full', reg_covar=reg_covar,
+              weights_init=weights/weights.sum(), means_init=np.vstack(means), precisions_init=np.array(precisions),
+              max_iter=max_iter, random_state=0)
+    return gmm
+
+
 class cluster():
     def __init__(self, clu_status):
         self.client = ipp.Client()
@@ -63,11 +98,8 @@ class cluster():
         
     @staticmethod
     def _dpgmm(fet, n_comp=8, max_iter=400):
-        from sklearn.mixture import BayesianGaussianMixture as DPGMM
-        dpgmm = DPGMM(
-            n_components=n_comp, covariance_type='full', weight_concentration_prior=1e-3,
-            weight_concentration_prior_type='dirichlet_process', init_params="kmeans",
-            max_iter=100, random_state=0, verbose=0, verbose_interval=10) # init can be "kmeans" or "random"
+        from spiketag.base.FET import _dpgmm_estimator
+        dpgmm = _dpgmm_estimator(n_comp, max_iter=100)
         dpgmm.fit(fet)
         label = dpgmm.predict(fet)
         return label
@@ -78,7 +110,7 @@ class cluster():
         kmeans = MiniBatchKMeans(n_clusters=n_comp,
                                  max_no_improvement=20,
                                  random_state=0,
-                                 batch_size=6)
+                                 batch_size=min(4096, fet.shape[0]))
         label = kmeans.fit_predict(fet)
         return label    
 
@@ -99,6 +131,107 @@ class cluster():
         return clusterer.labels_+1
 
 
+class stream_cluster(object):
+    '''
+    clusterless kmeans sorting that streams spike packets from disk chunk by chunk,
+    so that the feature file never has to be loaded into memory
+
+    sc = stream_cluster('./fet.bin', n_items=8, n_comp=8)
+    sc.fit()                                # 1st pass: partial_fit one MiniBatchKMeans per group
+    labels = sc.predict('./labels.bin')     # 2nd pass: global label of every packet (int32)
+
+    Every packet follows the fet.bin layout: [time, group_id, fet0, fet1, fet2, fet3, spike_id, ...]
+    Global label of cluster k in group g is offset[g]+k+1, 
+    0 is left for groups with less than n_comp spikes in the whole file (never fitted)
+    '''
+    def __init__(self, filename, n_items=8, n_comp=8, binpoint=13, chunk_size=2**20, batch_size=4096, n_jobs=8):
+        self.filename   = filename
+        self.n_items    = n_items
+        self.n_comp     = n_comp
+        self.binpoint   = binpoint
+        self.chunk_size = chunk_size
+        self.batch_size = batch_size
+        self.n_jobs     = n_jobs
+        self.packets = np.memmap(filename, dtype=np.int32, mode='r').reshape(-1, n_items)
+        self.models = {}
+        self.offset = {}
+
+    @property
+    def npts(self):
+        return self.packets.shape[0]
+
+    def _chunks(self):
+        '''
+        yield (start, {group_id: (idx, fet)}) for every chunk, idx is the row index inside the chunk
+        '''
+        for start in range(0, self.npts, self.chunk_size):
+            chunk = np.asarray(self.packets[start:start+self.chunk_size])
+            order = np.argsort(chunk[:, 1], kind='stable')
+            groups, first = np.unique(chunk[order, 1], return_index=True)
+            grouped = {}
+            for g, idx in zip(groups, np.split(order, first[1:])):
+                grouped[g] = (idx, chunk[idx, 2:6].astype(np.float32) / float(2**self.binpoint))
+            yield start, grouped
+
+    def _partial_fit(self, group_id, X):
+        for i in range(0, X.shape[0], self.batch_size):
+            self.models[group_id].partial_fit(X[i:i+self.batch_size])
+
+    def _submit(self, pool, group_id, X):
+        from sklearn.cluster import MiniBatchKMeans
+        if group_id not in self.models:
+            self.models[group_id] = MiniBatchKMeans(n_clusters=self.n_comp, batch_size=self.batch_size, random_state=0)
+        return pool.submit(self._partial_fit, group_id, X)
+
+    def fit(self):
+        '''
+        1st pass: every group gets full batches of `batch_size` spikes as they stream in,
+        groups in the same chunk are fitted in parallel, the remainder is fitted at the end
+        '''
+        from concurrent.futures import ThreadPoolExecutor
+        pending = {}
+        with ThreadPoolExecutor(max_workers=self.n_jobs) as pool:
+            for _, grouped in self._chunks():
+                jobs = []
+                for g, (_, X) in grouped.items():
+                    pending[g] = np.vstack((pending[g], X)) if g in pending else X
+                    n = pending[g].shape[0] // self.batch_size * self.batch_size
+                    if n > 0:
+                        jobs.append(self._submit(pool, g, pending[g][:n]))
+                        pending[g] = pending[g][n:]
+                for job in jobs:
+                    job.result()
+            jobs = [self._submit(pool, g, X) for g, X in pending.items()
+                    if X.shape[0] >= self.n_comp or (g in self.models and X.shape[0] > 0)]
+            for job in jobs:
+                job.result()
+
+        base = 0
+        for g in sorted(self.models.keys()):
+            self.offset[g] = base
+            base += self.n_comp
+        info('stream_cluster: {} groups fitted, {} clusters'.format(len(self.models), base))
+        return self
+
+    def predict(self, filename=None):
+        '''
+        2nd pass: label every packet, labels are written to `filename` (int32) if it is given
+        '''
+        from concurrent.futures import ThreadPoolExecutor
+        if filename is None:
+            labels = np.zeros((self.npts,), dtype=np.int32)
+        else:
+            labels = np.memmap(filename, dtype=np.int32, mode='w+', shape=(self.npts,))
+        with ThreadPoolExecutor(max_workers=self.n_jobs) as pool:
+            for start, grouped in self._chunks():
+                jobs = {g: pool.submit(self.models[g].predict, X) for g, (_, X) in grouped.items() if g in self.models}
+                for g, job in jobs.items():
+                    labels[start + grouped[g][0]] = job.result() + self.offset[g] + 1
+        if filename is not None:
+            labels.flush()
+        return labels
+
+
 class FET(object):
     """
     feature = FET(fet)
@@ -132,6 +265,11 @@ class FET(object):
         self.dpgmm_hyper_param = {'max_n_clusters': 10,
                                   'max_iter':       300}
 
+        # fitted mixture model per group, used to warm start `recluster`
+        self.models = {}
+        self._watched = {}          # {group_id: (clu, handlers)}, drop the model once the clu is edited
+        self._reclustering = False
+
     # def set_backend(self, method='ipyparallel'):
     #     self.backend = cluster()
 
@@ -164,6 +302,94 @@ class FET(object):
                              **kwargs)
         # print(f"get {self.clu[group_id].nclu} clusters", end='\r')
 
+    def recluster(self, group_id, clu_ids=None, n_comp=None, max_iter=50, clu=None):
+        '''
+        warm-started (blocking) reclustering of one group, the result is filled into the clu
+
+        clu_ids is None: refit the whole group
+            - starts from the cached model self.models[group_id] if there is one
+            - otherwise starts from the current clusters (one component per cluster)
+            - cold DPGMM with n_comp components if there are no clusters yet
+        clu_ids = [2, 5]: only spikes in these clusters are refitted, the others keep their labels
+            - n_comp is None: components start from the current clusters 2 and 5
+            - n_comp > len(clu_ids): re-split these spikes with a cold DPGMM of n_comp components
+
+        Passing n_comp for the whole group forces a cold DPGMM fit.
+        Only whole-group models are cached, any later edit of the clu (merge, move, delete,
+        a subset recluster ...) drops the cached model.
+        '''
+        if clu is None:
+            clu = self.clu[group_id]
+        fet = self.fet[group_id]
+        if group_id in self._watched and self._watched[group_id][0] is not clu:
+            self._drop_model(group_id)
+
+        if clu_ids is None:
+            model = self.models.get(group_id)
+            if model is not None and model.n_features_in_ == fet.shape[1] and n_comp is None:
+                model.set_params(warm_start=True, max_iter=max_iter)
+                labels = correct_label_order(model.fit(fet).predict(fet))
+            elif n_comp is None and clu.nclu > 1:
+                model = _gmm_from_labels(fet, clu.membership, clu.index_id, max_iter)
+                labels = clu.index_id[model.fit(fet).predict(fet)]
+            else:
+                n_comp = n_comp or self.dpgmm_hyper_param['max_n_clusters']
+                model = _dpgmm_estimator(n_comp, self.dpgmm_hyper_param['max_iter'])
+                labels = correct_label_order(model.fit(fet).predict(fet))
+            self.models[group_id] = model
+            global_idx = np.arange(fet.shape[0])
+        else:
+            clu_ids = np.unique(clu_ids)
+            global_idx = np.sort(np.hstack([clu[clu_id] for clu_id in clu_ids]))
+            X = fet[global_idx]
+            if n_comp is None or n_comp <= len(clu_ids):
+                model = _gmm_from_labels(X, clu.membership[global_idx], clu_ids, max_iter)
+                labels = clu_ids[model.fit(X).predict(X)]
+            else:
+                model = _dpgmm_estimator(n_comp, self.dpgmm_hyper_param['max_iter'])
+                _labels = correct_label_order(model.fit(X).predict(X))
+                # the biggest new cluster keeps the first id, the rest get new ids
+                _order = np.argsort(np.bincount(_labels))[::-1]
+                new_ids = np.append(clu_ids[0], np.arange(1, _order.shape[0]) + clu.max_clu_id)
+                labels = new_ids[np.argsort(_order)][_labels]
+
+        if clu_ids is None:
+            self._watch(group_id, clu)
+            self._reclustering = True
+        try:
+            clu.relabel(global_idx, labels)
+        finally:
+            self._reclustering = False
+        return model
+
+    def _watch(self, group_id, clu):
+        if group_id in self._watched and self._watched[group_id][0] is clu:
+            return
+        self._unwatch(group_id)
+        def on_cluster(*args, **kwargs):
+            if not self._reclustering:
+                self.models.pop(group_id, None)
+        def on_delete(*args, **kwargs):
+            if not self._reclustering:
+                self.models.pop(group_id, None)
+        self._watched[group_id] = (clu, [clu.connect(on_cluster), clu.connect(on_delete)])
+
+    def _unwatch(self, group_id):
+        if group_id in self._watched:
+            clu, handlers = self._watched.pop(group_id)
+            clu.unconnect(*handlers)
+
+    def _drop_model(self, group_id):
+        self.models.pop(group_id, None)
+        self._unwatch(group_id)
+
+    def disconnect(self):
+        '''
+        stop watching the clus of the cached models (the models are dropped)
+        '''
+        for g in list(self._watched):
+            self._drop_model(g)
+
     def reset(self):
         for g in self.group:
             self._reset(g)
@@ -195,18 +421,19 @@ class FET(object):
         assign global labels to each clu (fet.clu[group_id].membership_global)
         while return a look up table {group_id: {local_label:global_label}}
         '''
-        base = 0
-        global_label_lut = {} # a look up table {local label : global label} 
+        lut = self.global_label_lut
         for g in self.group:
-            label_dict = {}
-            old_labels = np.unique(self.clu[g].membership)
-            new_labels = np.unique(self.clu[g].membership) + base
-            base = max(max(new_labels), base)
-            new_labels[new_labels == new_labels.min()] = 0  # 0 won't change
-    #         print(g, new_labels)
-            for i, j in zip(old_labels, new_labels):
-                label_dict[i] = j
-            global_label_lut[g] = label_dict
-            # assign global labels
-            self.clu[g].membership_global = np.vectorize(label_dict.get)(self.clu[g].membership)
-        return global_label_lut
+            self.clu[g].membership_global = lut.to_global(g, self.clu[g].membership)
+        return lut.as_dict()
+
+    @property
+    def global_label_lut(self):
+        '''
+        persistent (group_id, clu_id) <-> global label table, see CLU.global_label_lut
+        '''
+        lut = getattr(self, '_global_label_lut', None)
+        if lut is None or lut.clu is not self.clu:
+            if lut is not None:
+                lut.disconnect()
+            self._global_label_lut = global_label_lut(self.clu, groups=self.group)
+        return self._global_label_lut
@@ -3,6 +3,7 @@ import numexpr as ne
 import pandas as pd
 from ..view import spike_view, scatter_3d_view
 from .FET import FET
+from .SpikeTable import spike_table, to_spike_table
 from ..utils.conf import info
 
 
@@ -350,23 +351,17 @@ class SPK():
     def to_spikedf(self, file=None):
         '''
         spike_df is a dataframe that each row is a spike packet (frame_id, group_id, fet0, fet1, fet2, fet3, spike_id)
-        sorted by timestamps
+        sorted by timestamps, `file` is written as a columnar spike table (see SpikeTable.py)
         '''
-        spk_matrix = np.array([]).reshape(-1, 7)
-        for g in self.fet.group:  # fet.group can be virtual groups (e.g., 0, 1, 2,... 38, 39)
-            if g in self.groups:  # must be also in the unique electrode groups
-                h = np.hstack((self.spk_time_dict[g].reshape(-1,1),              # spike frame_id (time stamps in #samples)
-                               self.spk_group_dict[g].reshape(-1,1),             # spike group_id (electrode group)
-                               self.fet[g][:,:4],                                # spike features (multichannel waveform 4d feature)
-                               self.fet.clu[g].membership_global.reshape(-1,1))) # spike spike_id (assigned unit id)
-                spk_matrix = np.append(spk_matrix, h, axis=0)
-
-        self.spike_df = pd.DataFrame(spk_matrix)
-        self.spike_df.columns = ['frame_id', 'group_id', 'fet0', 'fet1', 'fet2', 'fet3', 'spike_id']
-        self.spike_df = self.spike_df.sort_values('frame_id')
+        # fet.group can be virtual groups (e.g., 0, 1, 2,... 38, 39), must be also in the unique electrode groups
+        grps = [g for g in self.fet.group if g in self.groups]
+        self.spike_df = spike_table(frame_id = np.hstack([self.spk_time_dict[g] for g in grps]),              # spike frame_id (time stamps in #samples)
+                                    group_id = np.hstack([self.spk_group_dict[g] for g in grps]),             # spike group_id (electrode group)
+                                    fet      = np.vstack([self.fet[g][:,:4] for g in grps]),                  # spike features (multichannel waveform 4d feature)
+                                    spike_id = np.hstack([self.fet.clu[g].membership_global for g in grps]))  # spike spike_id (assigned unit id)
 
         if file is not None:
-            self.spike_df.to_pickle(file)
+            to_spike_table(self.spike_df, file)
 
         return self.spike_df
 
@@ -3,33 +3,17 @@ from .SPK import SPK
 from .FET import FET
 from .CLU import CLU
 from .CLU import status_manager
+from .CLU import global_label_lut
+from .SpikeTable import spike_table, to_spike_table, read_spike_table, _atomic_write
 import numpy as np
+import os
 import json
 import pickle
-import pandas as pd
-from numba import njit
-
-
-@njit(cache=True)
-def to_global_labels(grp_clu_matrix, cumsum_nclu):
-    '''
-    grp_clu_matrix: (N, 2) matrix, each row is a (grp_id, clu_id) pair
-    cumsum_nclu: (40,) vector, cumsum of model.nclus or spktag.nclus
-    '''
-    grp_clu_matrix = grp_clu_matrix.astype(np.int32)
-    N = grp_clu_matrix.shape[0]
-    labels = np.zeros((N,))
-    for i in range(N):
-        grp_id, clu_id = grp_clu_matrix[i]
-        if grp_id > 0:  # for each grp_id there is a base value
-            base = cumsum_nclu[grp_id - 1]
-        else:
-            base = 0
-        if clu_id > 0:  # for each label, we need to add the base
-            labels[i] = base + clu_id
-    return labels
 
 
+SPKTAG_VERSION = 2
+READONLY_FIELDS = ('t', 'spk')    # spike times and waveforms, fet and clu are edited
+
 
 class SPKTAG(object):
     def __init__(self, probe=None, spk=None, fet=None, clu=None, clu_manager=None, gtimes=None, filename=None):
@@ -41,6 +25,10 @@ class SPKTAG(object):
         gtimes      : dictionary of group with spike times
         '''
         self.probe = probe
+        self._dirty = set()
+        self._saved = None
+        self._partial = False   # loaded with only some of the groups of the file, see load
+        self._order = None      # record order of the groups of an unsorted version 1 file
         if filename is not None: # load from file
             self.fromfile(filename)
         elif gtimes is not None : # construct
@@ -59,9 +47,25 @@ class SPKTAG(object):
                             ('spk', 'f4', (self.spklen, self.grplen)), 
                             ('fet','f4',(self.fetlen,)),
                             ('clu','int32')]
+            self._watch()
         else:
             pass
 
+    def _watch(self):
+        '''
+        mark a group dirty whenever its clu is changed, see tofile
+        '''
+        for g, clu in self.clu.items():
+            if getattr(clu, '_spktag_watch', None) is self:
+                continue
+            clu._spktag_watch = self
+            def on_cluster(*args, _g=g, **kwargs):
+                self._dirty.add(_g)
+            def on_delete(*args, _g=g, **kwargs):
+                self._dirty.add(_g)
+            clu.connect(on_cluster)
+            clu.connect(on_delete)
+
     @property
     def nspk(self):
         return sum([len(v) for v in self.gtimes.values()])
@@ -74,6 +78,8 @@ class SPKTAG(object):
         meta["fetlen"] = self.fetlen
         meta["spklen"] = self.spklen
         meta["clu_statelist"] = self.clu_manager.state_list
+        meta["version"] = SPKTAG_VERSION
+        meta["grp_index"] = [[int(g), int(start), int(n)] for g, (start, n) in self.grp_index.items()]
         return meta
 
     def build_hdbscan_tree(self):
@@ -86,11 +92,16 @@ class SPKTAG(object):
         return treeinfo
 
     def build_spktag(self):
+        '''
+        records are sorted by group, self.grp_index[g] = (start, n) locates each group
+        '''
         spktag = np.zeros(self.nspk, dtype=self.dtype)
+        self.grp_index = {}
         start_index = 0
-        for g, times in self.gtimes.items():
+        for g, times in sorted(self.gtimes.items()):
             if times.shape[0] > 0:
                 end_index = start_index + len(times)
+                self.grp_index[g] = (start_index, len(times))
                 spktag['t'][start_index:end_index] = times
                 spktag['group'][start_index:end_index] = np.full((len(times)), g, dtype=np.int)
                 spktag['spk'][start_index:end_index] = self.spk[g]
@@ -101,41 +112,112 @@ class SPKTAG(object):
 
 
     def build_spkid_matrix(self, including_noise=False):
-        spkid_matrix = np.hstack((self.spktag['t'].reshape(-1,1), 
-                                  self.spktag['group'].reshape(-1,1), 
-                                  self.spktag['fet'], 
-                                  self.spktag['clu'].reshape(-1,1)))
+        grps = [g for g, times in sorted(self.gtimes.items()) if times.shape[0] > 0]
+        frame_id = np.hstack([self.gtimes[g] for g in grps])
+        group_id = np.hstack([np.full(len(self.gtimes[g]), g) for g in grps])
+        fet = np.vstack([self.fet[g][:,:4] for g in grps])
+        clu = np.hstack([self.clu[g].membership for g in grps])
         if including_noise is False:
-            spkid_matrix = spkid_matrix[spkid_matrix[:,-1]!=0]
-        grp_clu_matrix = spkid_matrix[:, [1,-1]]
-        global_labels = to_global_labels(grp_clu_matrix, self.nclus.cumsum())
-        spkid_matrix[:, -1] = global_labels
-        spkid_matrix = pd.DataFrame(spkid_matrix).sort_values(0, ascending=True)
-        spkid_matrix.columns = ['frame_id','group_id','fet0','fet1','fet2','fet3','spike_id']
-        spkid_matrix.index = np.arange(global_labels.shape[0])
-        return spkid_matrix
+            keep = clu != 0
+            frame_id, group_id, fet, clu = frame_id[keep], group_id[keep], fet[keep], clu[keep]
+        global_labels = self.lut.to_global(group_id, clu)
+        return spike_table(frame_id, group_id, fet, global_labels)
 
 
-    def update(self, spk, fet, clu, gtimes):
+    def update(self, spk, fet, clu, clu_manager, gtimes):
+        '''
+        rebind the model data, the dirty groups and last saved file are kept
+        '''
         self.spk = spk
         self.fet = fet
         self.clu = clu
+        self.clu_manager = clu_manager
         self.gtimes = gtimes
-        self.build_meta()
-        self.build_spktag()	
-        self.build_spkid_matrix()
+        self._watch()
+
+
+    def _snapshot(self):
+        '''
+        identity of the per-group data, a replaced fet or clu makes its group dirty 
+        '''
+        return {g: (id(self.fet[g]), id(self.clu[g])) for g in self.clu.keys()}
+
+
+    def _patchable(self, filename):
+        '''
+        the file can be updated in place when only labels or features changed,
+        the records of an unsorted version 1 file are rewritten sorted by group first
+        '''
+        if self._order is not None:
+            return False
+        if self._saved is None or self._saved[0] != os.path.abspath(filename) or not os.path.exists(filename):
+            return False
+        grp_index = self._saved[1]
+        grp_len = {g: len(times) for g, times in self.gtimes.items() if times.shape[0] > 0}
+        return grp_len == {g: n for g, (_, n) in grp_index.items()}
 
 
     def tofile(self, filename, including_noise=False):
+        '''
+        Groups changed since the last save (tracked from clu events) are rewritten 
+        in place through a journal, every other file is replaced by atomic rename.
+        A change of spike count in any group falls back to a full rewrite.
+        A spktag loaded with only some groups (load(filename, groups)) cannot be saved,
+        the file would lose every other group.
+        '''
+        if self._partial:
+            raise RuntimeError('spktag loaded with groups {} only, saving it would drop the other groups'.format(
+                               sorted(self.clu.keys())))
+        snapshot = self._snapshot()
+        if self._patchable(filename):
+            dirty = self._dirty | {g for g in snapshot if snapshot[g] != self._saved[2].get(g)}
+            self._patch(filename, sorted(dirty & set(self._saved[1])))
+        else:
+            dirty = set(self.clu.keys())
+            self.spktag = self.build_spktag()
+            _atomic_write(filename, self.spktag.tofile)   # numpy to file
+            self.spktag = np.memmap(filename, dtype=self.dtype, mode='r')
+            self._order = None
+
         self.meta = self.build_meta()
-        self.treeinfo = self.build_hdbscan_tree()
-        self.spktag = self.build_spktag()
-        self.spkid_matrix = self.build_spkid_matrix(including_noise=including_noise)
-        with open(filename+'.meta', 'w') as metafile:
-                json.dump(self.meta, metafile, indent=4)
-        np.save(filename+'.npy', self.treeinfo)
-        self.spktag.tofile(filename)   # numpy to file
-        self.spkid_matrix.to_pickle(filename+'.pd')  # pandas data frame
+        _atomic_write(filename+'.meta', lambda f: f.write(json.dumps(self.meta, indent=4).encode()))
+        if dirty:
+            self.treeinfo = self.build_hdbscan_tree()
+            _atomic_write(filename+'.npy', lambda f: np.save(f, self.treeinfo))
+            self.spkid_matrix = self.build_spkid_matrix(including_noise=including_noise)
+            to_spike_table(self.spkid_matrix, filename+'.spkdf')  # columnar spike table
+        self._dirty = set()
+        self._saved = (os.path.abspath(filename), dict(self.grp_index), snapshot)
+
+
+    def _patch(self, filename, groups):
+        '''
+        write fet and clu of `groups` into the spktag file in place,
+        the journal is replayed by fromfile if the writing is interrupted
+        '''
+        self.grp_index = self._saved[1]
+        if not groups:
+            return
+        journal = {}
+        for g in groups:
+            journal['fet_{}'.format(g)] = np.asarray(self.fet[g], dtype=np.float32)
+            journal['clu_{}'.format(g)] = np.asarray(self.clu[g].membership, dtype=np.int32)
+        journal['grp_index'] = np.array([[g, self.grp_index[g][0]] for g in groups])
+        _atomic_write(filename+'.journal', lambda f: np.savez(f, **journal))
+        self._replay_journal(filename)
+
+
+    def _replay_journal(self, filename):
+        journal = np.load(filename+'.journal')
+        spktag = np.memmap(filename, dtype=self.dtype, mode='r+')
+        for g, start in journal['grp_index']:
+            clu = journal['clu_{}'.format(g)]
+            spktag['fet'][start:start+len(clu)] = journal['fet_{}'.format(g)]
+            spktag['clu'][start:start+len(clu)] = clu
+        spktag.flush()
+        del spktag
+        journal.close()
+        os.remove(filename+'.journal')
 
 
     def fromfile(self, filename):
@@ -158,45 +240,86 @@ class SPKTAG(object):
                       ('spk', 'f4', (self.spklen, self.grplen)), 
                       ('fet', 'f4', (self.fetlen,)),
                       ('clu', 'int32')]
-        self.spktag = np.fromfile(filename, dtype=self.dtype)
+        # finish an interrupted incremental save
+        if os.path.exists(filename+'.journal'):
+            self._replay_journal(filename)
+
+        # memory-mapped, groups and fields are only read when requested
+        self.spktag = np.memmap(filename, dtype=self.dtype, mode='r')
+        if self.meta.get('version', 1) >= 2:
+            self._order = None
+            self.grp_index = {g: (start, n) for g, start, n in self.meta['grp_index']}
+        else:
+            self._build_grp_index()
         try:
-            self.spkid_matrix = pd.read_pickle(filename+'.pd')
+            if os.path.exists(filename+'.spkdf'):
+                self.spkid_matrix = read_spike_table(filename+'.spkdf')
+            else:
+                self.spkid_matrix = read_spike_table(filename+'.pd')
         except:
             pass
 
 
-    def tospk(self):
+    def _build_grp_index(self):
+        '''
+        version 1 files carry no grp_index, scan the group field once
+        '''
+        groups = np.asarray(self.spktag['group'])
+        if np.all(groups[1:] >= groups[:-1]):
+            self._order = None
+        else:
+            self._order = np.argsort(groups, kind='stable')
+            groups = groups[self._order]
+        grp_ids, starts, counts = np.unique(groups, return_index=True, return_counts=True)
+        self.grp_index = {int(g): (int(start), int(n)) for g, start, n in zip(grp_ids, starts, counts)}
+
+    def _groups(self, groups=None):
+        if groups is None:
+            return sorted(self.grp_index.keys())
+        return [g for g in np.atleast_1d(groups) if g in self.grp_index]
+
+    def read(self, group, field):
+        '''
+        one field of one group from the spktag file, the fields that are never edited
+        (READONLY_FIELDS) are read-only views of the memmap, the pages are only read when used
+        '''
+        start, n = self.grp_index[group]
+        if self._order is not None:
+            return self.spktag[field][self._order[start:start+n]]
+        if field in READONLY_FIELDS:
+            return self.spktag[field][start:start+n]
+        return np.array(self.spktag[field][start:start+n])
+
+    def tospk(self, groups=None):
         spkdict = {}
-        for g in self.gtimes.keys():
-            spkdict[g] = self.spktag['spk'][self.spktag['group']==g]
+        for g in self._groups(groups):
+            spkdict[g] = self.read(g, 'spk')
         self.spk = SPK(spkdict)
         return self.spk		
 
 
-    def tofet(self):
+    def tofet(self, groups=None):
         fetdict = {}
-        for g in self.gtimes.keys():
-            fetdict[g] = self.spktag['fet'][self.spktag['group']==g]
+        for g in self._groups(groups):
+            fetdict[g] = self.read(g, 'fet')
         self.fet = FET(fetdict)
         return self.fet		
 
 
-    def toclu(self):
+    def toclu(self, groups=None):
         cludict = {}
-        for g in self.gtimes.keys():
-            cludict[g] = CLU(self.spktag['clu'][self.spktag['group']==g], treeinfo=self.treeinfo[g])
+        for g in self._groups(groups):
+            cludict[g] = CLU(self.read(g, 'clu'), treeinfo=self.treeinfo[g])
             cludict[g]._id    = g
             cludict[g]._state = cludict[g].s[self.clu_statelist[g]]
         self.clu = cludict
         return self.clu
 
 
-    def to_gtimes(self):
-        times = self.spktag['t']
-        groups = self.spktag['group']
+    def to_gtimes(self, groups=None):
         gtimes = {}
-        for g in np.unique(groups):
-            gtimes[g] = times[np.where(groups == g)[0]]
+        for g in self._groups(groups):
+            gtimes[g] = self.read(g, 't')
         self.gtimes = gtimes
         return self.gtimes
 
@@ -214,13 +337,21 @@ class SPKTAG(object):
         self._nclus = np.array(self._nclus) - 1
         return self._nclus
 
+    @property
+    def lut(self):
+        '''
+        (group_id, clu_id) <-> global label table, updated on clu events
+        '''
+        lut = getattr(self, '_lut', None)
+        if lut is None or lut.clu is not self.clu:
+            if lut is not None:
+                lut.disconnect()
+            self._lut = global_label_lut(self.clu, groups=sorted(self.clu.keys()))
+        return self._lut
+
     def _get_label(self, grp_id, clu_id):
-        assert(clu_id<=self.nclus[grp_id]), "group {} contains only {} clusters".format(grp_id, self.nclus[grp_id])
-        if clu_id == 0:
-            return 0
-        else:
-            clu_offset = self.nclus.cumsum()[grp_id-1]
-            return clu_offset+clu_id
+        assert(clu_id<self.clu[grp_id].nclu), "group {} contains only {} clusters".format(grp_id, self.clu[grp_id].nclu-1)
+        return int(self.lut.to_global(grp_id, clu_id))
 
     def get_spk_times(self, group_id, cluster_id):
         '''
@@ -236,22 +367,30 @@ class SPKTAG(object):
         '''
         k = 0
         spk_time_dict = {}
-        for grp_No, grp_state in enumerate(self.clu_manager.state_list):
+        for grp_No, grp_state in zip(self.clu_manager.reporters.keys(), self.clu_manager.state_list):
             if grp_state == 3: # done state
                 for clu_No in range(1, self.clu[grp_No].nclu):
                     spk_time_dict[k] = self.get_spk_times(grp_No, clu_No)
                     k+=1
         return spk_time_dict
 
-    def load(self, filename):
+    def load(self, filename, groups=None):
+        '''
+        groups: only materialize these groups (default all), 
+                a partially loaded spktag is for reading, tofile refuses to save it
+        '''
         self.fromfile(filename)
-        self.gtimes = self.to_gtimes()
-        self.spk = self.tospk()
-        self.fet = self.tofet()
-        self.clu = self.toclu()
+        self._partial = groups is not None and set(self._groups(groups)) != set(self.grp_index)
+        self.gtimes = self.to_gtimes(groups)
+        self.spk = self.tospk(groups)
+        self.fet = self.tofet(groups)
+        self.clu = self.toclu(groups)
         self.clu_manager = status_manager()
         for _clu in self.clu.values():
             self.clu_manager.append(_clu)
+        self._watch()
+        self._dirty = set()
+        self._saved = (os.path.abspath(filename), dict(self.grp_index), self._snapshot())
         self.spk_time_dict = self.get_spk_time_dict()
         self.spk_time_array = np.array(list(self.spk_time_dict.values()))
         self.n_units = len(self.spk_time_dict)
@@ -0,0 +1,100 @@
+'''
+A spike table is the sorted spike packets (frame_id, group_id, fet0..fetn, spike_id)
+stored column by column:
+
+    filename        every column is a contiguous typed array at its own (aligned) offset
+    filename.json   schema: nrows and (name, dtype, offset) of every column
+
+It replaces the pickled pandas dataframe (.pd) written by earlier versions,
+a file without a schema is still read as a pickle.
+'''
+
+import os
+import json
+import numpy as np
+import pandas as pd
+
+
+SPIKE_TABLE_VERSION = 1
+_ALIGN = 64
+
+
+def _atomic_write(filename, write):
+    '''
+    write(f) into a temporary file, then rename it over filename
+    '''
+    tmp = filename + '.tmp'
+    with open(tmp, 'wb') as f:
+        write(f)
+        f.flush()
+        os.fsync(f.fileno())
+    os.replace(tmp, filename)
+
+
+def spike_table(frame_id, group_id, fet, spike_id):
+    '''
+    build the spike table (sorted by frame_id) in one vectorized pass
+
+    frame_id, group_id, spike_id: (N,) arrays
+    fet: (N, fetlen) array
+    '''
+    order = np.argsort(frame_id, kind='stable')
+    df = pd.DataFrame({'frame_id': np.asarray(frame_id, dtype=np.int64)[order],
+                       'group_id': np.asarray(group_id, dtype=np.int32)[order]})
+    fet = np.asarray(fet, dtype=np.float32)[order]
+    for i in range(fet.shape[1]):
+        df['fet{}'.format(i)] = fet[:, i]
+    df['spike_id'] = np.asarray(spike_id, dtype=np.int32)[order]
+    return df
+
+
+def to_spike_table(df, filename):
+    '''
+    write a dataframe as a spike table (see module doc)
+    '''
+    columns, offset = [], 0
+    for name in df.columns:
+        col = np.ascontiguousarray(df[name].to_numpy())
+        offset = -(-offset // _ALIGN) * _ALIGN
+        columns.append((name, col, offset))
+        offset += col.nbytes
+
+    def write(f):
+        for _, col, offset in columns:
+            f.seek(offset)
+            f.write(col.tobytes())
+
+    schema = {'version': SPIKE_TABLE_VERSION,
+              'nrows': len(df),
+              'columns': [{'name': name, 'dtype': col.dtype.str, 'offset': offset}
+                          for name, col, offset in columns]}
+    _atomic_write(filename, write)
+    _atomic_write(filename+'.json', lambda f: f.write(json.dumps(schema, indent=4).encode()))
+
+
+def open_spike_table(filename):
+    '''
+    memory-map every column of a spike table, nothing is read until used
+    return: {name: np.memmap}
+    '''
+    with open(filename+'.json', 'r') as schemafile:
+        schema = json.load(schemafile)
+    nrows = schema['nrows']
+    if nrows == 0:
+        return {c['name']: np.zeros(0, dtype=c['dtype']) for c in schema['columns']}
+    return {c['name']: np.memmap(filename, dtype=c['dtype'], mode='r', offset=c['offset'], shape=(nrows,))
+            for c in schema['columns']}
+
+
+def read_spike_table(filename, columns=None):
+    '''
+    load a spike table (or a legacy .pd pickle) into a pandas dataframe
+    columns: only load these columns (default all)
+    '''
+    if not os.path.exists(filename+'.json'):
+        df = pd.read_pickle(filename)
+        return df if columns is None else df[columns]
+    table = open_spike_table(filename)
+    if columns is None:
+        columns = list(table.keys())
+    return pd.DataFrame({name: np.array(table[name]) for name in columns})
@@ -4,6 +4,7 @@ from sympy import binomial_coefficients
 from .SPK import SPK
 from .FET import FET
 from .CLU import CLU
+from .SpikeTable import read_spike_table
 from ..view import scatter_3d_view, grid_scatter3d, raster_view
 
 
@@ -47,7 +48,7 @@ class UNIT(object):
 
     def load_unitpacket(self, filename, n_items=8):
         '''
-        1. pd dataframe
+        1. spike table (.spkdf) or pd dataframe (.pd)
         2. fet.bin
 
         Both follows table structure:
@@ -58,8 +59,8 @@ class UNIT(object):
         ['time', 'group_id', 'fet0', 'fet1', 'fet2', 'fet3', 'spike_id', 'mean_spk_range']
         '''
         self.filename = filename
-        if filename.split('.')[-1]=='pd':
-            self.df = pd.read_pickle(filename)
+        if filename.split('.')[-1] in ('pd', 'spkdf'):
+            self.df = read_spike_table(filename)
             self.df['frame_id'] /= self.sampling_rate
             self.df.rename(columns={'frame_id':'time'}, inplace=True)
             self.df['group_id'] = self.df['group_id'].astype('int')
@@ -1,9 +1,10 @@
 from .MUA import MUA
 from .SPK import SPK
-from .FET import FET
-from .CLU import CLU, status_manager
+from .FET import FET, stream_cluster
+from .CLU import CLU, status_manager, global_label_lut, unit_spike_index
 from .UNIT import UNIT
 from .SPKTAG import SPKTAG
+from .SpikeTable import spike_table, to_spike_table, read_spike_table
 from .Binload import fs2t, bload
 from .Probe import probe
 import numpy as np
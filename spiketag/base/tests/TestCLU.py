@@ -2,7 +2,7 @@
 # sys.path.append('../../../')
 import unittest
 import numpy as np
-from spiketag.base import CLU
+from spiketag.base import CLU, global_label_lut, unit_spike_index
 
 class TestCLU(unittest.TestCase):
     
@@ -95,7 +95,85 @@ class TestCLU(unittest.TestCase):
         
         self.setUp()
 
-      
+    def test_relabel_and_undo(self):
+        '''
+            relabel spikes [1,4] from clu 1 to clu 3, then undo
+        '''
+        self.clu.relabel(np.array([1,4]), 3)
+        expected_index = {0:[0,5,6,11],1:[8,9],2:[2,3,7,10],3:[1,4]}
+        self.assertDictEqual(self._array2list(self.clu.index),expected_index)
+        self.clu.undo()
+        expected_index = {0:[0,5,6,11],1:[1,4,8,9],2:[2,3,7,10]}
+        self.assertDictEqual(self._array2list(self.clu.index),expected_index)
+
+    def test_relabel_empty_clu0(self):
+        '''
+            relabel all spikes of clu 0 to clu 2, the ids shift down to 0,1
+        '''
+        self.clu.relabel(np.array([0,5,6,11]), 2)
+        expected_index = {0:[1,4,8,9],1:[0,2,3,5,6,7,10,11]}
+        self.assertDictEqual(self._array2list(self.clu.index),expected_index)
+        self.assertListEqual(list(self.clu.index_id), [0,1])
+
+    def test_global_label_lut(self):
+        '''
+            group 0: clu 1,2 -> 1,2; group 1: clu 1 -> 3
+        '''
+        clu1 = CLU(np.array([0,1,1,0]))
+        lut = global_label_lut({0:self.clu, 1:clu1})
+        self.assertListEqual(list(lut.to_global(1, clu1.membership)), [0,3,3,0])
+        self.assertListEqual(list(lut.to_global(np.array([0,0,1]), np.array([0,2,1]))), [0,2,3])
+        g, clu_id, idx = lut.locate(3)
+        self.assertEqual((g, clu_id), (1, 1))
+        self.assertListEqual(list(idx), [1,2])
+        self.clu.relabel(np.array([0]), 3)      # group 0 gets a 3rd cluster
+        self.assertListEqual(list(lut.to_global(1, clu1.membership)), [0,4,4,0])
+
+    def test_global_label_lut_replaced_clu(self):
+        '''
+            a replaced clu is unconnected and the table follows the new one
+        '''
+        callbacks = lambda clu: sum(len(v) for v in clu._callbacks.values())
+        clus = {0:self.clu, 1:CLU(np.array([0,1,1,0]))}
+        lut = global_label_lut(clus)
+        self.assertEqual(lut.n_units, 3)
+        self.assertEqual(callbacks(self.clu), 2)
+        clus[0] = CLU(np.array([0,1,2,3]))
+        self.assertEqual(lut.n_units, 4)
+        self.assertEqual(callbacks(self.clu), 0)
+        lut.disconnect()
+        self.assertEqual(callbacks(clus[0]), 0)
+
+    def test_unit_spike_index(self):
+        '''
+            group 0: clu 1,2 -> unit 0,1; group 1: clu 1 -> unit 2
+        '''
+        clu1 = CLU(np.array([0,1,1,0]))
+        times = {0: np.arange(12)*10., 1: np.arange(4)*100.}
+        index = unit_spike_index({0:self.clu, 1:clu1}, times, fs=10., groups=[0, 1])
+        self.assertEqual(index.n_units, 3)
+        self.assertListEqual(list(index[0]), [1.,4.,8.,9.])
+        self.assertListEqual(list(index[2]), [10.,20.])
+        self.assertListEqual(index.units.tolist(), [[0,1],[0,2],[1,1]])
+        version = index.version
+        self.clu.relabel(np.array([0]), 3)      # group 0 gets a 3rd cluster
+        self.assertEqual(index.n_units, 4)
+        self.assertListEqual(list(index[2]), [0.])
+        self.assertGreater(index.version, version)
+        self.assertListEqual(list(index.group_times(1)[0]), [0.,30.])
+        index.groups = [1]
+        self.assertListEqual(list(index[0]), [10.,20.])
+        callbacks = lambda clu: sum(len(v) for v in clu._callbacks.values())
+        clus = index.clu
+        old = clus[1]
+        clus[1] = CLU(np.array([1,1,0,0]))
+        self.assertListEqual(list(index[0]), [0.,10.])
+        self.assertEqual(callbacks(old), 0)
+        self.assertEqual(callbacks(clus[1]), 2)
+        index.disconnect()
+        self.assertEqual(callbacks(clus[1]), 0)
+
+
     '''
         Private methond
     '''
@@ -0,0 +1,87 @@
+# import sys
+# sys.path.append('../../../')
+import unittest
+import numpy as np
+from spiketag.base import FET, CLU
+
+class TestFET(unittest.TestCase):
+
+    def setUp(self):
+        '''
+            group 0: 3 blobs A, B, C of 200 spikes; clu 1 is A+B, clu 2 is C, 20 noise spikes
+        '''
+        rng = np.random.RandomState(0)
+        centers = np.array([[0, 0, 0, 0], [4, 0, 0, 0], [0, 4, 0, 0], [0, 0, 4, 4]], dtype=np.float32)
+        self.blob = np.repeat(np.arange(4), [20, 200, 200, 200])
+        fet = centers[self.blob] + rng.normal(0, 0.3, (620, 4)).astype(np.float32)
+        self.fet = FET({0: fet})
+        self.fet.clu[0] = CLU(np.array([0, 1, 1, 2])[self.blob])
+
+    '''
+       Test Cases
+    '''
+    def test_recluster_subset(self):
+        '''
+            re-split clu 1 into 2 clusters, clu 0 and 2 keep their spikes
+        '''
+        clu = self.fet.clu[0]
+        before = clu.membership.copy()
+        self.fet.recluster(0, clu_ids=[1], n_comp=2)
+        untouched = before != 1
+        self.assertTrue(np.array_equal(clu.membership[untouched], before[untouched]))
+        self.assertEqual(clu.nclu, 4)
+        # A and B end up in one cluster each, 1 (the biggest keeps the id) and the new 3
+        self.assertEqual(np.unique(clu.membership[self.blob == 1]).shape[0], 1)
+        self.assertEqual(np.unique(clu.membership[self.blob == 2]).shape[0], 1)
+        self.assertListEqual(sorted(np.unique(clu.membership[before == 1])), [1, 3])
+        clu.undo()
+        self.assertTrue(np.array_equal(clu.membership, before))
+
+    def test_recluster_from_labels(self):
+        '''
+            refit of the whole group starting from the current clusters keeps them, the model is cached
+        '''
+        clu = self.fet.clu[0]
+        clu.membership = np.array([0, 1, 2, 3])[self.blob]
+        clu.__construct__()
+        before = clu.membership.copy()
+        model = self.fet.recluster(0)
+        self.assertIs(self.fet.models[0], model)
+        self.assertGreater(np.mean(clu.membership == before), 0.95)
+
+    def test_recluster_model_dropped_on_edit(self):
+        '''
+            the cached model survives its own relabel, but not a user edit or a subset recluster
+        '''
+        clu = self.fet.clu[0]
+        model = self.fet.recluster(0)
+        self.assertIs(self.fet.recluster(0), model)
+        clu.merge([1, 2])
+        self.assertNotIn(0, self.fet.models)
+        self.fet.recluster(0)
+        self.fet.recluster(0, clu_ids=[1], n_comp=2)
+        self.assertNotIn(0, self.fet.models)
+        # a replaced clu is no longer watched
+        self.fet.recluster(0)
+        self.fet.clu[0] = CLU(np.array([0, 1, 1, 2])[self.blob])
+        self.fet.recluster(0)
+        self.assertEqual(sum(len(v) for v in clu._callbacks.values()), 0)
+        self.fet.disconnect()
+        self.assertEqual(sum(len(v) for v in self.fet.clu[0]._callbacks.values()), 0)
+
+    def test_global_label_lut_replaced_clu(self):
+        '''
+            the lut follows a replaced clu dict and stops watching the old one
+        '''
+        lut = self.fet.global_label_lut
+        old = self.fet.clu[0]
+        self.assertListEqual(list(np.unique(lut.to_global(0, old.membership))), [0, 1, 2])
+        self.fet.clu = {0: CLU(np.array([0, 1, 2, 3])[self.blob])}
+        new_lut = self.fet.global_label_lut
+        self.assertIsNot(new_lut, lut)
+        self.assertListEqual(list(np.unique(new_lut.to_global(0, self.fet.clu[0].membership))), [0, 1, 2, 3])
+        self.assertEqual(sum(len(v) for v in old._callbacks.values()), 0)
+
+
+if __name__ == "__main__":
+    unittest.main()
@@ -0,0 +1,126 @@
+# import sys
+# sys.path.append('../../../')
+import os
+import json
+import shutil
+import tempfile
+import unittest
+import numpy as np
+from types import SimpleNamespace
+from spiketag.base import SPK, FET, CLU, SPKTAG, status_manager
+
+class TestSPKTAG(unittest.TestCase):
+
+    def setUp(self):
+        '''
+            3 groups of 30, 20 and 10 spikes with 3 clusters each, saved in full to spktag.bin
+        '''
+        rng = np.random.RandomState(0)
+        self.folder = tempfile.mkdtemp()
+        self.filename = os.path.join(self.folder, 'spktag.bin')
+        self.probe = probe = SimpleNamespace(fs=25000., group_len=4, grp_dict={0: None, 1: None, 2: None})
+        nspk = {0: 30, 1: 20, 2: 10}
+        gtimes = {g: np.sort(rng.randint(0, 10**6, n)).astype(np.int32) for g, n in nspk.items()}
+        spk = SPK({g: rng.normal(0, 1, (n, 19, 4)).astype(np.float32) for g, n in nspk.items()})
+        fet = FET({g: rng.normal(0, 1, (n, 4)).astype(np.float32) for g, n in nspk.items()})
+        clu_manager = status_manager()
+        clu = {}
+        for g, n in nspk.items():
+            clu[g] = CLU(np.arange(n) % 3)
+            clu[g]._id = g
+            clu_manager.append(clu[g])
+        self.spktag = SPKTAG(probe, spk, fet, clu, clu_manager, gtimes)
+        self.spktag.tofile(self.filename)
+
+    def tearDown(self):
+        shutil.rmtree(self.folder)
+
+    def _load(self, groups=None):
+        spktag = SPKTAG(probe=self.probe)
+        spktag.load(self.filename, groups)
+        return spktag
+
+    def _assertGroupsEqual(self, spktag, expected):
+        for g in expected.gtimes:
+            self.assertTrue(np.array_equal(spktag.gtimes[g], expected.gtimes[g]))
+            self.assertTrue(np.array_equal(spktag.fet[g], expected.fet[g]))
+            self.assertTrue(np.array_equal(spktag.clu[g].membership, expected.clu[g].membership))
+            self.assertTrue(np.allclose(spktag.spk[g], expected.spk[g]))
+
+    '''
+       Test Cases
+    '''
+    def test_full_save(self):
+        self._assertGroupsEqual(self._load(), self.spktag)
+        self.assertTrue(os.path.exists(self.filename+'.spkdf'))
+
+    def test_load_views(self):
+        '''
+            the waveforms and times stay on the file, fet and clu are loaded to be edited
+        '''
+        spktag = self._load()
+        self.assertIsInstance(spktag.spk[0], np.memmap)
+        self.assertFalse(spktag.spk[0].flags.writeable)
+        self.assertFalse(spktag.gtimes[0].flags.writeable)
+        self.assertTrue(spktag.fet[0].flags.writeable)
+        self.assertTrue(spktag.clu[0].membership.flags.writeable)
+
+    def test_patch_save(self):
+        '''
+            a label edit is written in place, the spike table follows it
+        '''
+        spktag = self._load()
+        spktag.clu[1].fill(np.array([0, 3, 6]), 2)
+        self.assertTrue(spktag._patchable(self.filename))
+        spktag.tofile(self.filename)
+        self.assertFalse(os.path.exists(self.filename+'.journal'))
+        loaded = self._load()
+        self._assertGroupsEqual(loaded, spktag)
+        self.assertEqual(len(loaded.spkid_matrix), sum((spktag.clu[g].membership != 0).sum() for g in spktag.clu))
+
+    def test_journal_replay(self):
+        '''
+            a patch interrupted after the journal is written is finished by the next load
+        '''
+        spktag = self._load()
+        spktag.clu[2].fill(np.array([0, 3]), 1)
+        spktag._replay_journal = lambda filename: None
+        spktag.tofile(self.filename)
+        self.assertTrue(os.path.exists(self.filename+'.journal'))
+        self._assertGroupsEqual(self._load(), spktag)
+        self.assertFalse(os.path.exists(self.filename+'.journal'))
+
+    def test_unsorted_v1_save(self):
+        '''
+            records of a version 1 file interleaved across groups are rewritten sorted by group
+        '''
+        records = np.fromfile(self.filename, dtype=self._load().dtype)
+        order = np.argsort(np.hstack([np.arange(n) for n in (30, 20, 10)]), kind='stable')
+        records[order].tofile(self.filename)
+        with open(self.filename+'.meta') as f:
+            meta = json.load(f)
+        del meta['version'], meta['grp_index']
+        with open(self.filename+'.meta', 'w') as f:
+            json.dump(meta, f)
+        spktag = self._load()
+        self.assertIsNotNone(spktag._order)
+        self._assertGroupsEqual(spktag, self.spktag)
+        spktag.clu[1].fill(np.array([0, 3, 6]), 2)
+        self.assertFalse(spktag._patchable(self.filename))
+        spktag.tofile(self.filename)
+        loaded = self._load()
+        self.assertIsNone(loaded._order)
+        self._assertGroupsEqual(loaded, spktag)
+
+    def test_partial_load_is_not_saved(self):
+        spktag = self._load(groups=[0, 1])
+        self.assertListEqual(sorted(spktag.clu.keys()), [0, 1])
+        spktag.clu[0].fill(np.array([0]), 2)
+        with self.assertRaises(RuntimeError):
+            spktag.tofile(self.filename)
+        self._assertGroupsEqual(self._load(), self.spktag)
+        self.assertFalse(self._load(groups=[0, 1, 2])._partial)
+
+
+if __name__ == "__main__":
+    unittest.main()
@@ -0,0 +1,54 @@
+# import sys
+# sys.path.append('../../../')
+import os
+import shutil
+import tempfile
+import unittest
+import numpy as np
+from spiketag.base import stream_cluster
+
+class TestStreamCluster(unittest.TestCase):
+
+    def setUp(self):
+        '''
+            fet.bin of 3 groups interleaved in time: group 0 and 2 have 900 spikes in 3 blobs,
+            group 5 has 2 spikes (less than n_comp, never fitted)
+        '''
+        rng = np.random.RandomState(0)
+        self.folder = tempfile.mkdtemp()
+        self.filename = os.path.join(self.folder, 'fet.bin')
+        centers = np.array([[0, 0, 0, 0], [1, 0, 0, 0], [0, 1, 0, 0]])
+        grp_ids = np.hstack((np.repeat([0, 2], 900), np.full(2, 5)))
+        rng.shuffle(grp_ids)
+        packets = np.zeros((grp_ids.shape[0], 8), dtype=np.int32)
+        packets[:, 0] = np.arange(grp_ids.shape[0]) * 10
+        packets[:, 1] = grp_ids
+        fet = centers[rng.randint(0, 3, grp_ids.shape[0])] + rng.normal(0, 0.05, (grp_ids.shape[0], 4))
+        packets[:, 2:6] = (fet * 2**13).astype(np.int32)
+        packets[:, 6] = np.arange(grp_ids.shape[0])
+        packets.tofile(self.filename)
+        self.grp_ids = grp_ids
+
+    def tearDown(self):
+        shutil.rmtree(self.folder)
+
+    '''
+       Test Cases
+    '''
+    def test_fit_predict(self):
+        sc = stream_cluster(self.filename, n_items=8, n_comp=3, chunk_size=256, batch_size=64, n_jobs=2)
+        sc.fit()
+        self.assertDictEqual(sc.offset, {0: 0, 2: 3})
+        label_file = os.path.join(self.folder, 'labels.bin')
+        sc.predict(label_file)
+        labels = np.fromfile(label_file, dtype=np.int32)
+        self.assertEqual(labels.shape[0], self.grp_ids.shape[0])
+        self.assertTrue((labels[self.grp_ids == 5] == 0).all())
+        self.assertListEqual(sorted(np.unique(labels[self.grp_ids == 0])), [1, 2, 3])
+        self.assertListEqual(sorted(np.unique(labels[self.grp_ids == 2])), [4, 5, 6])
+        # in memory labels are the same
+        self.assertTrue(np.array_equal(sc.predict(), labels))
+
+
+if __name__ == "__main__":
+    unittest.main()
@@ -250,7 +250,7 @@ def auto_compile(probefile):
     ctrl.clusterless_sort(method='dpgmm', N=20, minimum_spks=3000)
     ctrl.compile(status='ready')
     ctrl.save()
-    ctrl.model.pc.load_spkdf('./spktag/dpgmm_sort.pd')
+    ctrl.model.pc.load_spkdf('./spktag/dpgmm_sort.spkdf')
     # ctrl.model.pc.kernlen = 9
     # ctrl.model.pc.kernstd = 2.5
     # ctrl.model.pc.get_fields()
@@ -1,3 +1,6 @@
 from .correlate import correlate, CCG
 from .convolve import convolve
 from .vq_knn import VQ_KNN
+from .similarity import cluster_similarity
+from .codebook import build_codebooks
+from .noise import spike_noise
@@ -0,0 +1,238 @@
+#--------------------------------------------------------------
+# VQ codebooks of the FPGA classifier for a whole probe
+#--------------------------------------------------------------
+import os
+import numpy as np
+from functools import partial
+from numba import njit
+from concurrent.futures import ProcessPoolExecutor, ThreadPoolExecutor
+
+
+def n_vq_per_clu(nspks_per_clu, N=500, method='proportional'):
+    '''
+    split the codebook budget N over the clusters of one group
+    proportional: every cluster gets min(#spikes, N/nclu) points
+    equal:        every cluster gets N/nclu points (the last one takes the rounding error)
+    '''
+    nspks_per_clu = np.asarray(nspks_per_clu)
+    nclu = nspks_per_clu.shape[0]
+    if method == 'proportional':
+        avg_nvq = N / nclu
+        n_vq = np.minimum(nspks_per_clu, avg_nvq).astype(np.int64)
+    elif method == 'equal':
+        n_vq = np.ones((nclu,), dtype=np.int64) * int(N / nclu)
+        n_vq[-1] -= n_vq.sum() - N
+    else:
+        raise ValueError("method should be 'proportional' or 'equal'")
+    n_vq = np.maximum(np.minimum(n_vq, nspks_per_clu), 1)
+    assert(n_vq.sum() <= N)
+    return n_vq
+
+
+def _fit_codebook(X, n_vq, random_state=0):
+    '''
+    codebook of one cluster: n_vq kmeans centers of X (runs in a worker process)
+    '''
+    import warnings
+    from sklearn.cluster import MiniBatchKMeans
+    warnings.filterwarnings('ignore')
+    if n_vq >= X.shape[0]:
+        return X[:n_vq].astype(np.float32)
+    km = MiniBatchKMeans(n_vq, random_state=random_state)
+    km.fit(X)
+    return km.cluster_centers_.astype(np.float32)
+
+
+@njit(cache=True, nogil=True, fastmath=True)
+def _nearest(Q, R, idx, d2):
+    '''
+    brute force 1-NN of every row of Q in R (releases the GIL, so chunks of Q run in parallel threads)
+    '''
+    for i in range(Q.shape[0]):
+        best, best_j = np.float32(np.inf), 0
+        for j in range(R.shape[0]):
+            d = np.float32(0.)
+            for k in range(Q.shape[1]):
+                t = Q[i, k] - R[j, k]
+                d += t * t
+            if d < best:
+                best, best_j = d, j
+        idx[i] = best_j
+        d2[i] = best
+
+
+def nearest(Q, R, chunk=2**16, n_threads=None):
+    '''
+    index of the nearest row of R (euclidean) for every row of Q
+    Q is read `chunk` rows at a time (so Q can be a memmap of millions of spikes),
+    the chunks are searched by n_threads threads (None: all cores)
+    return (idx, d2): (len(Q),) indices into R and squared distances
+    '''
+    R = np.ascontiguousarray(R, dtype=np.float32)
+    idx = np.zeros((Q.shape[0],), dtype=np.int64)
+    d2  = np.zeros((Q.shape[0],), dtype=np.float32)
+    def search(i):
+        _nearest(np.ascontiguousarray(Q[i:i+chunk], dtype=np.float32), R, idx[i:i+chunk], d2[i:i+chunk])
+    starts = range(0, Q.shape[0], chunk)
+    n_threads = os.cpu_count() if n_threads is None else n_threads
+    if n_threads > 1 and len(starts) > 1:
+        with ThreadPoolExecutor(max_workers=n_threads) as pool:
+            list(pool.map(search, starts))
+    else:
+        for i in starts:
+            search(i)
+    return idx, d2
+
+
+def fixed_point(points, binpoint=7):
+    '''
+    the codebook as the FPGA holds it: int8 fixed point with `binpoint` fractional bits (see fpga pack_int8x4),
+    points out of the int8 range are clipped to it
+    '''
+    q = np.clip(np.floor(np.asarray(points, dtype=np.float64) * 2**binpoint), -128, 127)
+    return (q / 2**binpoint).astype(np.float32)
+
+
+def evaluate(X, y, points, labels, chunk=2**18):
+    '''
+    realtime (FPGA) decision of a codebook: every spike takes the label of its nearest point
+    return (accuracy, errors): errors[i] is #spikes of y==i labelled wrongly
+    '''
+    y = np.asarray(y)
+    pred = np.asarray(labels)[nearest(X, points, chunk)[0]]
+    errors = np.bincount(y[pred != y], minlength=y.max()+1)
+    return np.mean(pred == y), errors
+
+
+def refine_codebook(X, y, points, labels, n_epochs=20, size=None, lr=0.05, batch_size=4096, n_swap=10, random_state=0,
+                    binpoint=7):
+    '''
+    LVQ refinement of a codebook for the 1-NN decision
+    size: grow the codebook to `size` points (e.g. the unused part of the 500 points budget),
+          the new points start on misclassified spikes
+
+    every epoch:
+    1. budget: up to n_swap points that win no spike (or the least useful ones) are moved onto
+       misclassified spikes, so the clusters with more errors get more points. 
+       The last point of a label is never moved (every cluster can still be predicted)
+    2. batch LVQ1: the nearest point of every spike moves toward it if their labels agree, away otherwise,
+       the step of a point is averaged over its batch and lr decays linearly to 0.
+       The points are clipped to the int8 fixed point range of the FPGA (binpoint)
+
+    the codebooks are scored as the FPGA holds them (see fixed_point)
+    return (points, labels, accuracy) of the best epoch, the input codebook if nothing improved it,
+    the points are fixed_point(points, binpoint)
+    '''
+    rng = np.random.RandomState(random_state)
+    lo, hi = -128 / 2**binpoint, 127 / 2**binpoint
+    X = np.asarray(X, dtype=np.float32)
+    y = np.asarray(y)
+    points = np.clip(np.array(points, dtype=np.float32), lo, hi)
+    labels = np.array(labels)
+    best = (fixed_point(points, binpoint), labels.copy(), evaluate(X, y, fixed_point(points, binpoint), labels)[0])
+    if size is not None and size > points.shape[0]:
+        wrong = np.where(labels[nearest(X, points)[0]] != y)[0]
+        candidates = wrong if wrong.shape[0] > 0 else np.arange(X.shape[0])
+        take = rng.choice(candidates, size - points.shape[0], replace=candidates.shape[0] < size - points.shape[0])
+        points, labels = np.vstack((points, X[take])), np.concatenate((labels, y[take]))
+    n = points.shape[0]
+    for epoch in range(n_epochs):
+        idx = nearest(X, points)[0]
+        wrong = labels[idx] != y
+        if wrong.any():
+            # usefulness of a point: spikes it labels correctly minus spikes it labels wrongly
+            gain = np.bincount(idx[~wrong], minlength=n) - np.bincount(idx[wrong], minlength=n)
+            npoints = dict(zip(*np.unique(labels, return_counts=True)))
+            drop = []
+            for k in np.argsort(gain, kind='stable'):
+                if len(drop) == min(n_swap, wrong.sum()) or gain[k] > 0:
+                    break
+                if npoints[labels[k]] > 1:
+                    npoints[labels[k]] -= 1
+                    drop.append(k)
+            drop = np.array(drop, dtype=np.int64)
+            take = rng.choice(np.where(wrong)[0], drop.shape[0], replace=False)
+            points[drop], labels[drop] = X[take], y[take]
+
+        step = lr * (1 - epoch / n_epochs)
+        order = rng.permutation(X.shape[0])
+        for start in range(0, X.shape[0], batch_size):
+            batch = order[start:start+batch_size]
+            xb, yb = X[batch], y[batch]
+            k = nearest(xb, points)[0]
+            sign = np.where(labels[k] == yb, 1., -1.).astype(np.float32)
+            delta = np.zeros_like(points)
+            np.add.at(delta, k, sign[:, None] * (xb - points[k]))
+            count = np.bincount(k, minlength=n)[:, None]
+            points += step * delta / np.maximum(count, 1)
+            np.clip(points, lo, hi, out=points)
+
+        quantized = fixed_point(points, binpoint)
+        accuracy = evaluate(X, y, quantized, labels)[0]
+        if accuracy > best[2]:
+            best = (quantized, labels.copy(), accuracy)
+    return best
+
+
+def _map(func, args, n_jobs):
+    '''
+    [func(*a) for a in args] over a process pool of n_jobs (in this process if n_jobs is 1)
+    '''
+    if n_jobs > 1 and len(args) > 1:
+        with ProcessPoolExecutor(max_workers=min(n_jobs, len(args))) as pool:
+            futures = [pool.submit(func, *a) for a in args]
+            return [f.result() for f in futures]
+    return [func(*a) for a in args]
+
+
+def build_codebooks(fet, membership, groups=None, N=500, n_dim=4, method='proportional', n_vq=None, 
+                    refine_epochs=0, n_jobs=None, binpoint=7):
+    '''
+    VQ codebooks of many groups at once, ready for the FPGA (vq_hash, label_hash)
+
+    fet:        {group_id: (N, ndim) transformed features}
+    membership: {group_id: (N,) cluster labels, 0 is noise}
+    n_vq:       {group_id: points of every cluster}, default from `method` (see n_vq_per_clu)
+    refine_epochs: if > 0, refine every codebook for the 1-NN decision and grow it to N points (see refine_codebook)
+    n_jobs:     processes to fit the per-(group, cluster) kmeans, None for all cores, 1 to fit in this process
+    binpoint:   the codebooks are int8 fixed point with binpoint fractional bits on the FPGA (see fixed_point)
+
+    return {'groups':   (G,) group ids
+            'points':   (G, N, n_dim) float32 codebooks, zero padded
+            'labels':   (G, N) int32 cluster label of every point (label of its nearest spike), zero padded
+            'n_points': (G,) number of points used in every codebook
+            'scores':   (G,) 1-NN accuracy of the fixed point codebook on all spikes of the group}
+    '''
+    groups = np.array(sorted(fet.keys()) if groups is None else groups, dtype=np.int64)
+    X = {g: np.asarray(fet[g][:, :n_dim], dtype=np.float32) for g in groups}
+    y = {g: np.asarray(membership[g]) for g in groups}
+
+    jobs = []
+    for g in groups:
+        clu_ids, nspks = np.unique(y[g], return_counts=True)
+        n_points = n_vq[g] if n_vq is not None and g in n_vq else n_vq_per_clu(nspks, N, method)
+        jobs += [(g, X[g][y[g] == clu_id], n) for clu_id, n in zip(clu_ids, n_points)]
+
+    n_jobs = os.cpu_count() if n_jobs is None else n_jobs
+    centers = _map(_fit_codebook, [(x, n) for _, x, n in jobs], n_jobs)
+    job_groups = np.array([g for g, _, _ in jobs])
+    books = []
+    for g in groups:
+        points = np.vstack([c for c, jg in zip(centers, job_groups) if jg == g])
+        books.append((points, y[g][nearest(points, X[g])[0]]))
+    if refine_epochs > 0:
+        books = _map(partial(refine_codebook, binpoint=binpoint), [(X[g], y[g], points, labels, refine_epochs, N) 
+                                                                   for g, (points, labels) in zip(groups, books)], n_jobs)
+
+    codebooks = {'groups':   groups,
+                 'points':   np.zeros((len(groups), N, n_dim), dtype=np.float32),
+                 'labels':   np.zeros((len(groups), N), dtype=np.int32),
+                 'n_points': np.zeros((len(groups),), dtype=np.int64),
+                 'scores':   np.zeros((len(groups),), dtype=np.float64)}
+    for i, g in enumerate(groups):
+        points, labels = books[i][:2]
+        codebooks['points'][i, :points.shape[0]] = np.clip(points, -128 / 2**binpoint, 127 / 2**binpoint)
+        codebooks['labels'][i, :points.shape[0]] = labels
+        codebooks['n_points'][i] = points.shape[0]
+        codebooks['scores'][i] = evaluate(X[g], y[g], fixed_point(points, binpoint), labels)[0]
+    return codebooks
@@ -0,0 +1,86 @@
+#--------------------------------------------------------------
+# Per-spike noise metrics of one group
+#--------------------------------------------------------------
+import numpy as np
+from numba import njit
+
+
+@njit(cache=True)
+def _spurious_score(spk, scale):
+    '''
+    mean over time of the peak-to-peak across channels of every spike (N, spklen, nch)
+    '''
+    N, spklen, nch = spk.shape
+    score = np.zeros((N,), dtype=np.float32)
+    for i in range(N):
+        total = 0.
+        for t in range(spklen):
+            lo, hi = spk[i, t, 0], spk[i, t, 0]
+            for c in range(1, nch):
+                v = spk[i, t, c]
+                if v < lo:
+                    lo = v
+                elif v > hi:
+                    hi = v
+            total += hi - lo
+        score[i] = total / spklen / scale
+    return score
+
+
+@njit(cache=True, error_model='numpy')
+def _noise_level(data, times, chs, grp_chs):
+    '''
+    mean of chs / mean of grp_chs of the raw data (n_samples, n_all_chs) at every spike time,
+    only the samples at the spike times are read (data can be a memmap)
+    '''
+    N = times.shape[0]
+    level = np.zeros((N,), dtype=np.float32)
+    for i in range(N):
+        s_all, s_grp = 0., 0.
+        for c in chs:
+            s_all += data[times[i], c]
+        for c in grp_chs:
+            s_grp += data[times[i], c]
+        level[i] = (s_all / chs.shape[0]) / (s_grp / grp_chs.shape[0])
+    return level
+
+
+class spike_noise(object):
+    '''
+    Noise metrics of every spike in one group, computed in one pass and cached.
+
+    sn = spike_noise()
+    sn.update(spk, times, data, chs, grp_chs)
+    sn.spurious    # (N,) mean peak-to-peak across the group channels / 2**13, small for flat (spurious) spikes
+    sn.noise       # (N,) mean of all probe channels / mean of the group channels at the spike time,
+                   #      large for noise that is common to the whole probe
+
+    A metric is only recomputed when its inputs changed (spk, or the spike times after a delete),
+    both are computed lazily at the first access. update(spk) alone keeps the raw data bound before.
+    '''
+    def __init__(self, scale=2**13):
+        self.scale = scale
+        self._spk, self._times, self._data = None, None, None
+        self._spurious, self._noise = None, None
+
+    def update(self, spk, times=None, data=None, chs=None, grp_chs=None):
+        if spk is not self._spk:
+            self._spk, self._spurious = spk, None
+        if times is not None and (times is not self._times or data is not self._data):
+            self._times, self._data, self._noise = times, data, None
+        self._chs, self._grp_chs = chs, grp_chs
+        return self
+
+    @property
+    def spurious(self):
+        if self._spurious is None:
+            self._spurious = _spurious_score(np.ascontiguousarray(self._spk), float(self.scale))
+        return self._spurious
+
+    @property
+    def noise(self):
+        if self._noise is None:
+            data = self._data if isinstance(self._data, np.ndarray) else np.asarray(self._data)
+            self._noise = _noise_level(data, np.asarray(self._times, dtype=np.int64),
+                                       np.asarray(self._chs, dtype=np.int64), np.asarray(self._grp_chs, dtype=np.int64))
+        return self._noise
@@ -0,0 +1,150 @@
+#--------------------------------------------------------------
+# Pairwise similarity between the clusters of one group
+#--------------------------------------------------------------
+import numpy as np
+from numba import njit
+from sklearn.neighbors import KDTree
+
+
+@njit(cache=True)
+def _knn_label_counts(labels, nbr_labels, nclu):
+    '''
+    counts[i,j]: #neighbours in cluster j of the spikes in cluster i
+    '''
+    counts = np.zeros((nclu, nclu), dtype=np.int64)
+    for i in range(nbr_labels.shape[0]):
+        for j in range(nbr_labels.shape[1]):
+            counts[labels[i], nbr_labels[i, j]] += 1
+    return counts
+
+
+@njit(cache=True)
+def _centroid_distance(centroids, spreads):
+    '''
+    distance between centroids in the unit of the pooled spread of the two clusters
+    '''
+    n = centroids.shape[0]
+    d = np.zeros((n, n))
+    for i in range(n):
+        for j in range(i+1, n):
+            dist = np.sqrt(np.sum((centroids[i] - centroids[j])**2) / (spreads[i]**2 + spreads[j]**2 + 1e-12))
+            d[i, j] = dist
+            d[j, i] = dist
+    return d
+
+
+@njit(cache=True)
+def _waveform_correlation(waves):
+    '''
+    pearson correlation between every pair of mean waveforms (n, spklen*nch)
+    '''
+    n, m = waves.shape
+    z = np.zeros((n, m))
+    for i in range(n):
+        w = waves[i] - waves[i].mean()
+        norm = np.sqrt(np.sum(w**2))
+        if norm > 0:
+            z[i] = w / norm
+    return z @ z.T
+
+
+class cluster_similarity(object):
+    '''
+    Similarity between every pair of clusters in one group, used to suggest merges.
+
+    sim = cluster_similarity(k=10)
+    sim.update(spk, fet, clu)      # spk: (N, spklen, nch), fet: (N, ndim), clu: CLU
+    sim.merge_candidates(n=10)     # [(clu_i, clu_j, score), ...] highest score first
+
+    Three features for each pair (i, j):
+    - distance:    centroid distance in units of the pooled spread
+    - overlap:     fraction of the knn links of i and j that go across i and j
+    - correlation: correlation between the mean waveforms
+    score = mean(exp(-distance), min(2*overlap, 1), max(correlation, 0))
+
+    The knn graph only depends on the features and is computed once (on at most `max_query` spikes);
+    centroids and mean waveforms are cached per cluster and recomputed only for clusters 
+    changed by a `cluster` or `delete` event of the clu.
+    '''
+    def __init__(self, k=10, max_query=20000):
+        self.k = k
+        self.max_query = max_query
+        self._spk, self._fet, self._clu = None, None, None
+        self._stats = {}   # {clu_id: (global_ids, centroid, spread, mean waveform)}
+        self._dirty = True
+        self._handlers = []   # connected to the events of self._clu
+
+    def update(self, spk, fet, clu):
+        if fet is not self._fet or spk is not self._spk:
+            self._spk, self._fet = spk, fet
+            self._knn_graph()
+            self._stats = {}
+            self._dirty = True
+        if clu is not self._clu:
+            self.disconnect()
+            def on_cluster(*args, **kwargs):
+                self._dirty = True
+            def on_delete(*args, **kwargs):
+                self._dirty = True
+            self._handlers = [clu.connect(on_cluster), clu.connect(on_delete)]
+            self._clu = clu
+            self._stats = {}
+            self._dirty = True
+        if self._dirty:
+            self._update_stats()
+            self._dirty = False
+        return self
+
+    def disconnect(self):
+        '''
+        stop watching the clu (it is replaced, or the similarity is no longer used)
+        '''
+        if self._clu is not None:
+            self._clu.unconnect(*self._handlers)
+        self._handlers = []
+
+    def _knn_graph(self):
+        n = self._fet.shape[0]
+        if n > self.max_query:
+            self._query_ids = np.sort(np.random.RandomState(0).choice(n, self.max_query, replace=False))
+        else:
+            self._query_ids = np.arange(n)
+        k = min(self.k + 1, n)
+        nbr = KDTree(self._fet).query(self._fet[self._query_ids], k)[1]
+        self._nbr = nbr[:, 1:]  # the first neighbour is the spike itself
+
+    def _update_stats(self):
+        clu = self._clu
+        for clu_id in list(self._stats.keys()):
+            if clu_id not in clu.index or not np.array_equal(self._stats[clu_id][0], clu.index[clu_id]):
+                del self._stats[clu_id]
+        for clu_id, ids in clu.index.items():
+            if clu_id not in self._stats:
+                fet = self._fet[ids]
+                self._stats[clu_id] = (ids, fet.mean(axis=0), np.sqrt(fet.var(axis=0).mean()),
+                                       self._spk[ids].mean(axis=0).ravel())
+
+        ids = clu.index_id
+        nclu = ids.max() + 1
+        labels = clu.membership
+        counts = _knn_label_counts(labels[self._query_ids], labels[self._nbr], nclu)[np.ix_(ids, ids)]
+        links = counts.sum(axis=1)
+        self.overlap = (counts + counts.T) / np.maximum((links[:, None] + links[None, :]), 1)
+        np.fill_diagonal(self.overlap, 1.)
+        self.distance = _centroid_distance(np.vstack([self._stats[i][1] for i in ids]).astype(np.float64),
+                                           np.array([self._stats[i][2] for i in ids], dtype=np.float64))
+        self.correlation = _waveform_correlation(np.vstack([self._stats[i][3] for i in ids]).astype(np.float64))
+        self.score = (np.exp(-self.distance) + np.minimum(2*self.overlap, 1) + np.maximum(self.correlation, 0)) / 3
+        self.clu_ids = ids
+
+    def merge_candidates(self, n=10, include_noise=False):
+        '''
+        the n most similar pairs of clusters [(clu_i, clu_j, score), ...], cluster 0 (noise) is excluded by default
+        '''
+        i, j = np.triu_indices(self.clu_ids.shape[0], k=1)
+        pairs = np.vstack((self.clu_ids[i], self.clu_ids[j])).T
+        score = self.score[i, j]
+        if not include_noise:
+            pairs, score = pairs[pairs.min(axis=1) > 0], score[pairs.min(axis=1) > 0]
+        order = np.argsort(score)[::-1][:n]
+        return [(int(a), int(b), float(s)) for (a, b), s in zip(pairs[order], score[order])]
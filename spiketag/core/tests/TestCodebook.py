@@ -0,0 +1,76 @@
+import sys
+sys.path.append('../../../')
+import unittest
+import numpy as np
+from spiketag.core.codebook import build_codebooks, n_vq_per_clu, nearest, evaluate, refine_codebook, fixed_point
+
+class TestCodebook(unittest.TestCase):
+
+    def setUp(self):
+        rng = np.random.RandomState(0)
+        self.fet, self.membership = {}, {}
+        for g in (0, 3, 5):
+            membership = np.repeat(np.arange(4), [600, 300, 300, 100])
+            centers = np.array([[0, 0, 0, 0], [2, 0, 0, 0], [0, 2, 0, 0], [0, 0, 2, 0]], dtype=np.float32)
+            self.fet[g] = centers[membership] + rng.normal(0, 0.2, (1300, 4)).astype(np.float32)
+            self.membership[g] = membership
+
+    '''
+        TestCase
+    '''
+    def test_n_vq_per_clu(self):
+        self.assertListEqual(list(n_vq_per_clu([600, 300, 300, 100], N=500)), [125, 125, 125, 100])
+        self.assertListEqual(list(n_vq_per_clu([600, 300, 300, 100], N=502, method='equal')), [125, 125, 125, 100])
+
+    def test_nearest(self):
+        rng = np.random.RandomState(1)
+        Q, R = rng.normal(0, 1, (1000, 4)), rng.normal(0, 1, (300, 4))
+        idx, d2 = nearest(Q, R, chunk=128)
+        d = ((Q[:, None, :] - R[None, :, :])**2).sum(axis=2)
+        self.assertTrue(np.array_equal(idx, d.argmin(axis=1)))
+        self.assertTrue(np.allclose(d2, d.min(axis=1), atol=1e-4))
+
+    def test_build_codebooks(self):
+        serial = build_codebooks(self.fet, self.membership, N=500, n_jobs=1)
+        parallel = build_codebooks(self.fet, self.membership, N=500, n_jobs=2)
+        self.assertListEqual(list(serial['groups']), [0, 3, 5])
+        self.assertEqual(serial['points'].shape, (3, 500, 4))
+        self.assertListEqual(list(serial['n_points']), [475, 475, 475])
+        self.assertTrue((serial['scores'] > 0.95).all())
+        self.assertTrue((serial['labels'][:, 475:] == 0).all())
+        self.assertTrue(np.allclose(serial['points'], parallel['points']))
+
+    def test_refine_codebook(self):
+        rng = np.random.RandomState(2)
+        # two overlapping clusters of very different size, the kmeans budget split favours neither
+        y = np.repeat([0, 1], [4000, 400])
+        X = np.vstack((rng.normal(0, 1, (4000, 4)), rng.normal(1.5, 0.3, (400, 4)))).astype(np.float32)
+        book = build_codebooks({0: X}, {0: y}, N=40, n_jobs=1)
+        points, labels = book['points'][0][:book['n_points'][0]], book['labels'][0][:book['n_points'][0]]
+        accuracy, errors = evaluate(X, y, points, labels)
+        self.assertEqual(errors.sum(), int(round((1 - accuracy) * len(y))))
+        refined, refined_labels, refined_accuracy = refine_codebook(X, y, points, labels, n_epochs=10, size=40)
+        self.assertEqual(refined.shape, (40, 4))
+        self.assertGreaterEqual(refined_accuracy, accuracy)
+        self.assertAlmostEqual(evaluate(X, y, refined, refined_labels)[0], refined_accuracy)
+        self.assertTrue(np.array_equal(refined, fixed_point(refined)))
+
+    def test_refine_codebook_bounds(self):
+        '''
+            the points stay in the int8 range (binpoint 7), a cluster keeps its only (useless) point
+        '''
+        rng = np.random.RandomState(3)
+        y = np.repeat([0, 1, 2], [1000, 1000, 5])
+        X = np.vstack((rng.normal(-0.5, 0.3, (1000, 4)), rng.normal(0.5, 0.3, (1000, 4)), 
+                       rng.normal(0.5, 0.3, (5, 4)))).astype(np.float32)
+        points = np.vstack((X[:10], X[1000:1010], [[3., 3., 3., 3.]])).astype(np.float32)
+        labels = np.repeat([0, 1, 2], [10, 10, 1])
+        refined, refined_labels, accuracy = refine_codebook(X, y, points, labels, n_epochs=5, n_swap=21, lr=0.5)
+        self.assertTrue((refined >= -1).all() and (refined <= 127/128.).all())
+        self.assertListEqual(sorted(np.unique(refined_labels)), [0, 1, 2])
+        q = np.floor(refined * 2**7)
+        self.assertTrue((q >= -128).all() and (q <= 127).all())
+
+
+if __name__ == "__main__":
+    unittest.main()
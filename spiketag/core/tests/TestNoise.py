@@ -0,0 +1,40 @@
+import sys
+sys.path.append('../../../')
+import unittest
+import numpy as np
+from spiketag.core import spike_noise
+
+class TestNoise(unittest.TestCase):
+
+    def setUp(self):
+        rng = np.random.RandomState(0)
+        self.spk = rng.normal(0, 1000, (500, 19, 4)).astype(np.float32)
+        self.data = rng.randint(-2000, 2000, (10000, 16)).astype(np.int16)
+        self.times = np.sort(rng.choice(10000, 500, replace=False))
+        self.chs, self.grp_chs = np.arange(16), np.array([4, 5, 6, 7])
+
+    '''
+        TestCase
+    '''
+    def test_scores(self):
+        sn = spike_noise().update(self.spk, self.times, self.data, self.chs, self.grp_chs)
+        spurious = np.mean(self.spk.max(axis=-1) - self.spk.min(axis=-1), axis=1) / 2**13
+        self.assertTrue(np.allclose(sn.spurious, spurious, rtol=1e-5))
+        rows = self.data[self.times].astype(np.float64)
+        noise = rows[:, self.chs].mean(axis=1) / rows[:, self.grp_chs].mean(axis=1)
+        self.assertTrue(np.allclose(sn.noise, noise, rtol=1e-4))
+
+    def test_cache(self):
+        sn = spike_noise().update(self.spk, self.times, self.data, self.chs, self.grp_chs)
+        spurious, noise = sn.spurious, sn.noise
+        sn.update(self.spk)
+        self.assertIs(sn.spurious, spurious)
+        self.assertIs(sn.noise, noise)
+        keep = np.arange(500) % 2 == 0
+        sn.update(self.spk[keep], self.times[keep], self.data, self.chs, self.grp_chs)
+        self.assertEqual(sn.spurious.shape[0], 250)
+        self.assertTrue(np.allclose(sn.noise, noise[keep]))
+
+
+if __name__ == "__main__":
+    unittest.main()
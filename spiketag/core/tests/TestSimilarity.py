@@ -0,0 +1,50 @@
+import sys
+sys.path.append('../../../')
+import unittest
+import numpy as np
+from spiketag.base import CLU
+from spiketag.core import cluster_similarity
+
+class TestSimilarity(unittest.TestCase):
+
+    def setUp(self):
+        rng = np.random.RandomState(0)
+        # cluster 1 and 2 are the same neuron split in two, cluster 3 is far away
+        self.membership = np.repeat(np.arange(4), 500)
+        centers = np.array([0., 1., 1.05, 3.])
+        self.fet = (centers[self.membership][:, None] + rng.normal(0, 0.2, (2000, 4))).astype(np.float32)
+        templates = rng.normal(0, 1, (4, 19, 4))
+        templates[2] = templates[1]
+        self.spk = (templates[self.membership] + rng.normal(0, 0.5, (2000, 19, 4))).astype(np.float32)
+        self.clu = CLU(self.membership)
+
+    '''
+        TestCase
+    '''
+    def test_merge_candidates(self):
+        sim = cluster_similarity(k=10).update(self.spk, self.fet, self.clu)
+        candidates = sim.merge_candidates(n=3)
+        self.assertEqual(candidates[0][:2], (1, 2))
+        self.assertEqual(len(candidates), 3)
+
+    def test_update_after_merge(self):
+        sim = cluster_similarity(k=10).update(self.spk, self.fet, self.clu)
+        self.clu.merge([1, 2])
+        sim.update(self.spk, self.fet, self.clu)
+        self.assertListEqual(list(sim.clu_ids), [0, 1, 2])
+        self.assertEqual(len(sim.merge_candidates(n=3)), 1)
+
+    def test_replaced_clu_is_unconnected(self):
+        sim = cluster_similarity(k=10).update(self.spk, self.fet, self.clu)
+        callbacks = lambda clu: sum(len(v) for v in clu._callbacks.values())
+        self.assertEqual(callbacks(self.clu), 2)
+        clu = CLU(self.membership)
+        sim.update(self.spk, self.fet, clu)
+        self.assertEqual(callbacks(self.clu), 0)
+        self.assertEqual(callbacks(clu), 2)
+        sim.disconnect()
+        self.assertEqual(callbacks(clu), 0)
+
+
+if __name__ == "__main__":
+    unittest.main()
@@ -1,6 +1,7 @@
 import numpy as np
-import torch
-from .memory_api import read_mem_16, write_mem_16
+from contextlib import contextmanager
+from .memory_api import read_mem_16, write_mem_16, read_mem_16_block, shadow_mem
+from .memory_api import save_image, load_image, diff_image
 from .bram_xike  import pca_hash, scale_hash, shift_hash, vq_hash, label_hash
 from . import bram_thres
 
@@ -12,10 +13,47 @@ def calculate_threshold(x, beta=4.0):
 class dummyobj(object):
     pass
 
+
+PARAM_KEYS = ('ch_hash', 'ch_grpNo', 'thres', 'ch_ref', 'scale', 'shift', 'pca', 'vq', 'label')
+MEM_16_CONFIG = (6, 8)    # n_units and target_unit, the configuration part of mem_16
+
+def _brams(thr_ram, model_ram, n_ch=160, ngrp=40, p_dim=4, spklen=19, ch_span=4, n_vq=500, verify=False):
+    '''
+    {name: bram hash} on the thr_32 and template_32 memories, following the address map of the current FPGA version
+    '''
+    return {'ch_hash':  bram_thres.channel_hash(nCh=n_ch, base_address=256, mem=thr_ram),
+            'ch_grpNo': bram_thres.chgpNo(nCh=n_ch, mem=thr_ram),
+            'ch_ref':   bram_thres.ch_ref(n_ch, mem=thr_ram),
+            'dc':       bram_thres.offset(nCh=n_ch, mem=thr_ram),
+            'thres':    bram_thres.threshold(nCh=n_ch, mem=thr_ram),
+            'scale':    scale_hash(nCh=ngrp,  base_address=0, mem=model_ram),
+            'shift':    shift_hash(nCh=ngrp,  base_address=ngrp * 1, verify=verify, mem=model_ram),
+            'pca':        pca_hash(nCh=ngrp,  base_address=ngrp * (p_dim + 1), verify=verify, mem=model_ram),
+            'vq':          vq_hash(nCh=ngrp,  base_address=ngrp * (p_dim + 1 + spklen*ch_span), verify=verify, mem=model_ram),
+            'label':    label_hash(nCh=ngrp,  base_address=ngrp * (p_dim + 1 + spklen*ch_span + n_vq), verify=verify, mem=model_ram)}
+
+def param_from_image(image):
+    '''
+    decode a memory image (FPGA.snapshot() or its file) into the parameters {key: array} of PARAM_KEYS
+    '''
+    if isinstance(image, str):
+        image = load_image(image)
+    thr_ram, model_ram = shadow_mem('thr_32'), shadow_mem('template_32')
+    thr_ram.preload(image['thr_32'])
+    model_ram.preload(image['template_32'])
+    brams = _brams(thr_ram, model_ram)
+    return {key: brams[key].to_numpy() for key in PARAM_KEYS}
+
 class FPGA(object):
 
-    def __init__(self, probe=None):
-        """TODO: to be defined1.
+    def __init__(self, probe=None, verify=False):
+        """
+        verify: read back every block of the model RAM (scale, shift, pca, vq, label) after writing it
+
+        All BRAM contents (thr_32 and the template_32 model RAM) are accessed through host-side
+        shadow images (`thr_ram`, `model_ram`): only words that differ from the image are written,
+        reads are served from the image. Use `with fpga.batch():` to download a whole model
+        as its net difference, and `fpga.sync()` if the FPGA was written by another process.
         """
 
         if probe is None:
@@ -30,31 +68,11 @@ class FPGA(object):
 
         self.n_ch = 160 # probe.n_ch
         self.probe = probe
+        self.thr_ram   = shadow_mem('thr_32')
+        self.model_ram = shadow_mem('template_32')
 
         '''
-        1. ch_hash, ch_grpNo and ch_ref
-        '''
-        # the channel hashing for spike grouping protocol in FPGA
-        self.ch_hash = bram_thres.channel_hash(nCh=self.n_ch, base_address=256)
-        # the channel groupNo for transformer to report in FPGA
-        self.ch_grpNo = bram_thres.chgpNo(nCh=self.n_ch)
-        self.ch_ref = bram_thres.ch_ref(self.n_ch)
-
-        '''
-        1. if probe is selected then write to FPGA
-        '''
-        if _set_channel_params_to_fpga:
-            self.set_channel_params_to_fpga()
-
-        '''
-        2. dc_offset and threshold
-        '''
-        self.dc = bram_thres.offset(nCh=self.n_ch)
-        self.dc[:] = np.ones((self.n_ch,)) * 32 # emprical, this need some invesigation why the offset exists
-        self.thres = bram_thres.threshold(nCh=self.n_ch)
-
-        '''
-        3. Transformer and VQ
+        Transformer and VQ
         y = a(xP+b)
         x: (spklen*ch_span,)
         P: (spklen*ch_span, 4)  : pca[grpNo]
@@ -70,11 +88,28 @@ class FPGA(object):
         self.n_vq    = 500
         self._transformer_status = np.zeros((self.ngrp,))
 
-        self.scale = scale_hash(nCh=self.ngrp,  base_address=0)
-        self.shift = shift_hash(nCh=self.ngrp,  base_address=self.ngrp * 1)
-        self.pca   =   pca_hash(nCh=self.ngrp,  base_address=self.ngrp * (self.p_dim + 1))
-        self.vq    =    vq_hash(nCh=self.ngrp,  base_address=self.ngrp * (self.p_dim + 1 + self.spklen*self.ch_span))
-        self.label = label_hash(nCh=self.ngrp,  base_address=self.ngrp * (self.p_dim + 1 + self.spklen*self.ch_span + self.n_vq))
+        '''
+        0. the BRAM hashes:
+           ch_hash:  the channel hashing for spike grouping protocol in FPGA
+           ch_grpNo: the channel groupNo for transformer to report in FPGA
+           ch_ref, dc (offset), thres
+           scale, shift, pca, vq, label (model RAM)
+        '''
+        brams = _brams(self.thr_ram, self.model_ram, n_ch=self.n_ch, ngrp=self.ngrp, p_dim=self.p_dim,
+                       spklen=self.spklen, ch_span=self.ch_span, n_vq=self.n_vq, verify=verify)
+        for name, bram in brams.items():
+            setattr(self, name, bram)
+
+        '''
+        1. if probe is selected then write to FPGA
+        '''
+        if _set_channel_params_to_fpga:
+            self.set_channel_params_to_fpga()
+
+        '''
+        2. dc_offset
+        '''
+        self.dc[:] = np.ones((self.n_ch,)) * 32 # emprical, this need some invesigation why the offset exists
 
 
     def __repr__(self):
@@ -100,18 +135,96 @@ class FPGA(object):
             '''
         return s
 
+    @property
+    def param(self):
+        return {key: getattr(self, key).to_numpy() for key in PARAM_KEYS}
+
+    '''
+    ------------------------------------------------------------------------------------
+    whole memory images: snapshot, save, restore and diff 
+    ------------------------------------------------------------------------------------
+    '''
+    def snapshot(self):
+        '''
+        read back every BRAM word (one block read per memory) and mem_16
+        return: image {'thr_32': words, 'template_32': words, 'mem_16': words}
+        '''
+        self.sync()
+        return {'thr_32':      self.thr_ram.read(0, self.thr_ram.image.shape[0]),
+                'template_32': self.model_ram.read(0, self.model_ram.image.shape[0]),
+                'mem_16':      read_mem_16_block(0, 2**5)}
+
     def save(self, filename='./param'):
-        param = {}
-        param['ch_hash'] = self.ch_hash.to_numpy()
-        param['ch_grpNo'] = self.ch_grpNo.to_numpy()
-        param['thres'] = self.thres.to_numpy()
-        param['ch_ref'] = self.ch_ref.to_numpy()
-        param['scale'] = self.scale.to_numpy()
-        param['shift'] = self.shift.to_numpy()
-        param['pca'] = self.pca.to_numpy()
-        param['vq'] = self.vq.to_numpy()
-        param['label'] = self.label.to_numpy()
-        torch.save(param, filename)
+        '''
+        save the snapshot as a versioned image file, read it by `load_param` or `restore`
+        '''
+        save_image(self.snapshot(), filename)
+
+    def restore(self, image, verify=False):
+        '''
+        write an image (or image file) back, only the words that differ from the FPGA are written
+        verify: read the FPGA back afterwards and raise IOError if it does not match the image
+        '''
+        if isinstance(image, str):
+            image = load_image(image)
+        with self.batch():
+            self.thr_ram.write(0, image['thr_32'])
+            self.model_ram.write(0, image['template_32'])
+        if 'mem_16' in image:
+            for addr in MEM_16_CONFIG:
+                write_mem_16(addr, int(image['mem_16'][addr]))
+        if verify:
+            changed = self.diff(image)
+            if changed:
+                raise IOError('fpga restore failed at {}'.format(changed))
+
+    def diff(self, image, other=None):
+        '''
+        compare image (or image file) with `other` (default the FPGA now)
+        return: {name: groups or channels that differ}, e.g. {'label': array([3, 7])}, empty if identical
+        '''
+        if isinstance(image, str):
+            image = load_image(image)
+        if other is None:
+            other = self.snapshot()
+        elif isinstance(other, str):
+            other = load_image(other)
+        changed = diff_image(image, other)
+        ranges = {'thr_32': ('thres', 'ch_hash', 'dc', 'ch_grpNo', 'ch_ref'),
+                  'template_32': ('scale', 'shift', 'pca', 'vq', 'label')}
+        diff = {}
+        for mem, names in ranges.items():
+            for name in names:
+                bram = getattr(self, name)
+                base, dim = getattr(bram, 'base', 0), getattr(bram, 'dim', 1)
+                addr = changed.get(mem, np.array([], dtype=np.int64))
+                addr = addr[(addr >= base) & (addr < base + bram.nCh*dim)]
+                if addr.shape[0] > 0:
+                    diff[name] = np.unique((addr - base) // dim)
+        if 'mem_16' in changed:
+            regs = np.intersect1d(changed['mem_16'], MEM_16_CONFIG)
+            if regs.shape[0] > 0:
+                diff['mem_16'] = regs
+        return diff
+
+    @contextmanager
+    def batch(self):
+        '''
+        stage every BRAM write in the block, write the net difference to the FPGA at exit
+
+        with fpga.batch():
+            ctrl.reset_vq()
+            ctrl.set_vq()
+        '''
+        with self.thr_ram.batch(), self.model_ram.batch():
+            yield self
+
+    def sync(self):
+        '''
+        forget the shadow images, the next access reads the BRAM back from the FPGA
+        '''
+        self.thr_ram.invalidate()
+        self.model_ram.invalidate()
 
     '''
     ------------------------------------------------------------------------------------
@@ -123,9 +236,7 @@ class FPGA(object):
         '''
         [4:0] 5-bits address
         '''
-        self._mem_16 = np.zeros((2**5,))
-        for i in range(2**5):
-            self._mem_16[i] = read_mem_16(i)
+        self._mem_16 = read_mem_16_block(0, 2**5).astype(np.float64)
         return self._mem_16
 
     @property
@@ -175,13 +286,17 @@ class FPGA(object):
 
     def set_channel_params_to_fpga(self):
         assert(self.n_ch == self.probe.n_ch)  # very important!
+        ch_hash  = np.zeros((self.probe.n_ch, 4), dtype=np.int64)
+        ch_grpNo = np.zeros((self.probe.n_ch,))
         for ch in range(self.probe.n_ch):
             ## it is possible that the probe.ch_hash is less than 40 groups (e.g. only 128 channels used)
-            self.ch_hash[ch] = self.probe.ch_hash(ch)
+            ch_hash[ch] = self.probe.ch_hash(ch)
             try:
-                self.ch_grpNo[ch] = self.probe.ch2g[ch]
+                ch_grpNo[ch] = self.probe.ch2g[ch]
             except:
-                self.ch_grpNo[ch] = 100
+                ch_grpNo[ch] = 100
+        self.ch_hash[:]  = ch_hash
+        self.ch_grpNo[:] = ch_grpNo
 
     def set_channel_ref(self, ch_ref):
         self.ch_ref[:] = ch_ref
@@ -229,14 +344,13 @@ class FPGA(object):
 
     @property
     def configured_groups(self):
-        self._configured_groups = np.array([g for g in range(self.probe.n_group) 
-                                            if np.unique(self.label[g]).shape[0]>1])
+        labels = self.label.to_numpy()[:self.probe.n_group]
+        self._configured_groups = np.where(labels.min(axis=1) != labels.max(axis=1))[0]
         return self._configured_groups
 
     @property
     def unique_labels(self):
-        _fpga_labels = np.array([self.label[g] for g in range(self.probe.n_group)]).ravel()
-        self._unique_labels = np.unique(_fpga_labels)
+        self._unique_labels = np.unique(self.label.to_numpy()[:self.probe.n_group])
         return self._unique_labels
 
     def check(self):
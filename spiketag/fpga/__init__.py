@@ -2,12 +2,16 @@ from .bram_thres import threshold
 from .bram_thres import offset
 from .bram_thres import channel_hash 
 from .memory_api import *
-from .NSP import FPGA
+from .NSP import FPGA, param_from_image
 from .run import run
 
 
-import torch
-
 def load_param(filename):
-    return torch.load(filename)
-
+    '''
+    the parameters saved by FPGA.save (a memory image), or by earlier versions (torch.save of a dict)
+    '''
+    try:
+        return param_from_image(filename)
+    except ValueError:
+        import torch
+        return torch.load(filename)
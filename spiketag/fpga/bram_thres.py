@@ -9,15 +9,38 @@ import struct
 
 # thres_arr = np.array([-100.14724392]*32)
 
+
+def _thr(mem):
+    '''
+    the memory behind the channel hashes: `mem` (e.g. a shadow_mem) or the thr_32 device
+    '''
+    return device('thr_32') if mem is None else mem
+
+def _write_channels(base, idx, values, dtype='<i4', binpoint=0, verify=False, mem=None):
+    '''
+    write values of channels idx into thr_32 (from base), each contiguous run of channels is one block write
+    '''
+    idx = np.atleast_1d(idx)
+    if idx.shape[0] == 0:
+        return
+    words = to_fixed_point_array(np.broadcast_to(values, idx.shape), dtype, binpoint)
+    breaks = np.where(np.diff(idx) != 1)[0] + 1
+    for run, block in zip(np.split(idx, breaks), np.split(words, breaks)):
+        _thr(mem).write(base + run[0], block.view('<i4'), verify=verify)
+
+def _read_channels(base, n, dtype='<i4', binpoint=0, mem=None):
+    return to_value_array(_thr(mem).read(base, n).view(dtype), binpoint)
+
 class ch_ref(object):
     """
     Must configure for FPGA tranformation to report the groupNo when spike is found
     and transformed
     """
-    def __init__(self, nCh=32, base_address=1024):
+    def __init__(self, nCh=32, base_address=1024, mem=None):
         self.nCh  = nCh
         self.base = base_address
         self.ch_ref = np.zeros(nCh)
+        self.mem = mem
 
     # def enable(self, flag):
     #     if flag is True:
@@ -27,29 +50,11 @@ class ch_ref(object):
 
     def __setitem__(self, chNo, ch_ref):
         self.ch_ref[chNo] = ch_ref
-        # if type(chNo) is slice:
-        #     for i,v in enumerate(ch_ref):
-        #         write_thr_32(i+self.base, ch_ref[i], dtype='<I', binpoint=0) 
-        # else:
-        #     write_thr_32(chNo+self.base, ch_ref, dtype='<I', binpoint=0) 
-
-        if type(chNo) is slice:
-            if chNo == slice(None,None,None): 
-                for ch in np.arange(self.nCh):
-                    if np.size(ch_ref) == 1:
-                        write_thr_32(ch+self.base, ch_ref,     dtype='<I', binpoint=0)
-                    else:
-                        write_thr_32(ch+self.base, ch_ref[ch], dtype='<I', binpoint=0)
-            else:
-                for i, ch in enumerate(np.arange(chNo.start, chNo.stop, chNo.step)):
-                    if np.size(ch_ref) == 1:
-                        write_thr_32(ch+self.base, ch_ref,     dtype='<I', binpoint=0)
-                    else:
-                        write_thr_32(ch+self.base, ch_ref[ch], dtype='<I', binpoint=0)
+        idx = np.arange(self.nCh)[chNo]
+        _write_channels(self.base, idx, self.ch_ref[idx], dtype='<u4', binpoint=0, mem=self.mem)
 
     def __getitem__(self, chNo):
-        ch = chNo+self.base
-        return read_thr_32(ch, dtype='<I', binpoint=0)
+        return _read_channels(self.base+chNo, 1, dtype='<u4', binpoint=0, mem=self.mem)[0]
 
     def __eq__(self, val):
         for ch in range(self.nCh):
@@ -62,9 +67,7 @@ class ch_ref(object):
         return self.hash_repr
 
     def to_numpy(self):
-        self.array = np.zeros((self.nCh,))
-        for i in range(self.nCh):
-            self.array[i] = self.__getitem__(i)
+        self.array = _read_channels(self.base, self.nCh, dtype='<u4', binpoint=0, mem=self.mem)
         return self.array
 
     __repr__ = __str__
@@ -76,10 +79,11 @@ class chgpNo(object):
     Must configure for FPGA tranformation to report the groupNo when spike is found
     and transformed
     """
-    def __init__(self, nCh=32, base_address=768):
+    def __init__(self, nCh=32, base_address=768, mem=None):
         self.nCh  = nCh
         self.base = base_address
         self.chgpNo = np.zeros(nCh)
+        self.mem = mem
 
     # def enable(self, flag):
     #     if flag is True:
@@ -89,15 +93,11 @@ class chgpNo(object):
 
     def __setitem__(self, chNo, chgpNo):
         self.chgpNo[chNo] = chgpNo
-        if type(chNo) is slice:
-            for i,v in enumerate(chgpNo):
-                write_thr_32(i+self.base, chgpNo[i], dtype='<I', binpoint=0) 
-        else:
-            write_thr_32(chNo+self.base, chgpNo, dtype='<I', binpoint=0) 
+        idx = np.arange(self.nCh)[chNo]
+        _write_channels(self.base, idx, self.chgpNo[idx], dtype='<u4', binpoint=0, mem=self.mem)
 
     def __getitem__(self, chNo):
-        ch = chNo+self.base
-        return read_thr_32(ch, dtype='<I', binpoint=0)
+        return _read_channels(self.base+chNo, 1, dtype='<u4', binpoint=0, mem=self.mem)[0]
 
     def __str__(self):
         self.hash_repr = ''
@@ -106,10 +106,7 @@ class chgpNo(object):
         return self.hash_repr
 
     def to_numpy(self):
-        grpNo = []
-        for i in range(self.nCh):
-            grpNo.append(self.__getitem__(i))
-        return np.stack(grpNo)
+        return _read_channels(self.base, self.nCh, dtype='<u4', binpoint=0, mem=self.mem)
 
     __repr__ = __str__
 
@@ -118,10 +115,11 @@ class chgpNo(object):
 class offset(object):
     """
     """
-    def __init__(self, nCh=32, base_address=512):
+    def __init__(self, nCh=32, base_address=512, mem=None):
         self.nCh  = nCh
         self.base = base_address
         self.offset = np.zeros(nCh)
+        self.mem = mem
 
     # def enable(self, flag):
     #     if flag is True:
@@ -131,15 +129,11 @@ class offset(object):
 
     def __setitem__(self, chNo, offset):
         self.offset[chNo] = offset
-        if type(chNo) is slice:
-            for i,v in enumerate(offset):
-                write_thr_32(i+self.base, offset[i], dtype='<i', binpoint=13) 
-        else:
-            write_thr_32(chNo+self.base, offset, dtype='<i', binpoint=13) 
+        idx = np.arange(self.nCh)[chNo]
+        _write_channels(self.base, idx, self.offset[idx], dtype='<i4', binpoint=13, mem=self.mem)
 
     def __getitem__(self, chNo):
-        ch = chNo+self.base
-        return read_thr_32(ch, dtype='<i', binpoint=13)
+        return _read_channels(self.base+chNo, 1, dtype='<i4', binpoint=13, mem=self.mem)[0]
 
     def __eq__(self, val):
         for ch in range(self.nCh):
@@ -152,10 +146,7 @@ class offset(object):
         return self.hash_repr
 
     def to_numpy(self):
-        offset = []
-        for i in range(self.nCh):
-            offset.append(self.__getitem__(i))
-        return np.stack(offset)
+        return _read_channels(self.base, self.nCh, dtype='<i4', binpoint=13, mem=self.mem)
 
 
     __repr__ = __str__
@@ -175,22 +166,26 @@ class channel_hash(object):
     Currently, the base address shift is 128, because the first 128 slot is used by threshold
     """
     
-    def __init__(self, nCh=32, base_address=256):
+    def __init__(self, nCh=32, base_address=256, mem=None):
         self.nCh  = nCh
         self.base = base_address
         self.ch_unigroup = np.zeros(nCh)
+        self.mem = mem
 
     def __setitem__(self, chNo, ch_group):
-        ch_nn0, ch_nn1, ch_nn2, ch_nn3 = ch_group
-        # print ch_nn0, ch_nn1, ch_nn2, ch_nn3
-        x = struct.unpack('<I', struct.pack('BBBB', 
-                                            ch_nn0, ch_nn1, ch_nn2, ch_nn3))[0]
-        ch = chNo+self.base
-        write_thr_32(ch, x, dtype='<I', binpoint=0) 
+        '''
+        ch_hash[ch] = (ch_nn0, ch_nn1, ch_nn2, ch_nn3)
+        ch_hash[a:b] = (b-a, 4) array
+        '''
+        idx = np.arange(self.nCh)[chNo]
+        ch_group = np.asarray(ch_group).reshape(-1, 4)
+        if ch_group.min() < 0 or ch_group.max() > 255:
+            raise struct.error('ubyte format requires 0 <= number <= 255')
+        words = np.ascontiguousarray(ch_group.astype('u1')).view('<u4').ravel()
+        _write_channels(self.base, idx, words, dtype='<u4', binpoint=0, mem=self.mem)
 
     def __getitem__(self, chNo):
-        ch = chNo+self.base
-        x = read_thr_32(ch, dtype='<I', binpoint=0)
+        x = _thr(self.mem).read(self.base+chNo, 1).view('<u4')[0]
         return struct.unpack('BBBB', struct.pack('<I', int(x)))
 
     def __str__(self):
@@ -200,10 +195,8 @@ class channel_hash(object):
         return self.hash_repr
 
     def to_numpy(self):
-        ch_hash = []
-        for i in range(self.nCh):
-            ch_hash.append(self.__getitem__(i))
-        return np.stack(ch_hash)
+        words = _thr(self.mem).read(self.base, self.nCh).view('<u4')
+        return words.view('u1').reshape(self.nCh, 4).astype(np.int64)
 
 
     __repr__ = __str__
@@ -230,12 +223,13 @@ class threshold(object):
     thres_arr = np.array([3.1,2,4,6.5])
     thres[:] = thres_arr
     """
-    def __init__(self, nCh=32):
+    def __init__(self, nCh=32, mem=None):
         # self.enable_reg_addres = 0
         self.nCh = nCh
         # thr_reset(nCh)
         # self.enable(True)
         self.thres = np.zeros(nCh)
+        self.mem = mem
 
     # def enable(self, flag):
     #     if flag is True:
@@ -245,25 +239,11 @@ class threshold(object):
 
     def __setitem__(self, chNo, thr):
         self.thres[chNo] = thr 
-        if type(chNo) is slice:
-            if chNo == slice(None,None,None): 
-                for ch in np.arange(self.nCh):
-                    if np.size(thr) == 1:
-                        write_thr_32(ch, thr,     dtype='<i', binpoint=13)
-                    else:
-                        write_thr_32(ch, thr[ch], dtype='<i', binpoint=13)
-            else:
-                for i, ch in enumerate(np.arange(chNo.start, chNo.stop, chNo.step)):
-                    if np.size(thr) == 1:
-                        write_thr_32(ch, thr,     dtype='<i', binpoint=13)
-                    else:
-                        write_thr_32(ch, thr[i], dtype='<i', binpoint=13) 
-
-        else:
-            write_thr_32(chNo, thr, dtype='<i', binpoint=13) 
+        idx = np.arange(self.nCh)[chNo]
+        _write_channels(0, idx, self.thres[idx], dtype='<i4', binpoint=13, mem=self.mem)
 
     def __getitem__(self, chNo):
-        return read_thr_32(chNo, dtype='<i', binpoint=13) 
+        return _read_channels(chNo, 1, dtype='<i4', binpoint=13, mem=self.mem)[0]
 
     def __eq__(self, val):
         for ch in range(self.nCh):
@@ -278,8 +258,6 @@ class threshold(object):
     __repr__ = __str__
 
     def to_numpy(self):
-        self.array = np.zeros((self.nCh,))
-        for i in range(self.nCh):
-            self.array[i] = self.__getitem__(i)
+        self.array = _read_channels(0, self.nCh, dtype='<i4', binpoint=13, mem=self.mem)
         return self.array
 
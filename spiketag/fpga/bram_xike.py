@@ -2,6 +2,14 @@ from spiketag.fpga.memory_api import *
 import numpy as np
 import struct
 
+
+def _tat(mem):
+    '''
+    the memory behind the model RAM hashes: `mem` (e.g. a shadow_mem) or the template_32 device
+    '''
+    return device('template_32') if mem is None else mem
+
+
 class pca_hash(object):
     """
     address: 128 - 1952(128+76*32)
@@ -30,11 +38,13 @@ class pca_hash(object):
     In FPGA side, pca[ch] is ndim 32 bits, each 32 bits are composed by 4*8bits:(pca0,pca1,pca2,pca3)
     write_pca_in and read_pca_out function write and read one 32 bits into FPGA memory
     """
-    def __init__(self, nCh=32, base_address=128, ndim=76):
+    def __init__(self, nCh=32, base_address=128, ndim=76, verify=False, mem=None):
         self.nCh  = nCh
         self.base = base_address
         self.pca = np.zeros(nCh)
         self.dim = ndim 
+        self.verify = verify
+        self.mem = mem
 
     def write_pca_in(self, i, pca_in):
         # print i, pca_in
@@ -43,44 +53,31 @@ class pca_hash(object):
         pca0, pca1, pca2, pca3 = pca_in
         x = struct.unpack('<i', struct.pack('4b', 
                                             pca0, pca1, pca2, pca3))[0]
-        write_tat_32(i, x, dtype='<i', binpoint=0) 
+        _tat(self.mem).write(i, [x])
 
     def __setitem__(self, grpNo, pca_comp):
         ch = grpNo*self.dim + self.base
-        for i, pca_in in enumerate(pca_comp):
-            self.write_pca_in(ch+i, pca_in)
+        _tat(self.mem).write(ch, pack_int8x4(pca_comp), verify=self.verify)
         
     def read_pca_out(self, i):
-        x = read_tat_32(i, dtype='<i', binpoint=0)
+        x = _tat(self.mem).read(i, 1)[0]
         y = struct.unpack('bbbb', struct.pack('<i', int(x)))
         y = np.asarray(y).astype(np.float32)
         y = y/(2**7)
         return y
 
     def __getitem__(self, grpNo):
-        pca_comp = np.zeros((self.dim, 4))
         ch = grpNo*self.dim + self.base
-        for i in range(self.dim):
-            pca_comp[i] = self.read_pca_out(ch+i)
-        return pca_comp
+        return unpack_int8x4(_tat(self.mem).read(ch, self.dim)).astype(np.float64)
 
     def get_hex(self, grpNo):
-        pca_comp_hex = []
         ch = grpNo*self.dim + self.base
-        for i in range(self.dim):
-            addr = (ch+i) * 4
-            r32 = open('/dev/xillybus_template_32', 'rb')
-            r32.seek(addr)
-            hexstring = r32.read(4)
-            pca_comp_hex.append(hexstring)
-            r32.close()     
-        return pca_comp_hex
+        buf = _tat(self.mem).read(ch, self.dim).tobytes()
+        return [buf[4*i:4*i+4] for i in range(self.dim)]
 
     def to_numpy(self):
-        pca = []
-        for i in range(self.nCh):
-            pca.append( self.__getitem__(i) )
-        return np.stack(pca)
+        pca = unpack_int8x4(_tat(self.mem).read(self.base, self.nCh*self.dim))
+        return pca.reshape(self.nCh, self.dim, 4).astype(np.float64)
 
 
          
@@ -89,24 +86,22 @@ class shift_hash(object):
     """
     32-127
     """
-    def __init__(self, nCh=32, base_address=32):
+    def __init__(self, nCh=32, base_address=32, verify=False, mem=None):
         self.nCh = nCh
         self.base = base_address
         self.dim   = 4
+        self.verify = verify
+        self.mem = mem
         # for i in range(self.nCh):
         #     self.__setitem__(i,np.zeros(self.dim,))
         
     def __setitem__(self, chNo, shift):
         ch = chNo*self.dim + self.base
-        for i, _shift in enumerate(shift):
-            write_tat_32(ch+i, _shift, dtype='<i', binpoint=19)
+        _tat(self.mem).write(ch, to_fixed_point_array(shift, binpoint=19), verify=self.verify)
 
     def __getitem__(self, chNo):
         ch = chNo*self.dim + self.base
-        x = []
-        for i in range(self.dim):
-            x.append(read_tat_32(ch+i, dtype='<i', binpoint=19))
-        return np.array(x)
+        return to_value_array(_tat(self.mem).read(ch, self.dim), binpoint=19)
 
     def __repr__(self):
         _shift = np.zeros((self.nCh, self.dim))
@@ -116,10 +111,8 @@ class shift_hash(object):
         return ' '
 
     def to_numpy(self):
-        shift = []
-        for i in range(self.nCh):
-            shift.append( self.__getitem__(i) )
-        return np.stack(shift)
+        shift = to_value_array(_tat(self.mem).read(self.base, self.nCh*self.dim), binpoint=19)
+        return shift.reshape(self.nCh, self.dim)
 
 
 
@@ -127,21 +120,21 @@ class scale_hash(object):
     """
     0-31
     """
-    def __init__(self, nCh=32, base_address=0):
+    def __init__(self, nCh=32, base_address=0, mem=None):
         self.nCh = nCh
         self.base = base_address
         self.dim = 1
+        self.mem = mem
         # for i in range(self.nCh):
         #     self.__setitem__(i,0)
 
     def __setitem__(self, chNo, _scale):
         ch = chNo + self.base
-        write_tat_32(ch, _scale, dtype='<i', binpoint=19) 
+        _tat(self.mem).write(ch, to_fixed_point_array([_scale], binpoint=19))
 
     def __getitem__(self, chNo):
         ch = chNo + self.base
-        x0 = read_tat_32(ch, dtype='<i', binpoint=19) 
-        return x0
+        return to_value_array(_tat(self.mem).read(ch, 1), binpoint=19)[0]
 
     def __repr__(self):
         _scale = np.zeros((self.nCh, self.dim))
@@ -151,10 +144,7 @@ class scale_hash(object):
         return ' '
 
     def to_numpy(self):
-        scale = []
-        for i in range(self.nCh):
-            scale.append( self.__getitem__(i) )
-        return np.stack(scale)
+        return to_value_array(_tat(self.mem).read(self.base, self.nCh), binpoint=19)
 
 
 class vq_hash(object):
@@ -165,11 +155,13 @@ class vq_hash(object):
     In FPGA:       the vq[ch] is organized as a memory structure in bram_thres module in Xike
     Currently, the base address shift is 1952 = 128 + 57*32
     """
-    def __init__(self, nCh=32, base_address=1952, ndim=500):
+    def __init__(self, nCh=32, base_address=1952, ndim=500, verify=False, mem=None):
         self.nCh  = nCh
         self.base = base_address
         self.vq   = np.zeros(nCh)
         self.dim  = ndim
+        self.verify = verify
+        self.mem = mem
 
     def write_vq_in(self, i, vq_in):
         vq_in = np.floor(np.asarray(vq_in)*2**7)
@@ -178,33 +170,27 @@ class vq_hash(object):
         x = struct.unpack('<i', struct.pack('bbbb', 
                                             vq0, vq1, vq2, vq3))[0]
         ch = i + self.base
-        write_tat_32(ch, x, dtype='<i', binpoint=0) 
+        _tat(self.mem).write(ch, [x])
 
     def read_vq_out(self, i):
         ch = i + self.base
-        x = read_tat_32(ch, dtype='<i', binpoint=0)
+        x = _tat(self.mem).read(ch, 1)[0]
         y = struct.unpack('bbbb', struct.pack('<i', int(x)))
         y = np.asarray(y).astype(np.float32)
         y = y/(2**7)
         return y
 
     def __setitem__(self, grpNo, vq):
-        ch = grpNo*self.dim
-        for i, vq_in in enumerate(vq):
-            self.write_vq_in(ch+i, vq_in)
+        ch = grpNo*self.dim + self.base
+        _tat(self.mem).write(ch, pack_int8x4(vq), verify=self.verify)
  
     def __getitem__(self, grpNo):
-        vq = np.zeros((self.dim, 4))
-        ch = grpNo*self.dim
-        for i in range(self.dim):
-            vq[i] = self.read_vq_out(ch+i)
-        return vq
+        ch = grpNo*self.dim + self.base
+        return unpack_int8x4(_tat(self.mem).read(ch, self.dim)).astype(np.float64)
 
     def to_numpy(self):
-        vq = []
-        for i in range(self.nCh):
-            vq.append( self.__getitem__(i) )
-        return np.stack(vq)
+        vq = unpack_int8x4(_tat(self.mem).read(self.base, self.nCh*self.dim))
+        return vq.reshape(self.nCh, self.dim, 4).astype(np.float64)
 
 
 class label_hash(object):
@@ -215,33 +201,31 @@ class label_hash(object):
     In FPGA:       the label[ch] is organized as a memory structure in bram_thres module in Xike
     Currently, the base address shift is 1952 = 128 + 57*32
     """
-    def __init__(self, nCh=32, base_address=1952, ndim=500):
+    def __init__(self, nCh=32, base_address=1952, ndim=500, verify=False, mem=None):
         self.nCh  = nCh
         self.base = base_address
         self.lb   = np.zeros(nCh)
         self.dim  = ndim
+        self.verify = verify
+        self.mem = mem
 
     def write_lb_in(self, i, lb_in):
         lb_in = lb_in.astype(np.int32)
         ch = i + self.base
-        write_tat_32(ch, lb_in, dtype='<i', binpoint=0) 
+        _tat(self.mem).write(ch, [lb_in])
 
     def read_lb_out(self, i):
         ch = i + self.base
-        lb = read_tat_32(ch, dtype='<i', binpoint=0)
+        lb = _tat(self.mem).read(ch, 1)[0]
         return lb
 
     def __setitem__(self, grpNo, lb):
-        ch = grpNo*self.dim
-        for i, lb_in in enumerate(lb):
-            self.write_lb_in(ch+i, lb_in)
+        ch = grpNo*self.dim + self.base
+        _tat(self.mem).write(ch, np.asarray(lb).astype(np.int32), verify=self.verify)
  
     def __getitem__(self, grpNo):
-        lb = np.zeros((self.dim,)).astype(np.int32)
-        ch = grpNo*self.dim
-        for i in range(self.dim):
-            lb[i] = self.read_lb_out(ch+i)
-        return lb
+        ch = grpNo*self.dim + self.base
+        return _tat(self.mem).read(ch, self.dim)
 
     def __repr__(self):
         # self._labels = np.zeros((self.nCh, self.dim))
@@ -251,12 +235,9 @@ class label_hash(object):
         return self._labels
 
     def to_numpy(self):
-        self.array = []
-        for i in range(self.nCh):
-            self.array.append(list(self.__getitem__(i)))
-        return np.array(self.array)
+        self.array = _tat(self.mem).read(self.base, self.nCh*self.dim).reshape(self.nCh, self.dim)
+        return self.array
 
     def from_numpy(self, array):
-        for i in range(self.nCh):
-            self.__setitem__(i, array[i])       
+        _tat(self.mem).write(self.base, np.asarray(array).astype(np.int32), verify=self.verify)
             
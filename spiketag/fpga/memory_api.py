@@ -1,52 +1,401 @@
 import numpy as np
+import os
 import struct
 from binascii import hexlify
+from contextlib import contextmanager
+
+
+########### device handles #########################
+'''
+Every xillybus memory device (e.g. /dev/xillybus_template_32) is opened once
+and kept open, registers are accessed as contiguous blocks of words from/to numpy arrays.
+
+The backend of the devices is chosen by `set_backend` or the SPIKETAG_FPGA_BACKEND environment variable:
+    'xillybus'        the PCIe board (/dev/xillybus_*), default
+    'file:<folder>'   every device is a local file <folder>/xillybus_<name>, streams are files or FIFOs there
+    'sim'             every device is an in-process buffer, streams are in-process pipes
+'''
+XILLYBUS_PATH = '/dev/xillybus_{}'
+
+# bytes of each memory device, following the address maps of bram_xike and bram_thres
+DEVICE_SIZE = {'template_32':     2**16 * 4,   # model RAM [15:0]: scale, shift, pca, vq, label
+               'thr_32':          2**11 * 4,   # threshold, ch_hash, offset, chgpNo, ch_ref
+               'mem_16':          2**5  * 2,   # mem_16 [4:0]
+               'control_regs_16': 2**5  * 2}
+
+class xillybus_mem(object):
+    '''
+    long-lived read and write handles on one xillybus memory device
+
+    mem = device('template_32')
+    mem.write(128, words)          # words: numpy array, written from address 128 on
+    words = mem.read(128, 76)      # 76 words from address 128
+    '''
+    def __init__(self, name, dtype='<i4'):
+        self.name  = name
+        self.path  = XILLYBUS_PATH.format(name)
+        self.dtype = np.dtype(dtype)
+        self._r = None
+        self._w = None
+
+    def _reader(self):
+        if self._r is None or self._r.closed:
+            self._r = open(self.path, 'rb', buffering=0)
+        return self._r
+
+    def _writer(self):
+        if self._w is None or self._w.closed:
+            self._w = os.fdopen(os.open(self.path, os.O_WRONLY), 'wb', buffering=0)
+        return self._w
+
+    def write_bytes(self, addr, data):
+        w = self._writer()
+        w.seek(addr)
+        w.write(data)
+        w.write(b'')   # zero-length write flushes the xillybus stream
+
+    def read_bytes(self, addr, nbytes):
+        r = self._reader()
+        r.seek(addr)
+        buf = bytearray()
+        while len(buf) < nbytes:
+            chunk = r.read(nbytes - len(buf))
+            if not chunk:
+                raise IOError('{}: read {} of {} bytes at {}'.format(self.path, len(buf), nbytes, addr))
+            buf += chunk
+        return bytes(buf)
+
+    def write(self, offset, words, verify=False):
+        words = np.ascontiguousarray(words, dtype=self.dtype).ravel()
+        self.write_bytes(offset * self.dtype.itemsize, words.tobytes())
+        if verify:
+            readback = self.read(offset, words.shape[0])
+            if not np.array_equal(readback, words):
+                bad = np.where(readback != words)[0]
+                raise IOError('{}: verify failed at {} addresses, first {}'.format(self.path, len(bad), offset+bad[0]))
+
+    def read(self, offset, n):
+        buf = self.read_bytes(offset * self.dtype.itemsize, n * self.dtype.itemsize)
+        return np.frombuffer(buf, dtype=self.dtype).copy()
+
+    def close(self):
+        for f in (self._r, self._w):
+            if f is not None:
+                f.close()
+        self._r, self._w = None, None
+
+
+class file_mem(xillybus_mem):
+    '''
+    a local file standing for a xillybus memory device, created zero-filled with the device size
+    '''
+    def __init__(self, name, dtype='<i4', folder='.'):
+        super(file_mem, self).__init__(name, dtype)
+        self.path = os.path.join(folder, 'xillybus_' + name)
+        size = DEVICE_SIZE.get(name, 0)
+        if not os.path.exists(self.path) or os.path.getsize(self.path) < size:
+            with open(self.path, 'ab') as f:
+                f.truncate(size)
+
+
+class sim_mem(xillybus_mem):
+    '''
+    an in-process buffer standing for a xillybus memory device
+    '''
+    def __init__(self, name, dtype='<i4'):
+        super(sim_mem, self).__init__(name, dtype)
+        self.path = 'sim://xillybus_' + name
+        self.buf = bytearray(DEVICE_SIZE.get(name, 0))
+
+    def _check(self, addr, nbytes):
+        if addr < 0 or addr + nbytes > len(self.buf):
+            raise IOError('{}: address {} + {} bytes out of the {} bytes device'.format(self.path, addr, nbytes, len(self.buf)))
+
+    def write_bytes(self, addr, data):
+        self._check(addr, len(data))
+        self.buf[addr:addr+len(data)] = data
+
+    def read_bytes(self, addr, nbytes):
+        self._check(addr, nbytes)
+        return bytes(self.buf[addr:addr+nbytes])
+
+    def close(self):
+        pass
+
+
+_backend = os.environ.get('SPIKETAG_FPGA_BACKEND', 'xillybus')
+_devices = {}
+_sim_streams = {}
+
+def set_backend(backend='xillybus'):
+    '''
+    'xillybus', 'file:<folder>' or 'sim' (see above), the opened devices are closed
+    '''
+    global _backend
+    if backend not in ('xillybus', 'sim') and not backend.startswith('file:'):
+        raise ValueError("unknown fpga backend {}, use 'xillybus', 'file:<folder>' or 'sim'".format(backend))
+    close_devices()
+    for r, w in _sim_streams.values():
+        os.close(r)
+        os.close(w)
+    _sim_streams.clear()
+    _backend = backend
+
+def get_backend():
+    return _backend
+
+def device(name, dtype='<i4'):
+    '''
+    the shared handle of a xillybus memory device (opened on first access)
+    '''
+    if name not in _devices:
+        if _backend == 'sim':
+            _devices[name] = sim_mem(name, dtype)
+        elif _backend.startswith('file:'):
+            _devices[name] = file_mem(name, dtype, folder=_backend[len('file:'):])
+        else:
+            _devices[name] = xillybus_mem(name, dtype)
+    return _devices[name]
+
+def open_stream(name, mode='rb', buffering=-1):
+    '''
+    open a xillybus stream endpoint (e.g. 'fet_clf_32') of the current backend,
+    the 'file:' backend creates a FIFO if the file does not exist yet
+    '''
+    if _backend == 'sim':
+        if name not in _sim_streams:
+            _sim_streams[name] = os.pipe()
+        r, w = _sim_streams[name]
+        return os.fdopen(r if 'r' in mode else w, mode, buffering=buffering, closefd=False)
+    elif _backend.startswith('file:'):
+        path = os.path.join(_backend[len('file:'):], 'xillybus_' + name)
+        if not os.path.exists(path):
+            os.mkfifo(path)
+        return open(path, mode, buffering=buffering)
+    else:
+        return open(XILLYBUS_PATH.format(name), mode, buffering=buffering)
+
+def close_devices():
+    for mem in _devices.values():
+        mem.close()
+    _devices.clear()
+
+
+class shadow_mem(object):
+    '''
+    host-side image of a xillybus memory device, with the same read/write interface as `device(name)`
+
+    write only sends the words that differ from the image (in contiguous runs, runs closer than
+    `gap` words are merged into one write), read is served from the image once the words are known.
+    Inside `with mem.batch():` writes are only staged, and the net difference is written at exit,
+    so overwriting a block and then restoring it costs nothing. The words staged with verify=True
+    are read back when they are written at exit.
+
+    The image assumes this object is the only writer of the device, call `invalidate()`
+    if the device was written by anything else (another process, a reset of the board).
+    '''
+    def __init__(self, name, dtype='<i4', gap=8):
+        self.name  = name
+        self.dtype = np.dtype(dtype)
+        self.gap   = gap
+        n = DEVICE_SIZE[name] // self.dtype.itemsize
+        self.image = np.zeros(n, dtype=self.dtype)
+        self.valid = np.zeros(n, dtype=bool)     # the image word is known to equal the device word
+        self._stage = None
+        self._touched = None
+        self._verify = None                      # staged words to read back after they are written
+        self._depth = 0
+        self.n_written = 0                       # words sent to the device so far
+
+    @property
+    def device(self):
+        return device(self.name, self.dtype)
+
+    def invalidate(self, offset=0, n=None):
+        n = self.image.shape[0] - offset if n is None else n
+        self.valid[offset:offset+n] = False
+
+    def preload(self, words, offset=0):
+        '''
+        take words as the device content from offset on (e.g. a saved image), without any device access
+        '''
+        words = np.asarray(words, dtype=self.dtype).ravel()
+        self.image[offset:offset+words.shape[0]] = words
+        self.valid[offset:offset+words.shape[0]] = True
+
+    def _sync(self, offset, n):
+        unknown = np.where(~self.valid[offset:offset+n])[0]
+        if unknown.shape[0] > 0:
+            lo, hi = offset + unknown[0], offset + unknown[-1] + 1
+            words = self.device.read(lo, hi - lo)
+            missing = ~self.valid[lo:hi]
+            self.image[lo:hi][missing] = words[missing]
+            self.valid[lo:hi] = True
+
+    def read(self, offset, n):
+        self._sync(offset, n)
+        if self._stage is not None:
+            sl = slice(offset, offset+n)
+            untouched = ~self._touched[sl]
+            self._stage[sl][untouched] = self.image[sl][untouched]
+            return self._stage[sl].copy()
+        return self.image[offset:offset+n].copy()
+
+    def write(self, offset, words, verify=False):
+        words = np.ascontiguousarray(words, dtype=self.dtype).ravel()
+        sl = slice(offset, offset+words.shape[0])
+        if sl.stop > self.image.shape[0]:
+            raise IOError('{}: address {} + {} words out of the device'.format(self.name, offset, words.shape[0]))
+        if self._stage is not None:
+            self._stage[sl] = words
+            self._touched[sl] = True
+            self._verify[sl] |= verify
+            return
+        changed = np.zeros(self.image.shape[0], dtype=bool)
+        changed[sl] = ~self.valid[sl] | (self.image[sl] != words)
+        self.image[sl] = words
+        self._flush(changed, verify)
+
+    def _flush(self, changed, verify=False):
+        '''
+        verify: True, or a mask of the words to read back (a run is verified if any of its words is)
+        '''
+        idx = np.where(changed)[0]
+        if idx.shape[0] == 0:
+            return
+        self.valid[idx] = True
+        # merge two runs when the words between them are few and known (rewritten with the same value)
+        unknown = np.concatenate(([0], np.cumsum(~self.valid)))
+        gaps = np.diff(idx) - 1
+        merge = (gaps <= self.gap) & (unknown[idx[1:]] - unknown[idx[:-1]+1] == 0)
+        breaks = np.where(~merge)[0] + 1
+        for run in np.split(idx, breaks):
+            lo, hi = run[0], run[-1] + 1
+            run_verify = verify if isinstance(verify, bool) else bool(verify[lo:hi].any())
+            self.device.write(lo, self.image[lo:hi], verify=run_verify)
+            self.n_written += hi - lo
+
+    @contextmanager
+    def batch(self):
+        self._begin()
+        try:
+            yield self
+        except:
+            self._end(commit=False)
+            raise
+        self._end(commit=True)
+
+    def _begin(self):
+        if self._depth == 0:
+            self._stage = self.image.copy()
+            self._touched = np.zeros(self.image.shape[0], dtype=bool)
+            self._verify = np.zeros(self.image.shape[0], dtype=bool)
+        self._depth += 1
+
+    def _end(self, commit=True):
+        self._depth -= 1
+        if self._depth > 0:
+            return
+        stage, touched, verify = self._stage, self._touched, self._verify
+        self._stage, self._touched, self._verify = None, None, None
+        if commit:
+            changed = touched & (~self.valid | (self.image != stage))
+            self.image[changed] = stage[changed]
+            self._flush(changed, verify & changed)
+####################################################
+
+
+########### memory images #########################
+'''
+A memory image is {device name: all words of the device} (e.g. FPGA.snapshot()),
+it is saved as a compressed npz file together with its format version.
+'''
+FPGA_IMAGE_VERSION = 1
+WORD_DTYPE = {'mem_16': '<i2', 'control_regs_16': '<i2'}   # the others are 32 bits
+
+def read_image(names=('thr_32', 'template_32')):
+    '''
+    read every word of the devices, one block read per device
+    '''
+    image = {}
+    for name in names:
+        dtype = np.dtype(WORD_DTYPE.get(name, '<i4'))
+        image[name] = device(name, dtype).read(0, DEVICE_SIZE[name] // dtype.itemsize)
+    return image
+
+def write_image(image, verify=False):
+    '''
+    write back every device of the image, one block write per device
+    '''
+    for name, words in image.items():
+        device(name, words.dtype).write(0, words, verify=verify)
+
+def save_image(image, filename):
+    with open(filename, 'wb') as f:
+        np.savez_compressed(f, fpga_image_version=FPGA_IMAGE_VERSION, **image)
+
+def load_image(filename):
+    '''
+    load an image saved by `save_image`, raise ValueError if filename is not an image
+    '''
+    try:
+        npz = np.load(filename, allow_pickle=False)
+    except (ValueError, OSError):
+        raise ValueError('{} is not an fpga memory image'.format(filename))
+    with npz:
+        if 'fpga_image_version' not in npz.files:
+            raise ValueError('{} is not an fpga memory image'.format(filename))
+        version = int(npz['fpga_image_version'])
+        if version > FPGA_IMAGE_VERSION:
+            raise ValueError('{} has image version {}, this spiketag reads up to {}'.format(filename, version, FPGA_IMAGE_VERSION))
+        return {name: npz[name] for name in npz.files if name != 'fpga_image_version'}
+
+def diff_image(a, b):
+    '''
+    {device name: addresses where the words of image a and b differ}, devices only in one image are skipped
+    '''
+    return {name: np.where(a[name] != b[name])[0] for name in a if name in b}
 
 
 ########### transformation and template #############
 def write_tat_32(offset, v, dtype='<i', binpoint=14):
-    addr = offset * 4
-    w32 = open('/dev/xillybus_template_32', 'wb')
     value = to_fixed_point(v, dtype, binpoint)
     # print 'mem content:', hexlify(value)
-    w32.seek(addr)
-    w32.write(value)
-    w32.close()
+    device('template_32').write_bytes(offset * 4, value)
 
 def read_tat_32(offset, dtype='<i', binpoint=14):
-    addr = offset * 4
-    r32 = open('/dev/xillybus_template_32', 'rb')
-    r32.seek(addr)
-    hexstring = r32.read(4)
+    hexstring = device('template_32').read_bytes(offset * 4, 4)
     # print 'mem content:', hexlify(hexstring)
     value = to_value(hexstring, dtype, binpoint)
-    r32.close()     
     return value 
 
+def write_tat_block(offset, words, dtype='<i4', verify=False):
+    device('template_32').write(offset, np.asarray(words).astype(dtype).view('<i4'), verify=verify)
+
+def read_tat_block(offset, n, dtype='<i4'):
+    return device('template_32').read(offset, n).view(dtype)
+
 
 ########### thr and ch hash #########################
 def write_thr_32(offset, v, dtype='<i', binpoint=14):
-    addr = offset * 4
-    w32 = open('/dev/xillybus_thr_32', 'wb')
     value = to_fixed_point(v, dtype, binpoint)
     # print 'mem content:', hexlify(value)
-    w32.seek(addr)
-    w32.write(value)
-    w32.close()        
+    device('thr_32').write_bytes(offset * 4, value)
 
 def read_thr_32(offset, dtype='<i', binpoint=14):
-    addr = offset * 4
-    r32 = open('/dev/xillybus_thr_32', 'rb')
-    r32.seek(addr)
-    hexstring = r32.read(4)
+    hexstring = device('thr_32').read_bytes(offset * 4, 4)
     # print 'mem content:', hexlify(hexstring)
     value = to_value(hexstring, dtype, binpoint)
-    r32.close()     
     return value 
 
+def write_thr_block(offset, words, dtype='<i4', verify=False):
+    device('thr_32').write(offset, np.asarray(words).astype(dtype).view('<i4'), verify=verify)
+
+def read_thr_block(offset, n, dtype='<i4'):
+    return device('thr_32').read(offset, n).view(dtype)
+
 def thr_reset(nCh):
-    for addr in np.arange(nCh):
-        write_thr_32(addr, 0, '<i', 0)
+    write_thr_block(0, np.zeros(nCh))
 ####################################################
 
 
@@ -57,25 +406,20 @@ This RAM is used for setting some communication variable
 between PC and FPGA. 
 '''
 def write_mem_16(offset, v, dtype='<h', binpoint=0):
-    addr = offset * 2
-    w16 = open('/dev/xillybus_mem_16', 'wb')
     value = to_fixed_point(v, dtype, binpoint)
     # print 'mem content:', hexlify(value)
-    w16.seek(addr)
-    w16.write(value)
-    w16.close()
+    device('mem_16', '<i2').write_bytes(offset * 2, value)
 
 def read_mem_16(offset, dtype='<h', binpoint=0):
-    addr = offset * 2
-    r16 = open('/dev/xillybus_mem_16', 'rb')
-    r16.seek(addr)
-    hexstring = r16.read(2)
+    hexstring = device('mem_16', '<i2').read_bytes(offset * 2, 2)
     # print 'mem content:', hexlify(hexstring)
     value = to_value(hexstring, dtype, binpoint)
-    r16.close() 
     # value is always XXX.0 when binpoint = 0
     return int(value)
 
+def read_mem_16_block(offset, n):
+    return device('mem_16', '<i2').read(offset, n)
+
 def mem_reset(nCh):
     for addr in np.arange(nCh):
         write_reg_16(addr, 0x0000, '<i', 0)
@@ -84,22 +428,14 @@ def mem_reset(nCh):
 
 ############ xillybus_control_regs_16 #######################
 def write_regs_16(offset, v, dtype='<h', binpoint=0):
-    addr = offset * 2
-    w16 = open('/dev/xillybus_control_regs_16', 'wb')
     value = to_fixed_point(v, dtype, binpoint)
     # print 'mem content:', hexlify(value)
-    w16.seek(addr)
-    w16.write(value)
-    w16.close()
+    device('control_regs_16', '<i2').write_bytes(offset * 2, value)
 
 def read_reg_16(offset, dtype='<h', binpoint=0):
-    addr = offset * 2
-    r16 = open('/dev/xillybus_control_regs_16', 'rb')
-    r16.seek(addr)
-    hexstring = r16.read(2)
+    hexstring = device('control_regs_16', '<i2').read_bytes(offset * 2, 2)
     # print 'mem content:', hexlify(hexstring)
     value = to_value(hexstring, dtype, binpoint)
-    r16.close() 
     # value is always XXX.0 when binpoint = 0
     return int(value)
 
@@ -121,6 +457,27 @@ def to_value(hexstring, dtype='<i', binpoint=13):
     value = float(value[0]) / 2**binpoint
     return value
 
+def to_fixed_point_array(v, dtype='<i4', binpoint=13):
+    '''
+    vectorized to_fixed_point, returns the words as numpy array
+    '''
+    return np.trunc(np.asarray(v, dtype=np.float64) * 2**binpoint).astype(np.int64).astype(dtype)
+
+def to_value_array(words, binpoint=13):
+    return np.asarray(words).astype(np.float64) / 2**binpoint
+
+def pack_int8x4(x, binpoint=7):
+    '''
+    (n, 4) matrix ==> (n,) 32 bits words, each word holds 4*8bits (x0, x1, x2, x3) fixed point
+    '''
+    q = np.floor(np.asarray(x) * 2**binpoint).astype(np.int32).reshape(-1, 4)
+    if q.size > 0 and (q.min() < -128 or q.max() > 127):
+        raise struct.error('int8 format requires -128 <= number <= 127')
+    return np.ascontiguousarray(q.astype('<i1')).view('<i4').ravel()
+
+def unpack_int8x4(words, binpoint=7):
+    return np.asarray(words, dtype='<i4').view('<i1').reshape(-1, 4).astype(np.float32) / 2**binpoint
+
 def to2scomp(v, dtype='<i'):
     value = hexlify(struct.pack(dtype,v))
     return value
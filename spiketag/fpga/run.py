@@ -1,6 +1,7 @@
 import os 
 import io
 import time
+from .memory_api import open_stream
 
 '''
 through `/dev/xillybus_fet_clf_32` each spike will generate 7 datum:
@@ -13,7 +14,7 @@ def run():
     the shared memory with other processors: shared_arr 
     '''
     # r32 = pcie_recv_open()
-    r32 = io.open('/dev/xillybus_fet_clf_32', 'rb')
+    r32 = open_stream('fet_clf_32', 'rb')
     r32_buf = io.BufferedReader(r32)
     fd = os.open("./fet.bin", os.O_CREAT | os.O_WRONLY | os.O_NONBLOCK)
     num = 0
@@ -0,0 +1,107 @@
+import unittest
+import numpy as np
+from spiketag.fpga import memory_api
+from spiketag.fpga import FPGA
+
+
+class TestFPGASim(unittest.TestCase):
+    '''
+    exercise the FPGA register paths on the in-process xillybus simulator
+    '''
+    def setUp(self):
+        memory_api.set_backend('sim')
+        self.fpga = FPGA()
+
+    def tearDown(self):
+        memory_api.set_backend('xillybus')
+
+    def test_transformer(self):
+        P = np.random.uniform(-0.9, 0.9, (76, 4))
+        b = np.array([0.5, -1.25, 3.3, -0.001])
+        self.fpga._config_FPGA_transformer(grpNo=3, P=P, b=b, a=0.25)
+        self.assertTrue(np.allclose(self.fpga.pca[3], np.floor(P*2**7)/2**7))
+        self.assertTrue(np.allclose(self.fpga.shift[3], b, atol=2**-19))
+        self.assertEqual(self.fpga.scale[3], 0.25)
+        self.assertTrue(np.allclose(self.fpga.pca.to_numpy()[3], self.fpga.pca[3]))
+
+    def test_vq_label(self):
+        vq = np.random.uniform(-1, 0.99, (500, 4))
+        label = np.random.randint(0, 20, 500)
+        self.fpga._config_FPGA_vq_knn(5, vq, label)
+        self.assertTrue(np.allclose(self.fpga.vq[5], np.floor(vq*2**7)/2**7))
+        self.assertListEqual(list(self.fpga.label[5]), list(label))
+        self.assertListEqual(list(self.fpga.label.to_numpy()[4]), [0]*500)
+
+    def test_thresholds(self):
+        thr = -np.arange(160) / 3.
+        self.fpga.thres[:] = thr
+        self.assertTrue(np.allclose(self.fpga.thres.to_numpy(), thr, atol=2**-13))
+        self.fpga.ch_ref[0:88] = 44.
+        self.assertEqual(self.fpga.ch_ref[87], 44)
+        self.assertTrue(np.allclose(self.fpga.dc.to_numpy(), 32))
+
+    def test_mem_16(self):
+        self.fpga.n_units = 12
+        self.assertEqual(self.fpga.n_units, 12)
+        self.assertEqual(self.fpga.mem_16[6], 12)
+
+    def test_differential_download(self):
+        vq = np.random.uniform(-1, 0.99, (500, 4))
+        label = np.random.randint(1, 20, 500)
+        with self.fpga.batch():
+            self.fpga._config_FPGA_vq_knn(2, vq, label)
+        n_written = self.fpga.model_ram.n_written
+        label[10:20] = 25
+        with self.fpga.batch():
+            self.fpga.label[2] = np.zeros(500)
+            self.fpga._config_FPGA_vq_knn(2, vq, label)
+        self.assertEqual(self.fpga.model_ram.n_written - n_written, 10)
+        self.fpga.sync()
+        self.assertListEqual(list(self.fpga.label[2]), list(label))
+        self.assertListEqual(list(self.fpga.configured_groups), [2])
+
+    def test_verify_in_batch(self):
+        '''
+        a device that drops the writes fails the verify of a batched download too
+        '''
+        fpga = FPGA(verify=True)
+        dev = memory_api.device(fpga.model_ram.name)
+        dev.write_bytes = lambda addr, data: None
+        vq = np.random.uniform(-1, 0.99, (500, 4))
+        label = np.random.randint(1, 20, 500)
+        with self.assertRaises(IOError):
+            fpga._config_FPGA_vq_knn(2, vq, label)
+        fpga.model_ram.invalidate()
+        with self.assertRaises(IOError):
+            with fpga.batch():
+                fpga._config_FPGA_vq_knn(3, vq, label)
+        # without verify the batch trusts the device
+        with self.fpga.batch():
+            self.fpga._config_FPGA_vq_knn(4, vq, label)
+
+    def test_snapshot_restore(self):
+        import os, tempfile
+        from spiketag.fpga import load_param
+        self.fpga.thres[:] = -60.
+        self.fpga._config_FPGA_vq_knn(1, np.random.uniform(-1, 0.99, (500, 4)), np.random.randint(1, 5, 500))
+        self.fpga.n_units = 4
+        filename = os.path.join(tempfile.mkdtemp(), 'rig.param')
+        self.fpga.save(filename)
+        self.assertTrue(np.array_equal(load_param(filename)['label'], self.fpga.label.to_numpy()))
+
+        self.fpga.label[1] = np.zeros(500)
+        self.fpga.thres[7] = -5000.
+        self.fpga.n_units = 0
+        diff = self.fpga.diff(filename)
+        self.assertListEqual(sorted(diff.keys()), ['label', 'mem_16', 'thres'])
+        self.assertListEqual(list(diff['label']), [1])
+        self.assertListEqual(list(diff['thres']), [7])
+
+        self.fpga.restore(filename, verify=True)
+        self.assertEqual(self.fpga.diff(filename), {})
+        self.assertEqual(self.fpga.n_units, 4)
+        self.assertEqual(self.fpga.thres[7], -60.)
+
+
+if __name__ == '__main__':
+    unittest.main()
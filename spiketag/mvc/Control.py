@@ -1,16 +1,16 @@
 import numpy as np
 import os
-from sklearn.neighbors import KDTree
 from tqdm import tqdm
 from ipywidgets import interact
 import matplotlib.pyplot as plt
-from .Model import MainModel
+from .Model import MainModel, clu_autosave, group_prefetch
 from ..analysis import spk_time_to_scv 
 from .View import MainView
-from ..base import CLU
+from ..base import CLU, unit_spike_index
 from ..utils import warning, conf, order_label, shift_label
 from ..utils.utils import Timer
 from ..base.SPK import _transform
+from ..core import build_codebooks
 from ..fpga import FPGA
 from ..analysis.place_field import place_field
 from ..view import scatter_3d_view
@@ -65,6 +65,10 @@ class controller(object):
         self.vq['scores'] = {}
         self._vq_npts = 500  # size of codebook to download to FPGA, there are many codebooks
 
+        self._autosave = None
+        self._unit_index = None
+        self._unit_dicts = (None, None)
+
         if fpga is True:
             # initialize FPGA channel grouping
             # both ch_hash and ch_grpNo are configured
@@ -75,6 +79,8 @@ class controller(object):
             
         if view is True:
             self.view  = MainView(prb=self.prb, model=self.model)
+            # view-ready data of the groups next to the one on screen, prepared in background
+            self.prefetch = group_prefetch(self.model, self._prepare_group)
 
             @self.view.prb.connect
             def on_select(group_id, chs):
@@ -195,8 +201,7 @@ class controller(object):
 
     @property
     def spk_spurious_score(self):
-        return np.mean(self.model.spk[self.current_group].max(axis=-1) - 
-                       self.model.spk[self.current_group].min(axis=-1), axis=1) / (2**13)
+        return self.model.spike_noise(self.current_group).spurious
 
     @property
     def fet(self):
@@ -218,7 +223,7 @@ class controller(object):
 
     @property
     def unit_done(self):
-        return sum(list(self.spk_times_all[1].values()))
+        return self.unit_index.n_units
 
     @property
     def unit_ready(self):
@@ -247,40 +252,49 @@ class controller(object):
         return spk_times
 
 
+    @property
+    def unit_index(self):
+        '''
+        spike times of the units in the `done` groups (see unit_spike_index), kept up to date by the clu events
+        '''
+        if self._unit_index is None or self._unit_index.clu is not self.model.clu \
+                                    or self._unit_index.spk_times is not self.model.spk.spk_time_dict:
+            self._unit_index = unit_spike_index(self.model.clu, self.model.spk.spk_time_dict, self.prb.fs)
+            self._unit_dicts = (None, None)
+        self._unit_index.groups = np.where(np.array(self.model.clu_manager.state_list)==3)[0]
+        return self._unit_index
+
     @property
     def spk_time(self):
-        self._spk_time = {}
-        cluNo = self.model.clu[self.current_group].index.keys()
-        for i in cluNo:
-            self._spk_time[i] = self.get_spk_times(cluster_id=i)
+        self._spk_time = self.unit_index.group_times(self.current_group)
         return self._spk_time
 
+    def _unit_times(self):
+        '''
+        ({grp_id: {unit: times}}, {grp_id: nclu}, {i: times}) of the unit index, rebuilt only after the index changed
+        '''
+        index = self.unit_index
+        version, dicts = self._unit_dicts
+        if version != index.version:
+            spk_times, nclu, in_one = {}, {}, {}
+            for g in index.groups:
+                spk_times[g], nclu[g] = {}, 0
+            for u, (g, clu_id) in enumerate(index.units):
+                spk_times[g][clu_id-1] = index[u]    # start from 0, the first cluster is noise
+                nclu[g] += 1
+                in_one[u] = index[u]
+            dicts = (spk_times, nclu, in_one)
+            self._unit_dicts = (index.version, dicts)
+        return dicts
 
     @property
     def spk_times_all(self):
-        self._spk_time_all = {}
-        self._nclu_all = {}
-        for grp_id in range(self.prb.n_group):
-            if self.model.clu_manager.state_list[grp_id]==3:
-                _spk_times = {}
-                cluNo = self.model.clu[grp_id].index.keys()
-                for i in cluNo:
-                    if i>0:  # first one is noise
-                        _spk_times[i-1] = self.get_spk_times(grp_id, cluster_id=i)  # start from 0
-                self._spk_time_all[grp_id] = _spk_times
-                self._nclu_all[grp_id] = len(cluNo) - 1 # first one is noise
+        self._spk_time_all, self._nclu_all, _ = self._unit_times()
         return self._spk_time_all, self._nclu_all
 
-
     @property
     def spk_times_all_in_one(self):
-        spk_times, _ = self.spk_times_all
-        i = 0
-        self._spk_times_all_in_one = {}
-        for grp_id, _spk_times in spk_times.items():
-            for cluNo, _spk_time in _spk_times.items():
-                self._spk_times_all_in_one[i] = _spk_time
-                i += 1
+        self._spk_times_all_in_one = self._unit_times()[2]
         return self._spk_times_all_in_one
 
     @property
@@ -293,13 +307,14 @@ class controller(object):
         self._scv = spk_time_to_scv(self.spk_times_all_in_one, delta_t=bin_size, ts=ts)
         return self._scv
 
-    def delete_spk(self, spk_idx):
+    def delete_spk(self, spk_idx, refet=False):
+        i = self.current_group
+        self.model.delete_spk(i, spk_idx, refet=refet)
+        self.view.prb_view.select(i) 
+
+    def undelete_spk(self):
         i = self.current_group
-        self.model.mua.spk_times[i] = np.delete(self.model.mua.spk_times[i], spk_idx, axis=0)
-        self.model.spk.spk_time_dict[i] = np.delete(self.model.spk.spk_time_dict[i], spk_idx, axis=0)
-        self.model.spk[i] = np.delete(self.model.spk[i], spk_idx, axis=0)
-        self.model.fet[i] = self.model.spk.tofet(i, method=self.model.fet_method, ncomp=self.model._fetlen)
-        self.model.clu[i].delete(spk_idx)
+        self.model.undelete_spk(i)
         self.view.prb_view.select(i) 
         
 
@@ -342,6 +357,15 @@ class controller(object):
         self.clu.emit('cluster')
         return dpgmm                
 
+    def warm_recluster(self, clu_ids=None, n_comp=None, max_iter=50):
+        '''
+        recluster the current group starting from the previous fit (see FET.recluster)
+        clu_ids: only refit these clusters, None for the whole group
+        n_comp:  larger than len(clu_ids) to re-split them
+        '''
+        return self.model.fet.recluster(self.current_group, clu_ids=clu_ids, n_comp=n_comp,
+                                        max_iter=max_iter, clu=self.clu)
+
     def kmm_cluster(self, N=100):
         from sklearn.cluster import MiniBatchKMeans
         kmm = MiniBatchKMeans(N)
@@ -354,7 +378,7 @@ class controller(object):
 
     def update_view(self):
         i = self.current_group
-        self.view.set_data(i, self.model.mua, self.model.spk[i], self.model.fet[i], self.model.clu[i])
+        self.view.set_data(i, self.model.gtimes[i], self.model.spk[i], self.model.fet[i], self.model.clu[i])
         self.view.setWindowTitle("Spiketag: {} units".format(self.unit_done)) 
 
     def sort(self, clu_method='hdbscan'):
@@ -379,8 +403,25 @@ class controller(object):
             self.update_view()
             self.view.show()
         else:
-            self.view.set_data(group_id, self.model.mua, self.model.spk[group_id], self.model.fet[group_id], self.model.clu[group_id])
+            prepared = self.prefetch.get(group_id)
+            self.view.set_data(group_id, self.model.gtimes[group_id], self.model.spk[group_id], self.model.fet[group_id], self.model.clu[group_id],
+                               prepared=prepared)
             self.view.show()
+            self.prefetch.request(self._adjacent_groups(group_id))
+
+    def _prepare_group(self, group_id):
+        # runs on the prefetch thread, see MainView.prepare
+        return self.view.prepare(self.model.spk[group_id], self.model.clu[group_id], self.model.gtimes[group_id])
+
+    def _adjacent_groups(self, group_id, n=1):
+        '''
+        the n groups after and before group_id (the next one first) that have spikes
+        '''
+        groups = [g for g in sorted(self.prb.grp_dict.keys()) if g == group_id or self.model.gtimes[g].shape[0] > 0]
+        if group_id not in groups:
+            return []
+        i = groups.index(group_id)
+        return [groups[j] for k in range(1, n+1) for j in (i+k, i-k) if 0 <= j < len(groups)]
 
     def save(self, filename=None, including_noise=True):
         '''
@@ -396,6 +437,34 @@ class controller(object):
         self.model.update_spktag()
         self.model.tofile(filename, including_noise)
         self.fpga.save(filename+'.param')
+        if self._autosave is not None:
+            self._autosave.clear()
+
+    def autosave(self, interval=60, n_edits=20, filename='./spktag/clu.autosave'):
+        '''
+        keep saving the clu memberships from a background thread while sorting (see clu_autosave)
+        after a crash, reload the spktag and call `recover_autosave`
+        '''
+        self.stop_autosave()
+        os.makedirs(os.path.dirname(filename) or '.', exist_ok=True)
+        self._autosave = clu_autosave(self.model.clu, filename, interval=interval, n_edits=n_edits)
+        self._autosave.start()
+
+    def stop_autosave(self):
+        if self._autosave is not None:
+            self._autosave.stop()
+            self._autosave = None
+
+    def recover_autosave(self, filename='./spktag/clu.autosave'):
+        '''
+        apply the memberships of an autosave file (undoable per group)
+        '''
+        for g, membership in clu_autosave.load(filename).items():
+            clu = self.model.clu[g]
+            if clu.npts != len(membership):
+                warning('group {}: autosave has {} spikes, clu has {}, skipped'.format(g, len(membership), clu.npts))
+            elif not np.array_equal(clu.membership, membership):
+                clu.relabel(np.arange(clu.npts), membership)
 
     #####################################
     ####  plot useful information  ######
@@ -419,13 +488,8 @@ class controller(object):
         self.clu.select(idx)
 
     def select_noise(self, thres=0.3):
-        noise_leve = []
-        group_id = self.current_group
-        for i in range(self.model.spk[group_id].shape[0]):
-            current_pts = self.model.mua.spk_times[group_id][i]
-            noise_leve.append(self.model.mua.data[current_pts, self.prb.chs].mean()/self.model.mua.data[current_pts, self.prb[group_id]].mean())
-        noise_leve = np.array(noise_leve)
-        idx = np.where(abs(noise_leve)>thres)[0]
+        noise_level = self.model.spike_noise(self.current_group, raw=True).noise
+        idx = np.where(abs(noise_level)>thres)[0]
         self.clu.select(idx)
 
     def refine(self, method, args):
@@ -439,15 +503,30 @@ class controller(object):
         self.clu.select(spk_tosel)
 
 
+    def merge_candidates(self, n=10):
+        '''
+        the n most similar cluster pairs of the current group [(clu_i, clu_j, score), ...]
+        '''
+        return self.model.similarity(self.current_group).merge_candidates(n)
+
+    def select_merge_candidate(self, rank=0):
+        '''
+        select the two clusters of the rank-th merge candidate in the views
+        '''
+        candidates = self.merge_candidates(rank+1)
+        if len(candidates) > rank:
+            clu_i, clu_j, score = candidates[rank]
+            info('merge candidate {}: cluster {} and {}, score {:.3f}'.format(rank, clu_i, clu_j, score))
+            self.clu.select_clu(np.array([clu_i, clu_j]))
+
     def transfer(self, sink_clu_id, source_clu_id, k=1):
         '''
         transfer source to sink the N*sink.shape[0] NN pts
         '''
         # if source_clu_id == sink_clu_id:
         #     source_clu_id = 0
-        source = self.fet[self.clu[source_clu_id]]
         sink   = self.fet[self.clu[sink_clu_id]]
-        KT = KDTree(source)
+        KT = self.model.kdtree(self.current_group, n_dim=None)[source_clu_id]
         nn_ids = KT.query(sink, k, dualtree=True)[1].ravel()
         global_nn_ids = self.clu.local2global({source_clu_id:nn_ids})
         collective_ids = np.hstack((global_nn_ids, self.clu[sink_clu_id]))
@@ -463,7 +542,7 @@ class controller(object):
         '''
         pts = k*30
         source = self.fet[self.clu[source_clu_id]]
-        KT = KDTree(source)
+        KT = self.model.kdtree(self.current_group, n_dim=None)[source_clu_id]
         dis, _ = KT.query(source, 10, dualtree=True) # use 10 pts to calculate average distance
         distance = dis[:, 1:].mean(axis=1) # the first column is the distance to each point itself, which is 0
         low_density_idx = self.clu.local2global({source_clu_id:np.argsort(distance)[::-1][:pts]})
@@ -478,12 +557,9 @@ class controller(object):
         # get the features of targeted cluNo
         #  X = self.fet[self.clu[cluNo]]
         # classification on these features
-            lables_X = self.model.predict(self.current_group, self.clu[cluNo], method='knn', k=15)
+            lables_X = self.model.predict(self.current_group, self.clu[cluNo], method='knn', k=k)
         # reconstruct current cluster membership
-            self.clu.membership[self.clu[cluNo]] = lables_X
-            if self.clu.membership.min()>0:
-                self.clu.membership -= 1
-            self.clu.__construct__()
+            self.clu.relabel(self.clu[cluNo], lables_X)
             self.update_view()
 
 
@@ -581,39 +657,36 @@ class controller(object):
         _fetview.set_data(_fet)
         _fetview.show()
 
-    def build_vq(self, grp_id=None, n_dim=4, n_vq=None, show=True, method='proportional'):
-        import warnings
-        warnings.filterwarnings('ignore')
-        # get the vq and vq labels
-        from sklearn.cluster import MiniBatchKMeans
-
+    def build_vq_all(self, groups, n_dim=4, method='proportional', n_vq=None, refine=0, n_jobs=None):
+        '''
+        build the vq codebooks of all groups at once (see core.build_codebooks),
+        the per-(group, cluster) kmeans are fitted in a process pool of n_jobs (None: all cores)
+        refine: #epochs of LVQ refinement of the codebooks for the realtime 1-NN decision (0: kmeans only)
+        the codebooks are kept in self.codebooks and in the per-group self.vq dicts
+        '''
+        groups = list(groups)
+        if len(groups) == 0:
+            return
+        # Note: use transformed_fet rather than original model.fet
+        codebooks = build_codebooks({g: self.transformed_fet[g] for g in groups},
+                                    {g: self.model.clu[g].membership for g in groups},
+                                    N=self._vq_npts, n_dim=n_dim, method=method, n_vq=n_vq, 
+                                    refine_epochs=refine, n_jobs=n_jobs)
+        for i, grp_id in enumerate(codebooks['groups']):
+            n = codebooks['n_points'][i]
+            self.vq['points'][grp_id] = codebooks['points'][i, :n]
+            self.vq['labels'][grp_id] = codebooks['labels'][i, :n]
+            self.vq['scores'][grp_id] = codebooks['scores'][i]
+            info('group {}: accuracy:{}'.format(grp_id, self.vq['scores'][grp_id]))
+        self.codebooks = codebooks
+        return codebooks
+
+    def build_vq(self, grp_id=None, n_dim=4, n_vq=None, show=True, method='proportional', refine=0):
         if grp_id is None:
             grp_id = self.current_group
 
-        vq = []
-        if n_vq is None:
-            if method == 'proportional':
-                avg_nvq = 500/self.model.clu[grp_id].nclu
-                n_vq = np.array([int(npts) if npts<avg_nvq else int(avg_nvq) for npts in self.model.clu[grp_id].nspks_per_clu])
-                # n_vq += np.round((500-np.array(n_vq).sum()) * ((self.model.clu[grp_id].nspks_per_clu / np.array(n_vq)) - 1) / ((self.model.clu[grp_id].nspks_per_clu / np.array(n_vq)) - 1).sum())
-                n_vq = n_vq.astype(np.int)
-            elif method == 'equal':
-                k = int(self._vq_npts/self.model.clu[grp_id].nclu)
-                n_vq = np.ones((self.model.clu[grp_id].nclu,)).astype(np.int32) * k
-                err = n_vq.sum() - self._vq_npts
-                n_vq[-1] -= err
-            assert(n_vq.sum()<=500)
-
-        for _clu_id in tqdm(self.model.clu[grp_id].index_id):
-            km = MiniBatchKMeans(n_vq[_clu_id])
-            X = self.transformed_fet[grp_id][self.model.clu[grp_id].index[_clu_id]][:,:n_dim]   # Note: use transformed_fet rather than original model.fet
-            km.fit(X)
-            vq.append(km.cluster_centers_)
-
-        self.vq['points'][grp_id] = np.vstack(vq)
-        self.vq['labels'][grp_id] = self._predict(grp_id, np.vstack(vq), n_dim)
-        self.vq['scores'][grp_id] = self._validate_vq(grp_id, n_dim)
-        info('group {}: accuracy:{}'.format(grp_id, self.vq['scores'][grp_id]))
+        self.build_vq_all([grp_id], n_dim=n_dim, method=method,
+                          n_vq=None if n_vq is None else {grp_id: n_vq}, refine=refine, n_jobs=1)
         assert(self.vq['labels'][grp_id].max() == self.model.clu[grp_id].nclu - 1)
 
         if show:
@@ -636,37 +709,32 @@ class controller(object):
         return _score
 
     def _predict(self, grp_id, vq_points, n_dim=4):
-        self.model.construct_kdtree(grp_id, n_dim)
-        d = []
-        for _kd in self.model.kd.keys():
-            tmp = _kd.query(vq_points, k=1)[0]
-            d.append(tmp.mean(axis=1))
-        d = np.vstack(np.asarray(d))
-        labels = np.asarray(list(self.model.kd.values()))[np.argmin(d, axis=0)]
+        labels = self.model.kdtree(grp_id, n_dim).predict(vq_points, k=1)
         return labels
 
-    def set_vq(self, vq_method='proportional', status='done'):
+    def set_vq(self, vq_method='proportional', status='done', refine=0, n_jobs=None):
         # step 1: set FPGA transfomer and build vq 
         if status == 'done':
             status_id = 3
         elif status == 'ready':
             status_id = 2
 
+        groups = []
         for grp_id in range(self.prb.n_group):  # set_vq condition for a group: at least 500 spikes and in a `done` state
             if self.model.clu_manager.state_list[grp_id]==status_id:
                 self.set_transformer(group_id=grp_id)
-                self.build_vq(grp_id=grp_id, show=False, method=vq_method)
-            else:
-                pass
+                groups.append(grp_id)
+        self.build_vq_all(groups, method=vq_method, refine=refine, n_jobs=n_jobs)
 
         # step 2: change labels such that each group has a different range that no overlapping
         self.global_label_lut = self.model.fet.assign_clu_global_labels()
 
-        # step 3: set FPGA vq
-        for grpNo in tqdm(self.vq['points'].keys(), desc='compile to fpga'):
-            self.fpga.vq[grpNo]    = self.vq['points'][grpNo]
-            self.vq['fpga_labels'][grpNo] = np.vectorize(self.global_label_lut[grpNo].get)(self.vq['labels'][grpNo]) 
-            self.fpga.label[grpNo] = self.vq['fpga_labels'][grpNo]
+        # step 3: set FPGA vq (only the words that changed are written)
+        with self.fpga.batch():
+            for grpNo in tqdm(self.vq['points'].keys(), desc='compile to fpga'):
+                self.fpga.vq[grpNo]    = self.vq['points'][grpNo]
+                self.vq['fpga_labels'][grpNo] = np.vectorize(self.global_label_lut[grpNo].get)(self.vq['labels'][grpNo]) 
+                self.fpga.label[grpNo] = self.vq['fpga_labels'][grpNo]
 
     def reset_vq(self):
         # step 1: reset all vq dict 
@@ -680,14 +748,18 @@ class controller(object):
             self.fpga.label[grp_id] = np.zeros((500,))
             self.fpga.vq[grp_id] = np.zeros((500,4))
 
-    def compile(self, vq_method='proportional', status='done'):
+    def compile(self, vq_method='proportional', status='done', refine=0, n_jobs=None):
         '''
         Download model parameters into the FPGA, and read back the downloaded parameters for a self-checking
         return False if self-checking is failed
         return True if self-checking is passed
+
+        The reset and the new model are staged in the FPGA shadow image, only the net difference
+        to what is already in the FPGA is downloaded (e.g. the groups changed by the last curation)
         '''
-        self.reset_vq()
-        self.set_vq(vq_method, status)
+        with self.fpga.batch():
+            self.reset_vq()
+            self.set_vq(vq_method, status, refine, n_jobs)
         if status == 'done':
             self.fpga.n_units = self.unit_done
         elif status == 'ready':
@@ -695,7 +767,7 @@ class controller(object):
         print('FPGA is compiled')
         self.fpga.check()
 
-    def to_nbdec(self, spkdf='./spktag/kmeans_sort.pd', t_step=0.1, t_window=0.8, t_smooth=3, 
+    def to_nbdec(self, spkdf='./spktag/kmeans_sort.spkdf', t_step=0.1, t_window=0.8, t_smooth=3, 
                        tps=[0.5, 0.6, 0.7, 0.8]):
         '''
         t_step: decoder update time step
@@ -1,17 +1,360 @@
 import numpy as np
+import os
+import time
+import threading
+from collections import OrderedDict
 from sklearn.neighbors import KDTree
 from ..base.SPK import _construct_transformer
 from ..base import *
+from ..base.SpikeTable import _atomic_write
 from ..utils.conf import info 
 from ..utils import conf
 from ..utils.utils import Timer
+from ..core import cluster_similarity, spike_noise
 from ..analysis.place_field import place_field
 
 
+class clu_kdtree(object):
+    '''
+    KDTree of every cluster in one group, built lazily and cached.
+    Only the clusters whose spikes changed after a `cluster` event of the clu are rebuilt.
+
+    kd = model.kdtree(group_id, n_dim=4)
+    kd[clu_id]                                # KDTree of the cluster
+    clu_ids, d = kd.knn_distance(X, k=10)     # (nclu, N) mean distance from X to the k nearest spikes of every cluster
+    '''
+    def __init__(self, model, group_id, n_dim=4):
+        self.model = model
+        self.group_id = group_id
+        self.n_dim = n_dim
+        self._fet = None
+        self._clu = None
+        self._trees = {}   # {clu_id: (global_ids, KDTree)}
+        self._dirty = False
+        self._npts = 0
+        self._on_cluster = None
+
+    def _sync(self):
+        fet, clu = self.model.fet[self.group_id], self.model.clu[self.group_id]
+        if fet is not self._fet or clu is not self._clu:
+            if clu is not self._clu:
+                self.disconnect()
+                def on_cluster(*args, **kwargs):
+                    self._dirty = True
+                self._on_cluster = clu.connect(on_cluster)
+            self._fet, self._clu = fet, clu
+            self._trees = {}
+        elif self._dirty or self._npts != clu.npts:
+            for clu_id in list(self._trees.keys()):
+                ids, _ = self._trees[clu_id]
+                if clu_id not in clu.index or not np.array_equal(ids, clu.index[clu_id]):
+                    del self._trees[clu_id]
+        self._dirty = False
+        self._npts = clu.npts
+
+    def disconnect(self):
+        '''
+        stop watching the clu (it is replaced, or the trees are no longer used)
+        '''
+        if self._on_cluster is not None:
+            self._clu.unconnect(self._on_cluster)
+            self._on_cluster = None
+
+    def __getitem__(self, clu_id):
+        self._sync()
+        if clu_id not in self._trees:
+            ids = self._clu.index[clu_id]
+            self._trees[clu_id] = (ids, KDTree(self._fet[ids][:, :self.n_dim]))
+        return self._trees[clu_id][1]
+
+    def knn_distance(self, X, k=10, exclude_ids=None):
+        '''
+        query all clusters with the whole batch X
+        exclude_ids: global ids left out of the trees (e.g. the spikes being classified),
+                     only the clusters containing them get a temporary tree
+        return clu_ids and d (len(clu_ids), N)
+        '''
+        self._sync()
+        clu_ids, d = [], []
+        for clu_id, ids in self._clu.index.items():
+            if exclude_ids is not None and np.isin(ids, exclude_ids).any():
+                ids = np.setdiff1d(ids, exclude_ids, assume_unique=True)
+                if len(ids) == 0:
+                    continue
+                kd = KDTree(self._fet[ids][:, :self.n_dim])
+            else:
+                kd = self[clu_id]
+            dis = kd.query(X[:, :self.n_dim], min(k, len(ids)))[0]
+            clu_ids.append(clu_id)
+            d.append(dis.mean(axis=1))
+        return np.asarray(clu_ids), np.vstack(d)
+
+    def predict(self, X, k=10, exclude_ids=None):
+        '''
+        label of the cluster with the smallest mean knn distance
+        '''
+        clu_ids, d = self.knn_distance(X, k, exclude_ids)
+        return clu_ids[np.argmin(d, axis=0)]
+
+
+class clu_autosave(object):
+    '''
+    Save the clu membership of every edited group from a background thread.
+
+    Every `cluster` or `delete` event copies the membership of that group (on the thread that 
+    made the edit, so the snapshot is consistent), the worker writes the snapshots to `filename` 
+    every `interval` secs or after `n_edits` edits. Edits within `debounce` secs are coalesced.
+
+    saver = clu_autosave(model.clu, './spktag/clu.autosave', interval=60, n_edits=20)
+    saver.start()
+    saver.stop()
+    labels = clu_autosave.load('./spktag/clu.autosave')    # {group_id: membership}
+    '''
+    def __init__(self, clu, filename, interval=60, n_edits=20, debounce=1.0):
+        self.clu = clu
+        self.filename = filename
+        self.interval = interval
+        self.n_edits = n_edits
+        self.debounce = debounce
+        self.nsaved = 0
+        self._snapshot = {}   # {group_id: membership} after the last edit of the group
+        self._edits = 0
+        self._last_edit = 0
+        self._lock = threading.Lock()   # guards the snapshots
+        self._io = threading.Lock()     # guards the file
+        self._wake = threading.Event()
+        self._stop = threading.Event()
+        self._thread = None
+        self._handlers = []   # (clu, callback) connected to the clu events, until stop
+        self._connect()
+
+    def _connect(self):
+        for g, _clu in self.clu.items():
+            def on_cluster(*args, _g=g, **kwargs):
+                self._on_edit(_g)
+            def on_delete(*args, _g=g, **kwargs):
+                self._on_edit(_g)
+            self._handlers += [(_clu, _clu.connect(on_cluster)), (_clu, _clu.connect(on_delete))]
+
+    def _disconnect(self):
+        for _clu, callback in self._handlers:
+            _clu.unconnect(callback)
+        self._handlers = []
+
+    def _on_edit(self, group_id):
+        with self._lock:
+            self._snapshot[group_id] = self.clu[group_id].membership.copy()
+            self._edits += 1
+            self._last_edit = time.time()
+            if self._edits >= self.n_edits:
+                self._wake.set()
+
+    def _run(self):
+        while not self._stop.is_set():
+            self._wake.wait(self.interval)
+            self._wake.clear()
+            while not self._stop.is_set() and time.time() - self._last_edit < self.debounce:
+                self._stop.wait(self.debounce)
+            if not self._stop.is_set():
+                self.flush()
+
+    def start(self):
+        if not self._handlers:
+            self._connect()
+        if self._thread is None or not self._thread.is_alive():
+            self._stop.clear()
+            self._thread = threading.Thread(target=self._run, name='clu_autosave', daemon=True)
+            self._thread.start()
+
+    def stop(self, flush=True):
+        '''
+        stop the worker and the snapshots of new edits (start resumes both)
+        '''
+        self._disconnect()
+        self._stop.set()
+        self._wake.set()
+        if self._thread is not None:
+            self._thread.join()
+            self._thread = None
+        if flush:
+            self.flush()
+
+    def flush(self):
+        '''
+        write the snapshots if anything changed since the last write
+        '''
+        with self._io:
+            with self._lock:
+                if self._edits == 0:
+                    return False
+                snapshot = {'clu_{}'.format(g): m for g, m in self._snapshot.items()}
+                self._edits = 0
+            _atomic_write(self.filename, lambda f: np.savez(f, **snapshot))
+            self.nsaved += 1
+        return True
+
+    def clear(self):
+        '''
+        forget all snapshots (e.g. after a full save)
+        '''
+        with self._io:
+            with self._lock:
+                self._snapshot = {}
+                self._edits = 0
+            if os.path.exists(self.filename):
+                os.remove(self.filename)
+
+    @staticmethod
+    def load(filename):
+        with np.load(filename) as f:
+            return {int(k.split('_')[1]): f[k] for k in f.files}
+
+
+def _nbytes(data):
+    '''
+    memory held by the arrays (numpy or torch) of nested dict/list/tuple
+    '''
+    if isinstance(data, dict):
+        return sum(_nbytes(v) for v in data.values())
+    if isinstance(data, (list, tuple)):
+        return sum(_nbytes(v) for v in data)
+    if hasattr(data, 'element_size'):
+        return data.element_size() * data.nelement()
+    return getattr(data, 'nbytes', 0)
+
+
+class group_prefetch(object):
+    '''
+    Prepare the data of other groups on a background thread and keep it in a bounded LRU cache.
+
+    The controller requests the neighbours of the group on screen, one worker thread prepares them 
+    (`prepare(group_id)`, must not touch GL state) while the user curates, so switching to them
+    only takes the cached data. An entry is dropped after a `cluster` or `delete` event of its clu,
+    when the spk/clu/spike times of its group were replaced, or when the cache holds more than 
+    `capacity` groups or `max_bytes` (least recently used first). The data is handed over by `get`
+    (the views own and edit it from then on).
+
+    pf = group_prefetch(model, prepare, capacity=4, max_bytes=2**30)
+    pf.request([g-1, g+1])    # prefetch in background, replaces the requests not started yet
+    data = pf.get(g)          # takes the data out of the cache (waits if g is being prepared), None if g is not cached
+    pf.stop()
+    '''
+    def __init__(self, model, prepare, capacity=4, max_bytes=2**30):
+        self.model = model
+        self.prepare = prepare
+        self.capacity = capacity
+        self.max_bytes = max_bytes
+        self.nhits, self.nmisses = 0, 0
+        self._cache = OrderedDict()   # {group_id: (source, data, nbytes)}
+        self._gen = {}                # {group_id: #edits}, an edit during prepare discards its result
+        self._watched = {}            # {group_id: (clu, handlers connected to it)}
+        self._pending = []
+        self._busy = None
+        self._cond = threading.Condition()
+        self._stop = False
+        self._thread = None
+
+    def _source(self, g):
+        return (self.model.spk[g], self.model.clu[g], self.model.gtimes[g])
+
+    def _valid(self, g):
+        return g in self._cache and all(a is b for a, b in zip(self._cache[g][0], self._source(g)))
+
+    def _watch(self, g):
+        clu = self.model.clu[g]
+        if g in self._watched and self._watched[g][0] is clu:
+            return
+        self._unwatch(g)
+        def on_cluster(*args, **kwargs):
+            self._invalidate(g)
+        def on_delete(*args, **kwargs):
+            self._invalidate(g)
+        self._watched[g] = (clu, [clu.connect(on_cluster), clu.connect(on_delete)])
+
+    def _unwatch(self, g):
+        if g in self._watched:
+            clu, handlers = self._watched.pop(g)
+            clu.unconnect(*handlers)
+
+    def _invalidate(self, g):
+        with self._cond:
+            self._gen[g] = self._gen.get(g, 0) + 1
+            self._cache.pop(g, None)
+
+    def _evict(self):
+        while len(self._cache) > self.capacity or \
+              (len(self._cache) > 1 and sum(e[2] for e in self._cache.values()) > self.max_bytes):
+            self._cache.popitem(last=False)
+
+    def _run(self):
+        while True:
+            with self._cond:
+                while not self._stop and not self._pending:
+                    self._cond.wait()
+                if self._stop:
+                    return
+                g = self._pending.pop(0)
+                if self._valid(g):
+                    continue
+                self._busy, gen, source = g, self._gen.get(g, 0), self._source(g)
+            try:
+                data = self.prepare(g)
+            except Exception as e:
+                info('prefetch of group {} failed: {}'.format(g, e))
+                data = None
+            with self._cond:
+                if data is not None and gen == self._gen.get(g, 0) and \
+                   all(a is b for a, b in zip(source, self._source(g))):
+                    self._cache[g] = (source, data, _nbytes(data))
+                    self._evict()
+                self._busy = None
+                self._cond.notify_all()
+
+    def request(self, group_ids):
+        for g in group_ids:
+            self._watch(g)
+        with self._cond:
+            self._pending = [g for g in group_ids if not self._valid(g)]
+            self._cond.notify_all()
+        if self._pending and (self._thread is None or not self._thread.is_alive()):
+            self._stop = False
+            self._thread = threading.Thread(target=self._run, name='group_prefetch', daemon=True)
+            self._thread.start()
+
+    def get(self, group_id):
+        with self._cond:
+            if group_id in self._pending:
+                self._pending.remove(group_id)
+            while self._busy == group_id:
+                self._cond.wait()
+            if self._valid(group_id):
+                self.nhits += 1
+                return self._cache.pop(group_id)[1]
+            self.nmisses += 1
+            return None
+
+    def clear(self):
+        with self._cond:
+            self._pending = []
+            self._cache.clear()
+
+    def stop(self):
+        with self._cond:
+            self._stop = True
+            self._pending = []
+            self._cond.notify_all()
+        if self._thread is not None:
+            self._thread.join()
+            self._thread = None
+        for g in list(self._watched):
+            self._unwatch(g)
+
+
 class MainModel(object):
     """
     filename is the mua binary file
     spktag_filename is the spiketag file, if None, Model will do clustering
+    lazy_mua: when opening from spktag_filename, the mua is only loaded when `model.mua` is first used
     other parameters are metadata of the binary file
 
     Model contains four sub-objects:
@@ -28,7 +371,7 @@ class MainModel(object):
                  time_segs=None,
                  playground_log=None, session_id=0, 
                  pc=None, bin_size=4, v_cutoff=5, replay_offset=0.,
-                 sort_movment_only=False):
+                 sort_movment_only=False, lazy_mua=True):
 
         # raw recording param
         self.mua_filename = mua_filename
@@ -43,12 +386,8 @@ class MainModel(object):
         self._corr_cutoff = corr_cutoff
         self._spklen = spklen 
         self._amp_cutoff = amp_cutoff
-        if time_segs is None:
-            bf = Binload.bload()
-            bf.load(mua_filename, verbose=False)
-            self._time_segs = [bf.t[0], bf.t[-1]]
-        else:
-            self._time_segs = time_segs
+        self._tsegs = time_segs   # None: read from the mua file on first use
+        self._mua = None
 
         # fet param
         self.fet_method = fet_method
@@ -59,6 +398,10 @@ class MainModel(object):
         self.clu_method = clu_method
         self._fall_off_size = fall_off_size
         self._n_jobs = n_jobs
+        self._kdtree = {}  # {(group_id, n_dim): clu_kdtree}
+        self._deleted = {} # {group_id: [delete transactions]}, for undelete_spk
+        self._similarity = {}  # {group_id: cluster_similarity}
+        self._noise = {}       # {group_id: spike_noise}
 
         # playground log
         self.time_still = None
@@ -84,6 +427,41 @@ class MainModel(object):
             self.pc = None
 
         self._model_init_(self.spktag_filename)
+        if not lazy_mua:
+            self.mua
+
+
+    @property
+    def _time_segs(self):
+        if self._tsegs is None:
+            bf = Binload.bload()
+            bf.load(self.mua_filename, verbose=False)
+            self._tsegs = [bf.t[0], bf.t[-1]]
+        return self._tsegs
+
+    @property
+    def mua(self):
+        '''
+        raw recording, a model opened from spktag attaches it on first use (views, thresholds, traces)
+        '''
+        if self._mua is None:
+            info('load mua data for wave view')
+            self._mua = MUA(probe        = self.probe,
+                            mua_filename = self.mua_filename, 
+                            spk_filename = self.spk_filename, 
+                            numbytes     = self.numbytes, 
+                            binary_radix = self.binpoint,
+                            scale        = self.scale,
+                            cutoff       = self._amp_cutoff, 
+                            time_segs    = self._time_segs, 
+                            time_still   = self.time_still,
+                            lfp          = False)
+            self._mua.spk_times = self.gtimes
+        return self._mua
+
+    @mua.setter
+    def mua(self, mua):
+        self._mua = mua
 
 
     def _model_init_(self, spktag_filename=None):
@@ -136,19 +514,8 @@ class MainModel(object):
             #     self.clu_manager.append(_clu)
             # self.spktag.clu_manager = self.clu_manager
 
-            info('load mua data for wave view')
-            self.mua = MUA(probe        = self.probe,
-                           mua_filename = self.mua_filename, 
-                           spk_filename = self.spk_filename, 
-                           numbytes     = self.numbytes, 
-                           binary_radix = self.binpoint,
-                           scale        = self.scale,
-                           cutoff       = self._amp_cutoff, 
-                           time_segs    = self._time_segs, 
-                           time_still   = self.time_still,
-                           lfp          = False)
-            self.mua.spk_times = self.gtimes
-            self.spk_times = self.mua.spk_times
+            # the mua is attached lazily, see MainModel.mua
+            self.spk_times = self.gtimes
             info('Model.spktag is generated, nspk:{}'.format(self.spktag.nspk))
 
         self.groups = self.probe.grp_dict.keys()
@@ -225,23 +592,23 @@ class MainModel(object):
 
         info('clustering with {}'.format(clu_method))
         self.fet.toclu(method=clu_method, group_id=group_id, **kwargs)
-
-        self.spktag = SPKTAG(self.probe,
-                             self.spk, 
-                             self.fet, 
-                             self.clu,
-                             self.clu_manager,
-                             self.gtimes)
-        info('Model.spktag is generated, nspk:{}'.format(self.spktag.nspk))
+        self.update_spktag()
 
     
     def update_spktag(self):
-        self.spktag = SPKTAG(self.probe,
-                             self.spk, 
-                             self.fet, 
-                             self.clu,
-                             self.clu_manager,
-                             self.gtimes)
+        '''
+        an existing spktag is rebound rather than rebuilt, so it keeps track of
+        the groups changed since its last save (see SPKTAG.tofile)
+        '''
+        if getattr(self, 'spktag', None) is not None and hasattr(self.spktag, 'gtimes'):
+            self.spktag.update(self.spk, self.fet, self.clu, self.clu_manager, self.gtimes)
+        else:
+            self.spktag = SPKTAG(self.probe,
+                                 self.spk, 
+                                 self.fet, 
+                                 self.clu,
+                                 self.clu_manager,
+                                 self.gtimes)
         info('Model.spktag is generated, nspk:{}'.format(self.spktag.nspk))
 
 
@@ -266,27 +633,40 @@ class MainModel(object):
         return _pca_comp, _shift, _scale, y
 
 
-    def construct_kdtree(self, group_id, global_ids=None, n_dim=4):
-        self.kd = {} 
-        for clu_id, value in self.clu[group_id].index.items():
-            diff_ids = np.setdiff1d(value, global_ids, assume_unique=True)
-            if len(diff_ids) > 0:
-                fet = self.fet[group_id][diff_ids][:, :n_dim]
-                self.kd[KDTree(fet)] = clu_id
+    def kdtree(self, group_id, n_dim=4):
+        '''
+        cached per-cluster KDTree of the group (see clu_kdtree), n_dim=None uses all features
+        '''
+        if (group_id, n_dim) not in self._kdtree:
+            self._kdtree[(group_id, n_dim)] = clu_kdtree(self, group_id, n_dim)
+        return self._kdtree[(group_id, n_dim)]
 
+    def similarity(self, group_id):
+        '''
+        cached cluster_similarity of the group, updated for the clusters changed since the last call
+        '''
+        if group_id not in self._similarity:
+            self._similarity[group_id] = cluster_similarity()
+        return self._similarity[group_id].update(self.spk[group_id], self.fet[group_id], self.clu[group_id])
+
+    def spike_noise(self, group_id, raw=False):
+        '''
+        cached per-spike noise metrics of the group (see spike_noise), recomputed only after the spikes changed
+        raw: also bind the raw data for the `noise` metric (attaches the MUA)
+        '''
+        if group_id not in self._noise:
+            self._noise[group_id] = spike_noise()
+        if raw:
+            return self._noise[group_id].update(self.spk[group_id], self.gtimes[group_id], self.mua.data,
+                                                self.probe.chs, self.probe[group_id])
+        return self._noise[group_id].update(self.spk[group_id])
 
     def predict(self, group_id, global_ids, method='knn', k=10, n_dim=4):
         X = self.fet[group_id][global_ids][:,:n_dim]
         if X.ndim==1: X=X.reshape(1,-1)
 
         if method == 'knn':
-            self.construct_kdtree(group_id, global_ids)
-            d = []
-            for _kd, _ in self.kd.items():
-                tmp = _kd.query(X, k)[0]
-                d.append(tmp.mean(axis=1))
-            d = np.vstack(np.asarray(d))
-            labels = np.asarray(list(self.kd.values()))[np.argmin(d, axis=0)]
+            labels = self.kdtree(group_id, n_dim).predict(X, k, exclude_ids=global_ids)
         return labels
 
 
@@ -310,32 +690,104 @@ class MainModel(object):
         info("the result of refine: {}".format(labels))
         self.clu[group].refill(global_ids, labels)
     
+    def _per_spike_dicts(self, group):
+        '''
+        (name, dict) of every store that holds one row per spike of the group, all of them must
+        have one row per spike of the clu:
+        - always: spk waveforms, fet, gtimes
+        - if they hold the group: mua.spk_times, spk.spk_time_dict, spk.spk_group_dict, spk.spk_max_dict
+        (the lazy spk._spike_energy cache is dropped instead)
+        '''
+        n = self.clu[group].npts
+        stores = [('spk', self.spk.spk, True), ('fet', self.fet.fet, True), ('gtimes', self.gtimes, True),
+                  ('mua.spk_times', getattr(self._mua, 'spk_times', None), False),
+                  ('spk.spk_time_dict', getattr(self.spk, 'spk_time_dict', None), False),
+                  ('spk.spk_group_dict', getattr(self.spk, 'spk_group_dict', None), False),
+                  ('spk.spk_max_dict', getattr(self.spk, 'spk_max_dict', None), False)]
+        dicts = []
+        for name, d, required in stores:
+            if not required and (d is None or group not in d):
+                continue
+            if any(d is _d for _, _d in dicts):
+                continue
+            assert len(d[group]) == n, '{}[{}] has {} rows but the clu has {} spikes'.format(name, group, len(d[group]), n)
+            dicts.append((name, d))
+        return dicts
+
+    def delete_spk(self, group, global_ids, refet=False, reclu=False):
+        '''
+        Delete spks (global_ids) of a group from SPK, FET, CLU and spike times in one transaction:
+        - every array is compacted once with a keep mask, O(deleted + group size)
+        - features and clusters are only recomputed if refet/reclu is True
+        - one `delete` event is emitted by the clu
+        - undelete_spk(group) puts the spikes back
+        '''
+        info("received model modified event, delete spikes[group={}, global_ids={}]".format(group, global_ids))
+        clu = self.clu[group]
+        keep = np.ones((clu.npts,), dtype=bool)
+        keep[global_ids] = False
+        with Timer("[MODEL] Model -- delete spk from SPK, FET and times", verbose=conf.ENABLE_PROFILER):
+            removed = []
+            for name, d in self._per_spike_dicts(group):
+                removed.append((name, d, d[group][~keep]))
+                d[group] = d[group][keep]
+            if getattr(self.spk, '_spike_energy', None) is not None:
+                self.spk._spike_energy = None
+        with Timer("[MODEL] Model -- delete spk from CLU", verbose=conf.ENABLE_PROFILER):
+            clu_removed = clu._compact(keep)
+        self.fet.npts[group] = clu.npts
+        self._deleted.setdefault(group, []).append((keep, removed, clu_removed, refet))
+
+        if refet:
+            with Timer("[MODEL] Model -- SPK to FET.", verbose=conf.ENABLE_PROFILER):
+                self.fet[group] = self.spk._tofet(group, method=self.fet_method, ncomp=self._fetlen)
+        if reclu:
+            with Timer("[MODEL] Model -- FET to CLU.", verbose=conf.ENABLE_PROFILER):
+                self.fet.recluster(group, clu=clu)
+        clu.emit('delete', action='delete', global_ids=np.where(~keep)[0])
+
+    def undelete_spk(self, group):
+        '''
+        undo the last delete_spk of the group
+        features are recomputed from the restored waveforms if that delete recomputed them (refet), 
+        otherwise the removed rows are put back
+        '''
+        if len(self._deleted.get(group, [])) == 0:
+            info('no deleted spikes in group {}'.format(group))
+            return
+        keep, removed, clu_removed, refet = self._deleted[group].pop()
+        for name, d, rows in removed:
+            if name == 'fet' and refet:
+                continue
+            _rows = np.empty((keep.shape[0],) + rows.shape[1:], dtype=d[group].dtype)
+            _rows[keep] = d[group]
+            _rows[~keep] = rows
+            d[group] = _rows
+        if getattr(self.spk, '_spike_energy', None) is not None:
+            self.spk._spike_energy = None
+        if refet:
+            with Timer("[MODEL] Model -- SPK to FET.", verbose=conf.ENABLE_PROFILER):
+                self.fet[group] = self.spk._tofet(group, method=self.fet_method, ncomp=self._fetlen)
+        self.clu[group]._expand(keep, clu_removed)
+        self.fet.npts[group] = self.clu[group].npts
+        self.clu[group].emit('delete', action='undelete', global_ids=np.where(~keep)[0])
+
     def remove_spk(self, group, global_ids):
         '''
         Delete spks using global_ids, spks includes SPK, FET, CLU, SPKTAG. 
         '''
-        info("received model modified event, removed spikes[group={}, global_ids={}]".format(group, global_ids))
-        with Timer("[MODEL] Model -- remove spk from times", verbose=conf.ENABLE_PROFILER):
-            self.gtimes[group] = np.delete(self.gtimes[group], global_ids)
-        with Timer("[MODEL] Model -- remove spk from SPK.", verbose=conf.ENABLE_PROFILER):
-            self.spk.remove(group, global_ids)
-        with Timer("[MODEL] Model -- SPK to FET.", verbose=conf.ENABLE_PROFILER):
-            self.fet[group] = self.spk._tofet(group, method=self.fet_method)
-        with Timer("[MODEL] Model -- FET to CLU.", verbose=conf.ENABLE_PROFILER):
-            self.clu[group] = self.fet._toclu(group)
+        self.delete_spk(group, global_ids)
             
     def mask_spk(self, group, global_ids):
         '''
         Mask spks using global_ids, spks includes SPK, FET, CLU, SPKTAG. 
+        Like SPK.mask, global_ids refer to the spikes before any deletion: the previous deletions 
+        of the group (delete_spk/remove_spk/mask_spk) are undone first, so a mask replaces the last one.
+        Use delete_spk to delete on top of the previous deletions.
         '''
-        info("received model modified event, mask spikes[group={}, global_ids={}]".format(group, global_ids))
-        
-        with Timer("[MODEL] Model -- mask spk from SPK.", verbose=conf.ENABLE_PROFILER):
-            self.spk.mask(group, global_ids)
-        with Timer("[MODEL] Model -- SPK to FET.", verbose=conf.ENABLE_PROFILER):
-            self.fet[group] = self.spk._tofet(group, method=self.fet_method)
-        with Timer("[MODEL] Model -- FET to CLU", verbose=conf.ENABLE_PROFILER):
-            self.clu[group] = self.fet._toclu(group)
+        while len(self._deleted.get(group, [])) > 0:
+            self.undelete_spk(group)
+        self.delete_spk(group, global_ids)
 
     @property
     def nspk_per_grp(self):
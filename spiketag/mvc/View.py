@@ -72,7 +72,7 @@ class MainView(QMainWindow,QApplication):
         self.corview = correlogram_view(fs=self.prb.fs)
         # self.treeview = ctree_view()
         self.pfview  = pf_view(pc=self._model.pc)
-        self.traceview = trace_view(data=self._model.mua.data, fs=self.prb.fs)
+        self.traceview = trace_view(data=lambda: self._model.mua.data, fs=self.prb.fs, n_ch=self.prb.n_ch)   # the mua is loaded when a trace is first drawn
         
         self.splitter1.addWidget(self.traceview.native)
         self.splitter1.addWidget(self.splitter_fet)
@@ -87,12 +87,29 @@ class MainView(QMainWindow,QApplication):
         self.splitter2.setSizes([40,40,100])  # corview, treeview, ampview
 
 
-    def set_data(self, group_id, mua, spk, fet, clu):
+    def prepare(self, spk, clu, spk_times):
+        '''
+        the view-ready data of one group that set_data would otherwise compute,
+        touches no GL state (the controller prefetches it for other groups on a worker thread)
+        '''
+        prepared = {'layout': self.spkview.layout(spk, clu),
+                    'amplitudes': self.ampview.amplitudes(spk, spk_times),
+                    'firing_idx': self.pfview.firing_idx(spk_times/self.prb.fs)}
+        try:
+            prepared['hists'] = self.corview.correlogram(clu, spk_times)
+        except Exception as e:
+            pass
+        return prepared
+
+    def set_data(self, group_id, spk_times, spk, fet, clu, prepared=None):
         ### init view and set_data
+        ### spk_times: the spike times of the group (model.gtimes[group_id])
+        ### prepared: the output of `prepare` for this group, if it was prefetched
 
+        prepared = {} if prepared is None else prepared
         self.clu = clu
         chs = self.prb[group_id]
-        self.spkview.set_data(spk, clu)
+        self.spkview.set_data(spk, clu, layout=prepared.get('layout'))
         # self.fetview0.set_data(fet, clu)
         # if fet.shape[1]>3:
         self.fetview0.dimension = [0,1,2]
@@ -100,15 +117,15 @@ class MainView(QMainWindow,QApplication):
         self.fetview1.dimension = [0,1,3]
         self.fetview1.set_data(fet, clu)   #[:,[0,1,3]].copy()
         # else:
-        self.ampview.set_data(spk, clu, mua.spk_times[group_id])
+        self.ampview.set_data(spk, clu, spk_times, amplitudes=prepared.get('amplitudes'))
         # self.treeview.set_data(clu) 
-        self.traceview.set_data(chs, clu, mua.spk_times[group_id])
+        self.traceview.set_data(chs, clu, spk_times)
         try:
-            self.corview.set_data(clu, mua.spk_times[group_id])
+            self.corview.set_data(clu, spk_times, hists=prepared.get('hists'))
         except Exception as e:
             pass
 
-        self.pfview.set_data(clu, mua.spk_times[group_id]/self.prb.fs)
+        self.pfview.set_data(clu, spk_times/self.prb.fs, firing_idx=prepared.get('firing_idx'))
 
         self.traceview.locate_buffer = 1500
 
@@ -140,11 +157,11 @@ class MainView(QMainWindow,QApplication):
         self.fetview1.dimension = [0,1,3]
         self.fetview1.set_data(model.fet[group_id], model.clu[group_id])   #[:,[0,1,3]].copy()
         # else:
-        self.ampview.set_data(model.spk[group_id], model.clu[group_id], model.mua.spk_times[group_id])
+        self.ampview.set_data(model.spk[group_id], model.clu[group_id], model.gtimes[group_id])
         # self.treeview.set_data(model.clu[group_id]) 
-        self.traceview.set_data(self.prb[group_id], model.clu[group_id], model.mua.spk_times[group_id])
+        self.traceview.set_data(self.prb[group_id], model.clu[group_id], model.gtimes[group_id])
         # try:
-        #     self.corview.set_data(model.clu[group_id], model.mua.spk_times[group_id])
+        #     self.corview.set_data(model.clu[group_id], model.gtimes[group_id])
         # except Exception as e:
         #     pass
 
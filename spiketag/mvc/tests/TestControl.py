@@ -0,0 +1,58 @@
+# import sys
+# sys.path.append('../../../')
+import os
+import shutil
+import tempfile
+import unittest
+import numpy as np
+from types import SimpleNamespace
+from spiketag.base import CLU
+from spiketag.mvc.Control import controller
+
+class TestAutosave(unittest.TestCase):
+
+    def setUp(self):
+        '''
+            controller of 2 groups with 12 and 8 spikes, group 0 is the current group
+        '''
+        self.folder = tempfile.mkdtemp()
+        self.filename = os.path.join(self.folder, 'clu.autosave')
+        self.ctrl = controller.__new__(controller)
+        self.ctrl.model = SimpleNamespace(clu={0: CLU(np.arange(12) % 3), 1: CLU(np.arange(8) % 2)})
+        self.ctrl._current_group = 0
+        self.ctrl._autosave = None
+
+    def tearDown(self):
+        self.ctrl.stop_autosave()
+        shutil.rmtree(self.folder)
+
+    '''
+       Test Cases
+    '''
+    def test_recover(self):
+        '''
+            the edit autosaved before a crash is recovered into the reloaded clu, undoable
+        '''
+        self.ctrl.autosave(interval=60, n_edits=100, filename=self.filename)
+        self.ctrl.model.clu[1].fill(np.array([0, 2]), 1)
+        edited = self.ctrl.model.clu[1].membership.copy()
+        self.ctrl.stop_autosave()    # flushes the snapshots
+        # reload after the crash
+        self.ctrl.model.clu = {0: CLU(np.arange(12) % 3), 1: CLU(np.arange(8) % 2)}
+        self.ctrl.recover_autosave(self.filename)
+        self.assertTrue(np.array_equal(self.ctrl.model.clu[1].membership, edited))
+        self.assertTrue(np.array_equal(self.ctrl.model.clu[0].membership, np.arange(12) % 3))
+        self.ctrl.model.clu[1].undo()
+        self.assertTrue(np.array_equal(self.ctrl.model.clu[1].membership, np.arange(8) % 2))
+
+    def test_recover_skips_other_size(self):
+        self.ctrl.autosave(interval=60, n_edits=100, filename=self.filename)
+        self.ctrl.model.clu[1].fill(np.array([0, 2]), 1)
+        self.ctrl.stop_autosave()
+        self.ctrl.model.clu[1] = CLU(np.arange(6) % 2)
+        self.ctrl.recover_autosave(self.filename)
+        self.assertTrue(np.array_equal(self.ctrl.model.clu[1].membership, np.arange(6) % 2))
+
+
+if __name__ == "__main__":
+    unittest.main()
@@ -0,0 +1,168 @@
+# import sys
+# sys.path.append('../../../')
+import threading
+import unittest
+import numpy as np
+from types import SimpleNamespace
+from spiketag.base import SPK, FET, CLU
+from spiketag.mvc.Model import MainModel, group_prefetch
+
+class TestDeleteSpk(unittest.TestCase):
+
+    def setUp(self):
+        '''
+            a model of one group (60 spikes, 3 clusters) without mua, as opened from a spktag
+        '''
+        rng = np.random.RandomState(0)
+        self.spk = rng.normal(0, 1, (60, 19, 4)).astype(np.float32)
+        self.fet = rng.normal(0, 1, (60, 4)).astype(np.float32)
+        self.membership = np.repeat([0, 1, 2], 20)
+        self.gtimes = np.arange(60) * 10
+        model = MainModel.__new__(MainModel)
+        model.spk = SPK({0: self.spk.copy()})
+        model.spk.W = None
+        model.fet = FET({0: self.fet.copy()})
+        model.fet.clu[0] = CLU(self.membership.copy())
+        model.clu = model.fet.clu
+        model.gtimes = {0: self.gtimes.copy()}
+        model._mua = None
+        model._deleted = {}
+        model.fet_method = 'pca'
+        model._fetlen = 4
+        self.model = model
+        self.ids = np.array([1, 5, 21, 40])
+
+    '''
+       Test Cases
+    '''
+    def test_delete_undelete(self):
+        model = self.model
+        model.delete_spk(0, self.ids)
+        keep = np.setdiff1d(np.arange(60), self.ids)
+        self.assertEqual(model.clu[0].npts, 56)
+        self.assertEqual(model.fet.npts[0], 56)
+        self.assertTrue(np.array_equal(model.spk[0], self.spk[keep]))
+        self.assertTrue(np.array_equal(model.fet[0], self.fet[keep]))
+        self.assertTrue(np.array_equal(model.gtimes[0], self.gtimes[keep]))
+        self.assertTrue(np.array_equal(model.clu[0].membership, self.membership[keep]))
+        model.undelete_spk(0)
+        self.assertTrue(np.array_equal(model.spk[0], self.spk))
+        self.assertTrue(np.array_equal(model.fet[0], self.fet))
+        self.assertTrue(np.array_equal(model.gtimes[0], self.gtimes))
+        self.assertTrue(np.array_equal(model.clu[0].membership, self.membership))
+
+    def test_delete_undelete_refet(self):
+        '''
+            features of another length are recomputed on delete and on undelete, not spliced
+        '''
+        model = self.model
+        model._fetlen = 3
+        model.delete_spk(0, self.ids, refet=True)
+        self.assertEqual(model.fet[0].shape, (56, 3))
+        model.undelete_spk(0)
+        self.assertEqual(model.fet[0].shape, (60, 3))
+        self.assertTrue(np.allclose(model.fet[0], model.spk._tofet(0, method='pca', ncomp=3)))
+        self.assertTrue(np.array_equal(model.spk[0], self.spk))
+
+    def test_undo_between_delete_and_undelete(self):
+        '''
+            the membership is then a snapshot taken before the delete, its own labels are restored
+        '''
+        model = self.model
+        model.clu[0].fill(np.array([1, 2, 3]), 2)
+        model.delete_spk(0, self.ids)
+        model.clu[0].undo()
+        model.undelete_spk(0)
+        self.assertTrue(np.array_equal(model.clu[0].membership, self.membership))
+
+    def test_out_of_sync_store(self):
+        self.model.gtimes[0] = self.gtimes[:-1]
+        with self.assertRaises(AssertionError):
+            self.model.delete_spk(0, self.ids)
+
+
+class TestGroupPrefetch(unittest.TestCase):
+
+    def setUp(self):
+        '''
+            4 groups of 10 spikes, prepare returns 80 bytes per group
+        '''
+        self.model = SimpleNamespace(spk={g: np.zeros((10, 19, 4)) for g in range(4)},
+                                     clu={g: CLU(np.arange(10) % 2) for g in range(4)},
+                                     gtimes={g: np.arange(10) for g in range(4)})
+        self.prepared = []
+        self.pf = None
+
+    def tearDown(self):
+        if self.pf is not None:
+            self.pf.stop()
+
+    def _prefetch(self, prepare=None, **kwargs):
+        def _prepare(g):
+            self.prepared.append(g)
+            return np.full((10,), g, dtype=np.float64)
+        self.pf = group_prefetch(self.model, prepare or _prepare, **kwargs)
+        return self.pf
+
+    def _wait(self, pf):
+        with pf._cond:
+            while pf._pending or pf._busy is not None:
+                pf._cond.wait(1)
+
+    '''
+       Test Cases
+    '''
+    def test_hit_miss(self):
+        pf = self._prefetch()
+        pf.request([1, 2])
+        self._wait(pf)
+        self.assertListEqual(self.prepared, [1, 2])
+        self.assertTrue(np.array_equal(pf.get(1), np.full((10,), 1.)))
+        self.assertIsNone(pf.get(1))          # handed over to the caller
+        self.assertIsNone(pf.get(3))          # never requested
+        self.assertEqual((pf.nhits, pf.nmisses), (1, 2))
+        pf.request([2])                       # still cached, not prepared again
+        self._wait(pf)
+        self.assertListEqual(self.prepared, [1, 2])
+        old = self.model.clu[2]
+        self.model.clu[2] = CLU(np.zeros((10,), dtype=np.int64))
+        self.assertIsNone(pf.get(2))          # its clu was replaced
+        callbacks = lambda clu: sum(len(v) for v in clu._callbacks.values())
+        pf.request([2])
+        self._wait(pf)
+        self.assertEqual(callbacks(old), 0)
+        self.assertEqual(callbacks(self.model.clu[2]), 2)
+        pf.stop()
+        self.assertEqual(sum(callbacks(clu) for clu in self.model.clu.values()), 0)
+
+    def test_invalidate_during_prepare(self):
+        started, release = threading.Event(), threading.Event()
+        def prepare(g):
+            started.set()
+            release.wait(5)
+            return np.zeros((10,))
+        pf = self._prefetch(prepare)
+        pf.request([1])
+        started.wait(5)
+        self.model.clu[1].fill(np.array([0]), 1)    # `cluster` event while group 1 is prepared
+        release.set()
+        self._wait(pf)
+        self.assertIsNone(pf.get(1))
+        pf.request([1])
+        self._wait(pf)
+        self.assertIsNotNone(pf.get(1))
+
+    def test_evict(self):
+        pf = self._prefetch(capacity=2)
+        pf.request([1, 2, 3])
+        self._wait(pf)
+        self.assertListEqual(list(pf._cache.keys()), [2, 3])
+        pf.stop()
+        pf = self._prefetch(capacity=4, max_bytes=100)
+        pf.request([0, 1, 2])
+        self._wait(pf)
+        self.assertListEqual(list(pf._cache.keys()), [2])
+
+
+if __name__ == "__main__":
+    unittest.main()
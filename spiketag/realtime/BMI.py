@@ -8,6 +8,7 @@ import numpy as np
 import torch as torch
 from collections import namedtuple
 from spiketag.fpga import FPGA
+from spiketag.fpga.memory_api import open_stream
 from torch.multiprocessing import Process, Pipe, SimpleQueue, set_start_method
 from ..utils.utils import EventEmitter, Timer
 from ..realtime import Binner 
@@ -149,7 +150,7 @@ class BMI(object):
         self.r32.close()
 
     def init_bmi_packet_channel(self):
-        self.r32 = io.open('/dev/xillybus_fet_clf_32', 'rb', buffering=4)  # this buffer size is critical for performance
+        self.r32 = open_stream('fet_clf_32', 'rb', buffering=4)  # this buffer size is critical for performance
         self._size = 8*4  # 8 samples, 4 bytes/sample
         self.bmi_buf = None
         print('spike-id packet channel is opened\n')
@@ -1,3 +1,4 @@
+import os
 import seaborn as sns
 import numpy as np
 import torch
@@ -154,13 +155,16 @@ def plot_unit_comparison(bmi_folder, model_foder, unit_No, bg=True, ms=2, ms_sca
     plot_unit_comparison(bmi_folder, model_folder, unit_No=2, ms=1, ms_scale=10);
     '''
     bmi_file = bmi_folder+'/fet.bin'
-    model_file = model_foder+'.pd'
+    model_file = model_foder+'.spkdf'
+    if not os.path.exists(model_file):
+        model_file = model_foder+'.pd'    # saved before the spike table
     param_file = model_foder+'.param'
     from spiketag.base import UNIT
+    from spiketag.fpga import load_param
     bmi_units = UNIT(); mod_units = UNIT()
     mod_units.load_unitpacket(model_file)
     bmi_units.load_unitpacket(bmi_file)
-    param = torch.load(param_file)
+    param = load_param(param_file)
     vq,label = param['vq'], param['label']
     fig = unit_comparison_all_dim(mod_units, bmi_units, vq, label, unit_No=unit_No, 
                                   bg=bg, ms=ms, ms_scale=ms_scale)
@@ -0,0 +1,79 @@
+# import sys
+# sys.path.append('../../../')
+import unittest
+from spiketag.utils.utils import EventEmitter, dispatcher
+
+class TestEvent(unittest.TestCase):
+
+    def setUp(self):
+        '''
+            an emitter and a log of the callbacks called, the dispatcher frames are run by hand
+        '''
+        self.emitter = EventEmitter()
+        self.calls = []
+        self.frames = []
+        dispatcher.schedule = self.frames.append
+
+    def tearDown(self):
+        dispatcher.schedule = None
+        dispatcher.flush()
+
+    def _connect(self, name, **kwargs):
+        def on_spam(*args, **kw):
+            self.calls.append((name, args, kw))
+        on_spam.__name__ = 'on_spam'
+        return self.emitter.connect(on_spam, **kwargs)
+
+    '''
+       Test Cases
+    '''
+    def test_priority(self):
+        self._connect('a')
+        self._connect('b', priority=1)
+        self._connect('c', priority=-1)
+        self._connect('d')
+        self.emitter.emit('spam')
+        self.assertListEqual([c[0] for c in self.calls], ['b', 'a', 'd', 'c'])
+
+    def test_deferred_coalesced(self):
+        '''
+            a burst of events runs the deferred callback once at the frame, with the latest arguments
+        '''
+        self._connect('fast')
+        self._connect('slow', deferred=True, priority=-1)
+        self._connect('slower', deferred=True, priority=-2)
+        for i in range(5):
+            self.emitter.emit('spam', None, i, key=i)
+        self.assertListEqual(self.calls, [('fast', (i,), {'key': i}) for i in range(5)])
+        self.assertEqual(len(self.frames), 1)
+        self.assertEqual(dispatcher.pending, 2)
+        self.calls = []
+        self.frames.pop()()
+        self.assertListEqual(self.calls, [('slow', (4,), {'key': 4}), ('slower', (4,), {'key': 4})])
+        self.assertEqual(dispatcher.pending, 0)
+        self.emitter.emit('spam', None, 5)
+        self.assertEqual(len(self.frames), 1)   # a new frame after the flush
+
+    def test_immediate_without_loop(self):
+        '''
+            without a schedule and a Qt event loop the deferred callback runs right away
+        '''
+        dispatcher.schedule = None
+        self._connect('slow', deferred=True)
+        self.emitter.emit('spam', None, 1)
+        self.emitter.emit('spam', None, 2)
+        self.assertListEqual(self.calls, [('slow', (1,), {}), ('slow', (2,), {})])
+        self.assertEqual(dispatcher.pending, 0)
+
+    def test_unconnect(self):
+        slow = self._connect('slow', deferred=True, priority=2)
+        self.assertIn(slow, self.emitter._options)
+        self.emitter.unconnect(slow)
+        self.assertNotIn(slow, self.emitter._options)
+        self.emitter.emit('spam')
+        self.assertEqual(dispatcher.pending, 0)
+        self.assertListEqual(self.calls, [])
+
+
+if __name__ == "__main__":
+    unittest.main()
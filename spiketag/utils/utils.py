@@ -1,6 +1,7 @@
 import re
 import os
-from collections import defaultdict, deque
+import threading
+from collections import defaultdict, deque, OrderedDict
 from functools import partial
 from time import time
 import numpy as np
@@ -128,6 +129,74 @@ class Timer(object):
 # Event system
 #------------------------------------------------------------------------------
 
+def _qt_single_shot(interval, func):
+    '''
+    call func from the Qt event loop after `interval` ms, False if there is no event loop on this thread
+    '''
+    try:
+        from PyQt5.QtCore import QCoreApplication, QThread, QTimer
+    except ImportError:
+        return False
+    app = QCoreApplication.instance()
+    if app is None or QThread.currentThread() != app.thread():
+        return False
+    QTimer.singleShot(interval, func)
+    return True
+
+
+class event_dispatcher(object):
+    '''
+    Run the deferred callbacks of every EventEmitter once per frame.
+
+    `emit` posts a callback connected with deferred=True here instead of calling it. Until the next
+    frame the posts are coalesced by callback: a burst of events runs it once, with the arguments 
+    of the latest event (the callback reads the current state, e.g. the membership of its clu).
+    At the frame the queued callbacks run by priority (then by the order of their first post).
+
+    The frame is a Qt timer of `interval` ms when the Qt event loop runs on the emitting thread,
+    a custom `schedule(flush)` can be set instead. Without either a posted callback runs right 
+    away, so scripts and tests see the synchronous behaviour.
+    '''
+    def __init__(self, interval=0):
+        self.interval = interval
+        self.schedule = None
+        self._queue = OrderedDict()   # {callback: (priority, args, kwargs)}
+        self._scheduled = False
+        self._lock = threading.Lock()
+
+    def post(self, callback, priority, args, kwargs):
+        with self._lock:
+            self._queue[callback] = (priority, args, kwargs)
+            if self._scheduled:
+                return
+            self._scheduled = True
+        if self.schedule is not None:
+            self.schedule(self.flush)
+        elif not _qt_single_shot(self.interval, self.flush):
+            self.flush()
+
+    @property
+    def pending(self):
+        return len(self._queue)
+
+    def flush(self):
+        '''
+        run the queued callbacks now, return their results
+        '''
+        with self._lock:
+            queue, self._queue = self._queue, OrderedDict()
+            self._scheduled = False
+        calls = sorted(queue.items(), key=lambda item: -item[1][0])
+        res = []
+        for callback, (_, args, kwargs) in calls:
+            with Timer('[Event] deferred -- {}.{}'.format(callback.__module__, callback.__name__), verbose=conf.ENABLE_PROFILER):
+                res.append(callback(*args, **kwargs))
+        return res
+
+
+dispatcher = event_dispatcher()
+
+
 class EventEmitter(object):
     """Class that emits events and accepts registered callbacks.
 
@@ -159,6 +228,7 @@ class EventEmitter(object):
     def _reset(self):
         """Remove all registered callbacks."""
         self._callbacks = defaultdict(list)
+        self._options = {}   # {callback: (priority, deferred)}
 
     def _get_on_name(self, func):
         """Return `eventname` when the function name is `on_<eventname>()`."""
@@ -183,7 +253,7 @@ class EventEmitter(object):
             setattr(self, event,
                     lambda *args, **kwargs: self.emit(event, *args, **kwargs))
 
-    def connect(self, func=None, event=None, set_method=False):
+    def connect(self, func=None, event=None, set_method=False, priority=0, deferred=False):
         """Register a callback function to a given event.
 
         To register a callback function to the `spam` event, where `obj` is
@@ -201,9 +271,20 @@ class EventEmitter(object):
 
         The registration order is conserved and may matter in applications.
 
+        Opt-in dispatch: callbacks with a higher `priority` run first. A `deferred` callback
+        is not called by emit but posted to the `dispatcher`, which coalesces bursts of the
+        event and runs it once at the next frame with the latest arguments (for the heavy 
+        consumers, so an edit is shown by the fast ones first).
+
+        ```python
+        @obj.connect(priority=-1, deferred=True)
+        def on_spam(arg1, arg2):
+            pass
+        ```
+
         """
         if func is None:
-            return partial(self.connect, set_method=set_method)
+            return partial(self.connect, event=event, set_method=set_method, priority=priority, deferred=deferred)
 
         # Get the event name from the function.
         if event is None:
@@ -214,6 +295,8 @@ class EventEmitter(object):
         funcName = func.__module__ + '.' + func.__name__  + '_id' + str(id(func))
         if funcName not in self._registered_func_name(event):
             self._callbacks[event].append(func)
+            if priority != 0 or deferred:
+                self._options[func] = (priority, deferred)
 
         # A new method self.event() emitting the event is created.
         if set_method:
@@ -229,6 +312,7 @@ class EventEmitter(object):
             for callbacks in self._callbacks.values():
                 if func in callbacks:
                     callbacks.remove(func)
+            self._options.pop(func, None)
 
     def emit(self, event, caller=None, *args, **kwargs):
         """Call all callback functions registered with an event.
@@ -240,10 +324,17 @@ class EventEmitter(object):
 
         """
         res = []
-        for callback in self._callbacks.get(event, []):
+        callbacks = self._callbacks.get(event, [])
+        options = getattr(self, '_options', None)
+        if options:
+            callbacks = sorted(callbacks, key=lambda callback: -options.get(callback, (0, False))[0])
+        for callback in callbacks:
             if caller and caller == callback.__module__:
                continue 
 
+            if options and options.get(callback, (0, False))[1]:
+                dispatcher.post(callback, options[callback][0], args, kwargs)
+                continue
             with Timer('[Event] emit -- {}.{}'.format(callback.__module__, callback.__name__), verbose=conf.ENABLE_PROFILER):
                 res.append(callback(*args, **kwargs))
         return res
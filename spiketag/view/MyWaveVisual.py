@@ -13,10 +13,16 @@ VERT_SHADER = """
 // y coordinate of the position.
 attribute float y;
 
-// row, col, and time index.
-attribute vec3 a_index;
+// vertex id (GLSL 120 has no gl_VertexID), the row, col and time index derive from it.
+attribute float a_vertex;
 varying vec3 v_index;
 
+// 1 from the ring position of the oldest sample on (see scroll), 0 before it.
+varying float v_wrap;
+
+// Ring position of the oldest sample of every signal.
+uniform float u_offset;
+
 // Size of the table.
 uniform vec2 u_size;
 
@@ -34,6 +40,13 @@ void main() {
     float nrows = u_size.x;
     float ncols = u_size.y;
 
+    // Signal and sample of this vertex, signals are stored one after the other, 
+    // every signal ends with a copy of its first sample (the ring closes on it).
+    float ch = floor((a_vertex + .5) / (u_npts + 1.));
+    float s  = a_vertex - ch * (u_npts + 1.);
+    vec3 a_index = vec3(mod(ch, ncols), floor((ch + .5) / ncols), mod(s - u_offset, u_npts));
+    v_wrap = (s >= ((u_offset > 0.) ? u_offset : u_npts)) ? 1. : 0.;
+
     // Compute the x coordinate from the time index.
     float x = -1 + 2*a_index.z / (u_npts-1);
     vec2 position = vec2(x, y);
@@ -61,12 +74,14 @@ FRAG_SHADER = """
 
 varying vec4 v_color;
 varying vec3 v_index;
+varying float v_wrap;
 
 void main() {
     gl_FragColor = v_color;
 
-    // Discard the fragments between the signals (emulate glMultiDrawArrays).
-    if ((fract(v_index.x) > 0.) || (fract(v_index.y) > 0.))
+    // Discard the fragments between the signals (emulate glMultiDrawArrays),
+    // and between the newest and the oldest sample of a scrolled signal.
+    if ((fract(v_index.x) > 0.) || (fract(v_index.y) > 0.) || (fract(v_wrap) > 0.))
         discard;
 
 }
@@ -106,8 +121,9 @@ class MyWaveVisual(visuals.Visual):
         self.npts = 0
         self.ncols = ncols
         self.nrows = 0
-        self.index = np.array([])
         self.data = np.array([])
+        self._offset = 0     # ring position of the oldest sample of every signal (see scroll)
+        self._vbo = {}       # attribute name -> gloo.VertexBuffer, reused while the size holds
         self.color = color
         self.ls = ls
         self.gap = gap
@@ -135,9 +151,51 @@ class MyWaveVisual(visuals.Visual):
 
     def _timer_show(self, ev):
         self.data = self.data.astype('float32')
-        self.shared_program['y'] = self.data.reshape(-1,self.nCh).T.ravel()/300
+        self._set_attribute('y', self.data.reshape(-1,self.nCh).T.ravel()/300)
         self.update()
 
+    def _set_attribute(self, name, data, ring=True):
+        '''
+        upload a vertex attribute, into its previous buffer when the size is the same
+        ring: data has one row per sample (nCh*npts), it is uploaded with the first sample
+              of every signal repeated after its last one (see _ring)
+        '''
+        if ring:
+            data = data[self._ring(np.arange(self.nCh*(self.npts+1)))]
+        data = np.ascontiguousarray(data, dtype=np.float32)
+        vbo = self._vbo.get(name)
+        if vbo is not None and vbo.size == data.shape[0]:
+            vbo.set_data(data)
+        else:
+            self._vbo[name] = gloo.VertexBuffer(data)
+            self.shared_program[name] = self._vbo[name]
+
+    def _set_attribute_runs(self, name, data, idx):
+        '''
+        upload data[idx] of a vertex attribute, one sub-buffer update per contiguous run of the vertices of idx
+        '''
+        ch, n = np.divmod(np.asarray(idx, dtype=np.int64), self.npts)
+        vertex = np.unique(np.concatenate((ch*(self.npts+1) + n, ch[n == 0]*(self.npts+1) + self.npts)))
+        for run in np.split(vertex, np.where(np.diff(vertex) != 1)[0] + 1):
+            if run.shape[0] > 0:
+                rows = self._ring(np.arange(run[0], run[-1]+1))
+                self._vbo[name].set_subdata(np.ascontiguousarray(data[rows], dtype=np.float32), offset=run[0])
+
+    def _ring(self, vertex):
+        '''
+        rows of the data (nCh*npts) of the vertices: every signal has npts+1 vertices, the last one 
+        repeats the first sample so that the line strip also joins the last sample to the first one,
+        the shader only cuts the strip between the newest and the oldest sample
+        '''
+        ch, n = np.divmod(vertex, self.npts + 1)
+        return ch*self.npts + n % self.npts
+
+    def _vertex(self, chNo, n):
+        '''
+        vertex (position in data and color) of the time points n of signal chNo
+        '''
+        return chNo*self.npts + (np.asarray(n, dtype=np.int64) + self._offset) % self.npts
+
     def highlight(self, spacial_code, temporal_code, highlight_color=None):
         '''
         highlight segment of the signals in one or several channels
@@ -151,17 +209,16 @@ class MyWaveVisual(visuals.Visual):
         for chNo in spacial_code:
             for nrange in temporal_code:
                 n0, n1 = nrange   # from n0 to n1
-                start  = int(n0+chNo*self.npts)
-                end    = int(n1+chNo*self.npts)
-                self.color[start:end,:] = np.asarray(highlight_color)       
-        self.shared_program['a_color'] = self.color
+                n = np.arange(max(int(n0), 0), min(int(n1), self.npts))
+                self.color[self._vertex(chNo, n),:] = np.asarray(highlight_color)       
+        self._set_attribute('a_color', self.color)
         self.update()
 
 
     def highlight_reset(self):
         self.color = np.repeat(np.ones((self.nCh,4)),
                                         self.npts, axis=0).astype(np.float32)
-        self.shared_program['a_color'] = self.color
+        self._set_attribute('a_color', self.color)
         self.update()
 
 
@@ -206,7 +263,7 @@ class MyWaveVisual(visuals.Visual):
                     end    = n1 + chNo*self.npts
                     self.color[start:end,:] = (1,1,1,0.5)    
 
-        self.shared_program['a_color'] = self.color
+        self._set_attribute('a_color', self.color)
         self.update()
 
 
@@ -233,8 +290,9 @@ class MyWaveVisual(visuals.Visual):
         self.nrows = int(self.nCh / self.ncols)
     
         ####### scale data #######
-        self._scale = self.data.max()-self.data.min()
+        self._scale = (self.data.max()-self.data.min()) or 1.   # a flat segment is drawn unscaled
         self.data = self.data.T.ravel()/self._scale
+        self._offset = 0
         
         self.highlight_reset()
         
@@ -243,7 +301,31 @@ class MyWaveVisual(visuals.Visual):
     def append_data(self, data):
         newdata = data.astype('float32')
         newdata = newdata.T.ravel()/self._scale
-        self.shared_program['y'] = np.hstack((self.data, newdata))
+        self._set_attribute('y', np.hstack((self.data, newdata)), ring=False)
+        self.update()
+
+    def scroll(self, data, backward=False):
+        '''
+        scroll the signals by data.shape[0] time points, data (n, nCh) are the new points 
+        after the last one (before the first one if backward) with the scale of set_data
+
+        every signal is a ring buffer: the new points overwrite the ones scrolled out and only them
+        are uploaded (two sub-buffer updates per signal at most), the shader shifts the time index by u_offset
+        '''
+        data = np.asarray(data, dtype=np.float32)
+        if data.ndim == 1:
+            data = data.reshape(-1,1)
+        n = data.shape[0]
+        if n >= self.npts:
+            return self.set_data(data[-self.npts:])
+        self._offset = (self._offset + (-n if backward else n)) % self.npts
+        t = np.arange(n) if backward else np.arange(self.npts - n, self.npts)
+        vertex = np.concatenate([self._vertex(chNo, t) for chNo in range(self.nCh)])
+        self.data[vertex] = data.T.ravel()/self._scale
+        self.color[vertex] = 1
+        self._set_attribute_runs('y', self.data, vertex)
+        self._set_attribute_runs('a_color', self.color, vertex)
+        self.shared_program['u_offset'] = float(self._offset)
         self.update()
 
     def get_gl_pos(self):
@@ -251,12 +333,13 @@ class MyWaveVisual(visuals.Visual):
             convert data to opengl position, then we can use this position to transform to other coordinate system, eg:
             document coordinate system or viewport coordinate system
         '''
-        x_pos = -1 + 2 * self.index[:,2]/ (self.npts - 1)
+        ch, s = np.divmod(np.arange(self.nCh*self.npts), self.npts)
+        x_pos = -1 + 2 * ((s - self._offset) % self.npts)/ (self.npts - 1)
         y_pos = self.data
         pos = np.column_stack((x_pos,y_pos))
 
         a = np.array([1.0 / self.ncols,1.0 / self.nrows]) * 0.95
-        b = np.array([(-1 + 2 * (self.index[:,0] + 0.5) / self.ncols),(-1 + 2 * (self.index[:,1] * self.gap
+        b = np.array([(-1 + 2 * (ch % self.ncols + 0.5) / self.ncols),(-1 + 2 * (ch // self.ncols * self.gap
              + 0.5) / self.nrows)])
 
         return a * pos + b.T
@@ -268,18 +351,14 @@ class MyWaveVisual(visuals.Visual):
 
     def _render(self):
 
-        # index is (#cols*#rows*#npts, 3) # each row of index is (col_idx, row_idx, npts_idx) 
-        # (col,row):
-        # (0,0)->(0,1)->(0,2)->(0,3)->(0,4)-...->(0,7)->(1,0)->(1,1)-...->(1,7)
-        # index = np.c_[np.repeat(np.repeat(np.arange(ncols), nrows), npts),
-        #               np.repeat(np.tile(np.arange(nrows), ncols), npts),
-        #               np.tile(np.arange(npts), nCh)].astype(np.float32)
-
+        # the vertex shader derives (col_idx, row_idx, npts_idx) of every vertex from its id
         # (col,row):
         # (0,0)->(1,0)->(0,1)->(1,1)->(0,2)->(1,2)...->(0,7)->(1,7)
-        self.index = np.c_[np.repeat(np.tile(np.arange(self.ncols), self.nrows), self.npts),
-                      np.repeat(np.arange(self.nrows), self.ncols*self.npts),
-                      np.tile(np.arange(self.npts), self.nCh)].astype(np.float32)
+        # the ids only change with nCh*(npts+1) (exact in float32 up to 2**24 vertices), 
+        # otherwise set_data uploads the samples alone
+        vbo = self._vbo.get('a_vertex')
+        if vbo is None or vbo.size != self.nCh*(self.npts+1):
+            self._set_attribute('a_vertex', np.arange(self.nCh*(self.npts+1)), ring=False)
         
         if self.color is 'random':
             self.color = np.repeat(np.random.uniform(size=(self.nCh, 4), low=.2, high=.9),
@@ -288,9 +367,9 @@ class MyWaveVisual(visuals.Visual):
             self.color = np.repeat(np.ones((self.nCh,4)),
                               self.npts, axis=0).astype(np.float32)
         
-        self.shared_program['y'] = self.data
-        self.shared_program['a_color'] = self.color
-        self.shared_program['a_index'] = self.index
+        self._set_attribute('y', self.data)
+        self._set_attribute('a_color', self.color)
+        self.shared_program['u_offset'] = float(self._offset)
         self.shared_program['u_size'] = (self.nrows, self.ncols)
         self.shared_program['u_npts'] = self.npts
         self.shared_program['u_gap'] = self.gap
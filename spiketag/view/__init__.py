@@ -1,5 +1,5 @@
 from .cameras import XSyncCamera, YSyncCamera
-from .picker import Picker, ROI_time_series
+from .picker import Picker, ROI_time_series, point_index
 from .probe_view import probe_view
 from .color_scheme import palette
 from .widgets import param_widget
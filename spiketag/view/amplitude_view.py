@@ -47,12 +47,22 @@ class amplitude_view(scatter_2d_view):
     ###              public method 
     ### ----------------------------------------------
 
-    def set_data(self, spk=None, clu=None, spk_times=None):
+    def set_data(self, spk=None, clu=None, spk_times=None, amplitudes=None):
+        '''
+        amplitudes: self.amplitudes(spk, spk_times) if it was prepared ahead
+        '''
         self._spike_time = spk_times 
         self._spk = spk
         self._clu = clu
+        self._amplitudes = amplitudes
         self._draw(self._clu.index_id)
 
+    def amplitudes(self, spk, spk_times):
+        '''
+        (time, peak amplitude) of every spike (touches no GL state, see MainView.prepare)
+        '''
+        return _locate_amplitude(spk, spk_times, self.binsize, np.arange(spk.shape[0]))
+
 
     def register_event(self):
         @self._clu.connect
@@ -63,7 +73,7 @@ class amplitude_view(scatter_2d_view):
         def on_select(*args, **kwargs):
             self.highlight(self._clu.selectlist)
         
-        @self._clu.connect
+        @self._clu.connect(deferred=True)
         def on_cluster(*args, **kwargs):
             self._draw(self._clu.index_id)
             # self._clu.select_clu(self._clu.index_id)
@@ -149,10 +159,12 @@ class amplitude_view(scatter_2d_view):
         '''
         self.poses = None
         self.colors = None
+        if self._amplitudes is None or self._amplitudes.shape[0] != self._clu.npts:
+            self._amplitudes = self.amplitudes(self._spk, self._spike_time)
         
         for clu_id in clus:
             clu_idx = self._clu.index[clu_id]
-            pos = _locate_amplitude(self._spk, self._spike_time, self.binsize, clu_idx) 
+            pos = self._amplitudes[clu_idx] 
             color = np.tile(np.hstack((palette[clu_id],1)),(pos.shape[0],1))
         
             if self.poses is None and self.colors is None:
@@ -47,16 +47,20 @@ class correlogram_view(View):
         assert self._window_bins % 2 == 0
         assert self._window_bins % self._bin_size == 0
 
-    def set_data(self, clu, spk_times):
+    def set_data(self, clu, spk_times, hists=None):
+        '''
+            hists: the correlograms of clu and spk_times if they were computed before (see `correlogram`)
+        '''
         self._clu = clu
         self._spike_time = spk_times 
 
         # Not rendering immedially now, waiting for shortcut
-        self._render()
+        self._render(hists)
 
 
     def register_event(self):
-        @self._clu.connect
+        # the heaviest view: rerendered once per frame after a burst of edits
+        @self._clu.connect(priority=-1, deferred=True)
         def on_cluster(*args, **kwargs):
             self._render()
 
@@ -71,8 +75,14 @@ class correlogram_view(View):
     ###              private method
     ### ----------------------------------------------
 
+    def correlogram(self, clu, spk_times):
+        '''
+            the correlograms of every pair of clusters, touches no GL state (can run on a worker thread)
+        '''
+        return self._correlate(spk_times, clu.membership, clu.index_id, window_bins=self._window_bins, bin_size=self._bin_size) 
+
     def _correlogram(self):
-        return self._correlate(self._spike_time, self._clu.membership, self._clu.index_id, window_bins=self._window_bins, bin_size=self._bin_size) 
+        return self.correlogram(self._clu, self._spike_time)
 
     def _pair_clusters(self):
         '''
@@ -82,7 +92,7 @@ class correlogram_view(View):
             for j in range(i + 1):
                 yield i,j
     
-    def _render(self):
+    def _render(self, hists=None):
         '''
             draw correlogram within grid. eg: if we have 4 clu:
                 3+ + + +
@@ -95,7 +105,8 @@ class correlogram_view(View):
         self.clear()
         self.grid.shape = (self._clu.nclu,self._clu.nclu)
 
-        hists = self._correlogram()
+        if hists is None:
+            hists = self._correlogram()
    
         # begin draw
         with self.building():
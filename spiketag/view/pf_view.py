@@ -25,12 +25,25 @@ class pf_view(scene.SceneCanvas):
         if show is True:
             self.show()
 
-    def set_data(self, clu, gtimes):
+    def set_data(self, clu, gtimes, firing_idx=None):
+        '''
+        gtimes: spike times (sec) of the group
+        firing_idx: pc._get_firing_idx(gtimes) if it was prepared ahead (see firing_idx)
+        '''
         self.clu = clu
         self.gtimes = gtimes
+        self._firing_idx = firing_idx
 
-    def _get_field(self, spk_times):
-        place_field =  self.pc._get_field(spk_times)
+    def firing_idx(self, gtimes):
+        '''
+        the position index of every spike (touches no GL state, see MainView.prepare)
+        '''
+        if self.pc is None:
+            return None
+        return self.pc._get_firing_idx(gtimes)
+
+    def _get_field(self, spk_times, firing_idx=None):
+        place_field =  self.pc._get_field(spk_times, firing_idx)
         return place_field
 
     def _render(self, place_field):
@@ -48,10 +61,13 @@ class pf_view(scene.SceneCanvas):
 
     def register_event(self):
         if self.pc is not None:
-            @self.clu.connect
+            @self.clu.connect(deferred=True)
             def on_select(*args, **kwargs): 
                 if len(self.clu.selectlist) > 0:
-                    place_field = self._get_field(self.gtimes[self.clu.selectlist])
+                    firing_idx = None
+                    if self._firing_idx is not None and self._firing_idx.shape[0] == self.gtimes.shape[0]:
+                        firing_idx = self._firing_idx[self.clu.selectlist]
+                    place_field = self._get_field(self.gtimes[self.clu.selectlist], firing_idx)
                     self._render(place_field)
                 else:
                     pass
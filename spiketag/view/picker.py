@@ -1,7 +1,56 @@
 from vispy import scene, app
+import itertools
 import numpy as np
 from matplotlib import path
 
+
+#------------------------------------------------------------------------------
+# Spatial index of the points a Picker selects from
+#------------------------------------------------------------------------------
+class point_index(object):
+
+    """Uniform grid over 3d points, so that a lasso or rectangle only tests the points 
+    of the grid cells whose projection can meet it.
+
+    A cell is a box, its projection lies within the bounding box of its 8 projected corners,
+    the cells whose corners fall on one side of the net are left out.
+
+    Example
+    -------
+
+    ```
+       index = point_index(fet[:, [0,1,2]])
+       selected = picker.pick(fet[:, [0,1,2]], index=index)
+    ```
+
+    """
+
+    def __init__(self, points, n_cells=16):
+        points = np.asarray(points)[:, :3]
+        lo, hi = points.min(axis=0), points.max(axis=0)
+        size = np.maximum((hi - lo) / n_cells, 1e-12)
+        cell = np.minimum(((points - lo) / size).astype(np.int64), n_cells - 1)
+        key = (cell[:, 0] * n_cells + cell[:, 1]) * n_cells + cell[:, 2]
+        self._order = np.argsort(key, kind='stable')
+        keys, starts = np.unique(key[self._order], return_index=True)
+        self._starts = np.append(starts, key.shape[0])
+        cells = np.stack((keys // n_cells**2, keys // n_cells % n_cells, keys % n_cells), axis=1)
+        corners = np.array(list(itertools.product((0, 1), repeat=3)))
+        self._corners = (lo + (cells[:, None, :] + corners[None, :, :]) * size).reshape(-1, 3)
+
+    def candidates(self, mapping, vertices):
+        """
+            indices of the points whose cell may project into the bounding box of vertices (screen coordinate)
+        """
+        vertices = np.asarray(vertices)[:, :2]
+        vlo, vhi = vertices.min(axis=0), vertices.max(axis=0)
+        screen = mapping.map(self._corners)[:, :2].reshape(-1, 8, 2)
+        meet = np.where((screen.max(axis=1) >= vlo).all(axis=1) & (screen.min(axis=1) <= vhi).all(axis=1))[0]
+        if meet.shape[0] == 0:
+            return np.array([], dtype=np.int64)
+        return np.sort(np.concatenate([self._order[self._starts[i]:self._starts[i+1]] for i in meet]))
+
+
 #------------------------------------------------------------------------------
 # Picker
 #------------------------------------------------------------------------------
@@ -93,19 +142,23 @@ class Picker(object):
             samples which be selected
         ptype :      string
             type of cast, rectangle or lasso
+        index :      point_index
+            spatial index of samples, only the samples near the net are tested
         return:      array
             points be selected
     """
-    def pick(self, samples, auto_disappear=True):
+    def pick(self, samples, auto_disappear=True, index=None):
         if not self._trigger:
             return np.array([])
 
         mask = np.array([])
         if len(self._vertices):
-            data = self._mapping.map(samples[:, :3])[:, :2]
-            select_path = path.Path(self._vertices, closed=True)
-            selected = select_path.contains_points(data)
-            mask = np.where(selected)[0]
+            mask = np.arange(samples.shape[0]) if index is None else index.candidates(self._mapping, self._vertices)
+            if mask.shape[0] > 0:
+                data = self._mapping.map(samples[mask, :3])[:, :2]
+                select_path = path.Path(self._vertices, closed=True)
+                selected = select_path.contains_points(data)
+                mask = mask[np.where(selected)[0]]
         if auto_disappear:
             self.reset()
         return mask
@@ -4,12 +4,46 @@ from vispy.util import keys
 from .color_scheme import palette
 from ..base.CLU import CLU
 from ..view import Picker
+from .picker import point_index
 from ..utils import Timer
 
 
+def _class_quota(counts, budget):
+    '''
+    share the budget among classes of `counts` points: every class keeps min(count, share),
+    the share left by the small classes goes to the large ones
+    '''
+    quota = np.zeros_like(counts)
+    left = budget
+    order = np.argsort(counts, kind='stable')
+    for i, k in enumerate(order):
+        quota[k] = min(counts[k], left // (len(order) - i))
+        left -= quota[k]
+    return quota
+
+
+def _stratified_subset(membership, budget, seed=0):
+    '''
+    sorted indices of at most `budget` points, sampled at random within every class (see _class_quota)
+    '''
+    n = membership.shape[0]
+    if budget is None or n <= budget:
+        return np.arange(n)
+    order = np.argsort(membership, kind='stable')
+    labels, starts, counts = np.unique(membership[order], return_index=True, return_counts=True)
+    quota = _class_quota(counts, budget)
+    rng = np.random.RandomState(seed)
+    picks = [order[s + rng.choice(c, q, replace=False)] for s, c, q in zip(starts, counts, quota)]
+    return np.sort(np.concatenate(picks))
+
+
 class scatter_3d_view(scene.SceneCanvas):
     
-    def __init__(self, show=False, debug=False):
+    def __init__(self, show=False, debug=False, budget=100000):
+        '''
+        budget: points drawn at most, a class stratified subset of them when there are more
+                (None draws every point). The selections resolve against all points.
+        '''
         scene.SceneCanvas.__init__(self, keys=None)
 
         self.unfreeze()
@@ -17,6 +51,12 @@ class scatter_3d_view(scene.SceneCanvas):
         self.view.camera = 'turntable'
 
         self._n = 0
+        self._budget = budget
+        self._drawn = np.array([], dtype=np.int64)   # the indices of the points drawn, in vertex order
+        self._vertex = np.array([], dtype=np.int64)  # the vertex of every point, -1 if it is not drawn
+        self._ring = 0          # stream_in writes over the oldest points from here
+        self._version = 0       # bumped whenever the points move (the spatial index is then rebuilt)
+        self._index = None
         self._transparency = 0.7
         self._control_transparency = False
         self._control_picker = False
@@ -80,6 +120,8 @@ class scatter_3d_view(scene.SceneCanvas):
         '''
 
         self.fet = fet
+        self._ring = 0
+        self._version += 1
 
         if clu is None:
             self.clu = CLU(np.zeros(fet.shape[0],).astype(np.int64))
@@ -110,6 +152,7 @@ class scatter_3d_view(scene.SceneCanvas):
         clu: ndarray, shape=(n_samples, )
         '''
         self.fet = np.vstack((self.fet, fet))
+        self._version += 1
         self.label = np.concatenate((self.label, clu), axis=0)
         self.clu = CLU(self.label)
         self._n = self.fet.shape[0] + fet.shape[0]
@@ -134,6 +177,35 @@ class scatter_3d_view(scene.SceneCanvas):
             self.highlight(self.clu.selectlist)
 
 
+    @property
+    def budget(self):
+        return self._budget
+
+    @budget.setter
+    def budget(self, budget):
+        self._budget = budget
+        self._render()
+
+    @property
+    def spatial_index(self):
+        '''
+        point_index of all points in the dimensions shown, rebuilt after the points or dimensions changed
+        '''
+        key = (self._version, tuple(self.dimension))
+        if self._index is None or self._index[0] != key:
+            self._index = (key, point_index(self.fet[:, self.dimension]))
+        return self._index[1]
+
+    def _local(self, ids):
+        '''
+        positions among the drawn points of the points ids that are drawn
+        '''
+        ids = np.asarray(ids, dtype=np.int64)
+        if self._drawn.shape[0] == self.fet.shape[0] or ids.shape[0] == 0:
+            return ids
+        pos = self._vertex[ids]
+        return pos[pos >= 0]
+
     def set_dimension(self, dimension):
         self.dimension = dimension
         self._render()
@@ -141,20 +213,28 @@ class scatter_3d_view(scene.SceneCanvas):
             self.highlight(self.clu.selectlist)
         self.mode = ''
 
-    def _render(self):
+    def _render(self, drawn=None):
+        '''
+        drawn: the points to draw, by default a class stratified subset within the budget
+        '''
+        #######################################################
+        ### step0: choose the points within the budget
+        self._drawn = _stratified_subset(self.clu.membership, self._budget) if drawn is None else drawn
+        drawn = self._drawn
+        self._vertex = np.full(self.fet.shape[0], -1, dtype=np.int64)
+        self._vertex[drawn] = np.arange(drawn.shape[0])
+
         #######################################################
         ### step1: set the color for clustering
-        base_color = np.asarray([palette[i] for i in self.clu.membership])
-        _transparency = np.ones((len(self.fet), 1)) * self._transparency
-        edge_color = np.hstack((base_color, _transparency))
+        base_color = np.asarray([palette[i] for i in self.clu.membership[drawn]])
 
         #######################################################
         ### step2: set transparency for density
         if self.rho is None:
-            _transparency = np.ones((len(self.fet), 1)) * self._transparency
+            _transparency = np.ones((len(drawn), 1)) * self._transparency
             edge_color = np.hstack((base_color, _transparency))
         else:
-            _transparency = self.rho.reshape(-1, 1)
+            _transparency = self.rho.reshape(-1, 1)[drawn]
             edge_color = np.hstack((base_color, _transparency))
 
         #######################################################
@@ -165,8 +245,8 @@ class scatter_3d_view(scene.SceneCanvas):
         # TODO: add functionality to change :3 to input specific 3 dims
         if self.dimension is None:
             self.dimension = [0,1,2]
-        self.scatter.set_data(self.fet[:, self.dimension], symbol='o', edge_width=0.0, 
-                              size=self._size.reshape(-1,1), edge_color=self.color, face_color=self.color)
+        self.scatter.set_data(self.fet[drawn][:, self.dimension], symbol='o', edge_width=0.0, 
+                              size=self._size[drawn].reshape(-1,1), edge_color=self.color, face_color=self.color)
 
         self.dimension_text.text = str(self.dimension) 
         self.dimension_text.pos  = np.array([35,10])
@@ -180,18 +260,37 @@ class scatter_3d_view(scene.SceneCanvas):
             self.info_text.font_size = 12
 
     def _stream_in_data(self, fet, clu=None):
+        '''
+        ring buffer: the stream overwrites the oldest points in place, return their indices
+        '''
         stream_size = fet.shape[0]
-        self.fet = np.roll(self.fet, -stream_size, axis=0)
-        self.fet[-stream_size:] = fet
-        self.clu.membership = np.roll(self.clu.membership, -stream_size)
-        self.clu.membership[-stream_size:] = clu
+        pos = (self._ring + np.arange(stream_size)) % self.fet.shape[0]
+        self._ring = (self._ring + stream_size) % self.fet.shape[0]
+        self._version += 1
+        self.fet[pos] = fet
+        self.clu.membership[pos] = clu
         self.clu.__construct__()
+        return pos
 
-    def _stream_in_render(self, fet, clu=None, rho=None, highlight_no=None):
+    def _stream_in_render(self, fet, clu=None, rho=None, highlight_no=None, pos=None):
         #######################################################
-        ### step0: roll the previous data for stream_size
+        ### step0: the vertices of the streamed points, a streamed point that is not drawn
+        ###        (outside the budget) takes the vertex of the oldest drawn point, 
+        ###        so the number of drawn points stays the same
         stream_size = fet.shape[0]
-        self.scatter._data = np.roll(self.scatter._data, -stream_size)
+        if self._drawn.shape[0] == self.fet.shape[0]:
+            local, rows = pos, np.arange(stream_size)
+        else:
+            new = pos[self._vertex[pos] < 0][-self._drawn.shape[0]:]
+            if new.shape[0] > 0:
+                age = (self._drawn - self._ring) % self.fet.shape[0]    # 0 is the oldest point
+                age[self._vertex[pos[self._vertex[pos] >= 0]]] = self.fet.shape[0]
+                vertex = np.argpartition(age, new.shape[0] - 1)[:new.shape[0]]
+                self._vertex[self._drawn[vertex]] = -1
+                self._drawn[vertex] = new
+                self._vertex[new] = vertex
+            rows = np.where(self._vertex[pos] >= 0)[0]
+            local = self._vertex[pos[rows]]
 
         #######################################################
         ### step1: set the color for clustering
@@ -212,19 +311,25 @@ class scatter_3d_view(scene.SceneCanvas):
             _edge_color[-highlight_no:, -1] = 1.
 
         #######################################################
-        ### step3: update scatter._data for the latest stream_size
-
-        self.scatter._data[-stream_size:]['a_position'] = fet[:,:3]
-        self.scatter._data[-stream_size:]['a_fg_color'] = _edge_color
-        self.scatter._data[-stream_size:]['a_bg_color'] = _edge_color
-
-        self.scatter._vbo.set_data(self.scatter._data)
+        ### step3: update scatter._data of the streamed points, upload only their vertices 
+        ###        (one sub-buffer update per contiguous run)
+
+        self.scatter._data['a_position'][local] = fet[rows][:, self.dimension]
+        self.scatter._data['a_fg_color'][local] = _edge_color[rows]
+        self.scatter._data['a_bg_color'][local] = _edge_color[rows]
+        self.color[local] = _edge_color[rows]
+        self._cache_color[local] = _edge_color[rows]
+
+        local = np.sort(local)
+        for run in np.split(local, np.where(np.diff(local) != 1)[0] + 1):
+            if run.shape[0] > 0:
+                self.scatter._vbo.set_subdata(self.scatter._data[run[0]:run[-1]+1], offset=run[0])
         self.scatter.update() 
 
     def stream_in(self, fet, clu=None, rho=None, highlight_no=None):
         '''
         stream new data into previous data
-        but the total number of data is fixed through self._n
+        but the total number of data is fixed through self._n (a ring buffer, the oldest points are replaced)
 
         data = np.zeros(n, dtype=[('a_position', np.float32, 3),
                                   ('a_fg_color', np.float32, 4),
@@ -235,9 +340,9 @@ class scatter_3d_view(scene.SceneCanvas):
         stream_size = fet.shape[0]
         with Timer('stream_in {0} points'.format(stream_size), verbose=self.debug):
             # update self.fet and self.clu
-            self._stream_in_data(fet, clu)
+            pos = self._stream_in_data(fet, clu)
             # update self.scatter._data which is used for rendering(bind to scatter._vbo)
-            self._stream_in_render(fet, clu, rho, highlight_no)
+            self._stream_in_render(fet, clu, rho, highlight_no, pos)
 
 
     def set_range(self):
@@ -251,7 +356,14 @@ class scatter_3d_view(scene.SceneCanvas):
         """
         highlight the nth index points (mask) with _highlight_color
         refresh is False means it will append
+        the points of mask that are not drawn (outside the budget) are drawn from now on
         """
+        mask = np.asarray(mask, dtype=np.int64)
+        if self._local(mask).shape[0] < mask.shape[0]:
+            highlighted = self._drawn[self._cache_mask_.astype(np.int64)] if not refresh else np.array([], dtype=np.int64)
+            self._render(drawn=np.union1d(self._drawn, mask))
+            mask = np.union1d(highlighted, mask)
+        mask = self._local(mask)
         if refresh is True and len(self._cache_mask_)>0:
             _cache_mask_ = self._cache_mask_
             self.color[_cache_mask_, :] = self._cache_color[_cache_mask_, :]
@@ -306,9 +418,9 @@ class scatter_3d_view(scene.SceneCanvas):
         if keys.CONTROL in e.modifiers and e.is_dragging:
             if self.key_option in ['1','2']:
                 if self.clu.selectlist.shape[0]==0:
-                    mask = self._picker.pick(self.fet[:, self.dimension])
+                    mask = self._picker.pick(self.fet[:, self.dimension], index=self.spatial_index)
                 elif self.clu.selectlist.shape[0]>0:
-                    mask = self._picker.pick(self.fet[:, self.dimension])
+                    mask = self._picker.pick(self.fet[:, self.dimension], index=self.spatial_index)
                     mask = np.intersect1d(mask, self.clu.selectlist)
                 self.highlight(mask)
                 self.clu.select(mask)
@@ -316,11 +428,11 @@ class scatter_3d_view(scene.SceneCanvas):
 
     def toggle_noise_clu(self):
         if self._noise_toggle == False:
-            self.color[self.clu[0],-1] = 0.02
+            self.color[self._local(self.clu[0]),-1] = 0.02
             self._update()
             self._noise_toggle = True
         elif self._noise_toggle == True:
-            self.color[self.clu[0],-1] = self._transparency
+            self.color[self._local(self.clu[0]),-1] = self._transparency
             self._update()
             self._noise_toggle = False
 
@@ -1,6 +1,5 @@
 import numpy as np
 import numexpr as ne
-import torch as tc
 from collections import OrderedDict
 from phy.plot import View, base, visuals
 from vispy.util.event import Event
@@ -10,14 +9,68 @@ from ..utils import conf
 from ..utils.conf import error, warning
 from ..base.CLU import CLU
 from ._core import _get_array, _accumulate
-from ._core import _spkNo2maskNo_numba, _cache_out, _cache_in_vector, _cache_in_scalar, _representsInt, _get_box_index
+from ._core import _cache_out, _cache_in_vector, _cache_in_scalar, _representsInt, _get_box_index
 from collections import deque
 from PyQt5.QtCore import Qt
 
+
+def _slot_capacity(n, slack=0.25, minimum=16):
+    '''
+    #spikes the slot of a cluster of n spikes can hold, the room left absorbs moves into the cluster
+    '''
+    return n + max(int(n*slack), minimum)
+
+
+# level of detail: a cluster with more spikes than the budget draws a stratified sample of them
+# and, as a density shaded envelope of all its spikes, the curves of these quantiles
+_ENVELOPE_Q = np.linspace(0.1, 0.9, 9)
+_ENVELOPE_ALPHA = (1 - np.abs(_ENVELOPE_Q - 0.5) * 1.6).astype(np.float32)   # denser towards the median
+
+
+def _stratified_sample(ids, budget, seed=0):
+    '''
+    `budget` of the spikes ids (in time order), one at random from each of `budget` equal strata
+    so that the sample covers the whole recording
+    '''
+    n = len(ids)
+    if budget is None or n <= budget:
+        return ids
+    edges = np.arange(budget + 1) * n // budget
+    rng = np.random.RandomState(seed)
+    return ids[edges[:-1] + (rng.random_sample(budget) * np.diff(edges)).astype(np.int64)]
+
+
+def _set_subdata(program, name, data, block):
+    '''
+    upload data[block] into the vertex buffer of attribute `name`, 
+    the whole array if that buffer can not be updated in place
+    '''
+    try:
+        program[name].set_subdata(data[block], offset=block.start)
+    except (AttributeError, KeyError, IndexError, ValueError):
+        program[name] = data
+
+def _runs(idx):
+    '''
+    the vertex ranges (slices) of the contiguous runs of the vertices idx
+    '''
+    idx = np.unique(np.asarray(idx, dtype=np.int64))
+    breaks = np.where(np.diff(idx) != 1)[0] + 1
+    return [slice(run[0], run[-1] + 1) for run in np.split(idx, breaks) if run.shape[0] > 0]
+
 class spike_view(View):
    
-    def __init__(self, interactive=True):
+    def __init__(self, interactive=True, budget=1000, lod_zoom=2.):
+        '''
+        budget:   waveforms drawn per cluster, a larger cluster draws a stratified sample and its envelope
+                  (None draws every waveform)
+        lod_zoom: the clusters in sight are drawn in full detail when zoomed in by more than lod_zoom
+        '''
         super(spike_view, self).__init__('grid')
+        self._budget = budget
+        self.lod_zoom = lod_zoom
+        self._detail = set()   # clusters drawn in full detail (zoomed in)
+        self._pinned = {}      # {cluNo: global ids} selected spikes, always drawn
         self.palette = palette
         self._transparency = 0.2
         self._highlight_color = np.array([1,0,0,1]).astype('float32')
@@ -40,26 +93,108 @@ class spike_view(View):
         gui.add_view(self)
 
 
-    def set_data(self, spk, clu=None):
+    def layout(self, spk, clu):
+        '''
+        the vertex buffers of spk and clu, touches no GL state 
+        (so the layout of another group can be prepared on a worker thread)
+
+        every cluster owns a slot: a block of vertices [ch][row][sample], the rows hold the drawn 
+        spikes with room for more (see _slot_capacity) followed by the envelope curves, the unused 
+        rows are transparent. An edit then only rewrites the slots of the changed clusters (see rerender).
+        '''
+        return self._allocate(self._affine_transform(spk), clu)
+
+    @property
+    def budget(self):
+        return self._budget
+
+    @budget.setter
+    def budget(self, budget):
+        self._budget = budget
+        if hasattr(self, '_layout'):
+            self.rerender(relayout=True)
+
+    def _slot_spikes(self, ids, detail=False, pinned=None):
+        '''
+        the spikes of a cluster that are drawn: all of them in detail, otherwise a stratified 
+        sample of `budget` spikes plus the pinned (selected) ones
+        '''
+        ids = np.asarray(ids)
+        if detail or self._budget is None or len(ids) <= self._budget:
+            return ids
+        drawn = _stratified_sample(ids, self._budget)
+        if pinned is not None and len(pinned) > 0:
+            drawn = np.union1d(drawn, np.intersect1d(pinned, ids, assume_unique=True))
+        return drawn
+
+    def _allocate(self, spk, clu, detail=(), pinned={}):
+        n_samples, n_ch = spk.shape[1], spk.shape[2]
+        slots, drawn, offset = OrderedDict(), {}, 0
+        for cluNo in clu.index_id:
+            drawn[cluNo] = self._slot_spikes(clu.index[cluNo], cluNo in detail, pinned.get(cluNo))
+            capacity = _slot_capacity(len(drawn[cluNo]))
+            slots[cluNo] = (offset, capacity)
+            offset += (capacity + len(_ENVELOPE_Q)) * n_ch * n_samples
+        xsig = np.linspace(-0.5, 0.5, n_samples)
+        layout = {'spk': spk, 'xsig': xsig, 'slots': slots, 'slot_ids': {}, 'cluster_ids': {},
+                  'depth': np.zeros((offset, 3), dtype=np.float32),
+                  'color': np.zeros((offset, 4), dtype=np.float32),
+                  'box_index': np.zeros((offset, 2), dtype=np.float32),
+                  'drawn': np.zeros((offset,), dtype=np.bool_),
+                  'signal_index': np.repeat(np.arange(offset//n_samples), n_samples).astype(np.float32)}
+        layout['depth'][:, 0] = np.tile(xsig, offset//n_samples)
+        for cluNo in slots:
+            self._fill_slot(layout, cluNo, clu.index[cluNo], drawn[cluNo])
+        return layout
+
+    def _fill_slot(self, layout, cluNo, ids, drawn):
+        '''
+        write the `drawn` spikes of cluster cluNo (all its spikes are `ids`) into its slot,
+        with the envelope of all spikes if only a sample of them is drawn,
+        return the vertex range of the slot
+        '''
+        spk = layout['spk']
+        n_samples, n_ch = spk.shape[1], spk.shape[2]
+        offset, capacity = layout['slots'][cluNo]
+        rows, n = capacity + len(_ENVELOPE_Q), len(drawn)
+        block = slice(offset, offset + rows*n_ch*n_samples)
+        y = np.zeros((n_ch, rows, n_samples), dtype=np.float32)
+        y[:, :n] = spk[drawn].transpose(2, 0, 1)
+        color = np.zeros((n_ch, rows, n_samples, 4), dtype=np.float32)
+        color[..., :3] = palette[cluNo]
+        color[:, :n, :, 3] = self._transparency
+        if n < len(ids):
+            y[:, capacity:] = np.quantile(spk[ids], _ENVELOPE_Q, axis=0).transpose(2, 0, 1)
+            color[:, capacity:, :, 3] = _ENVELOPE_ALPHA[None, :, None]
+        box = np.zeros((n_ch, rows, n_samples, 2), dtype=np.float32)
+        box[..., 0] = np.arange(n_ch)[:, None, None]
+        box[..., 1] = cluNo
+        layout['depth'][block, 1] = y.ravel()
+        layout['depth'][block, 2] = 0
+        layout['color'][block] = color.reshape(-1, 4)
+        layout['box_index'][block] = box.reshape(-1, 2)
+        layout['drawn'][block] = np.broadcast_to(np.arange(rows)[None, :, None] < n, (n_ch, rows, n_samples)).ravel()
+        layout['cluster_ids'][cluNo] = np.array(ids)
+        layout['slot_ids'][cluNo] = np.array(drawn)
+        return block
+
+    def set_data(self, spk, clu=None, layout=None):
         #################################
         # this init block take about 1ms
-        self.spk = self._affine_transform(spk)
         if clu is None:
             self.clu = CLU(np.zeros(spk.shape[0]).astype('int'))
         else:
             self.clu = clu
+        if layout is None:
+            layout = self.layout(spk, self.clu)
+        self._layout = layout
+        self._detail, self._pinned = set(), {}
+        self.spk = layout['spk']
         self.n_signals = spk.shape[0]
         self.n_samples = spk.shape[1]
         self.n_ch      = spk.shape[2]
-        self._xsig = np.linspace(-0.5, 0.5, self.n_samples)
-        self.x = np.tile(self._xsig, self.n_ch*self.n_signals)
-        self._depth = tc.zeros((self.x.shape[0], 3)).float()
-        self._depth[:, 0] = tc.from_numpy(self.x)        
-        self.signal_index = np.repeat(np.arange(len(self.x)/len(self._xsig)), 
-                                  len(self._xsig)).astype(np.float32)
-        # self._depth = tc.zeros((self.x.shape[0], 3)).float()
-        # self._depth[:, 0] = tc.from_numpy(self.x)
-        # self.depth = np.zeros((self.x.shape[0], 3)).astype(np.float32)
+        self._xsig = layout['xsig']
+        self.signal_index = layout['signal_index']
 
         #################################
         self.clear()
@@ -71,7 +206,7 @@ class spike_view(View):
 
     def register_event(self):
         
-        @self.clu.connect
+        @self.clu.connect(priority=1)
         def on_cluster(*args, **kwargs):
             with Timer('[VIEW] Spikeview -- rerender', verbose=conf.ENABLE_PROFILER):
                 self._selected = {}
@@ -105,82 +240,40 @@ class spike_view(View):
         r = np.linalg.solve(a,b)
         return r[0], r[1]
 
-    def _get_data(self, data_bound):
-        # new_data_list=[]
-        # self._y=[]
-        # self._box_=[]
-        # self._color_=[]
-        i = 0
-        # self.box_index   = np.zeros((np.prod(self.spk.shape), 2)).astype(np.float32)
-        # self.color_index   = np.zeros((np.prod(self.spk.shape), 4)).astype(np.float32)
-        self.box_index   = np.zeros((self.spk.shape[0]*self.spk.shape[2], 2)).astype(np.float32)   # the box index for every pts
-        self.color_index = np.zeros((self.spk.shape[0]*self.spk.shape[2], 4)).astype(np.float32)   # the color for every pts
-        self._y          = np.zeros((self.spk.shape[0]*self.spk.shape[2], self.spk.shape[1])).astype(np.float32)  # the value for every pts
-        for chNo in range(self.n_ch):
-            for cluNo in self.clu.index_id:
-                s = self.spk[self.clu.index[cluNo],:,chNo]
-                if s.ndim == 1:
-                    s = s.reshape(1, -1)
-                nspk = s.shape[0]
-                # self._y.append(np.asarray(s))
-                self._y[i:i+nspk, :] = s
-                # self._depth[i:i+nspk*s.shape[1], 1] = tc.from_numpy(s.ravel())
-                self.box_index[i:i+nspk, :] = np.array([chNo, cluNo])
-                self.color_index[i:i+nspk, :3] = np.array(palette[cluNo])
-                self.color_index[i:i+nspk,  3] = self._transparency
-                i+=nspk
-                
-                # color_len = nspk*self.n_samples
-                # self.color_index[j:j+color_len, :3] = np.array(palette[cluNo])
-                # self.color_index[j:j+color_len,  3] = self._transparency
-                # j+=color_len
-
-                # transparency= np.tile(self._transparency, (n,1))
-                # color       = np.hstack((np.asarray([self.palette[cluNo] for i in s]), transparency)).astype(np.float32)
-                # box_index   = np.tile((chNo, cluNo), ((n*self.n_samples,1))).astype(np.float32)
-                # self._box_.append(box_index)
-                # self._color_.append(color)
-                # new_data_list.append({# 'y': y,
-                #                       # 'x': x,
-                #                       'color': color,
-                #                       # 'depth': depth,
-                #                       # 'data_bounds': data_bounds,
-                #                       'box_index': box_index})
-        # self.data = _accumulate(new_data_list)
-        # self.data = {}
-        # self.data['box_index'] = np.vstack(self._box_)
-        # self.data['color']     = np.vstack(self._color_)
-        
-        self.y = self._y.ravel()
+    def _changed_slots(self):
+        '''
+        {cluNo: drawn spikes} of the clusters whose spikes changed, None if the slots must be laid out 
+        again (a new cluster id, a cluster outgrew its slot, or more than half of the rows are unused)
+        '''
+        slots, cluster_ids = self._layout['slots'], self._layout['cluster_ids']
+        changed = {}
+        for cluNo, ids in self.clu.index.items():
+            if cluNo not in slots:
+                return None
+            if not np.array_equal(cluster_ids[cluNo], ids):
+                changed[cluNo] = self._slot_spikes(ids, cluNo in self._detail, self._pinned.get(cluNo))
+        for cluNo in slots:
+            if cluNo not in self.clu.index and len(cluster_ids[cluNo]) > 0:
+                changed[cluNo] = np.array([], dtype=np.int64)
+        return self._fit_slots(changed)
+
+    def _fit_slots(self, changed):
+        '''
+        changed ({cluNo: drawn spikes}) if it fits in the slots, otherwise None
+        '''
+        slots, slot_ids = self._layout['slots'], self._layout['slot_ids']
+        if any(len(drawn) > slots[cluNo][1] for cluNo, drawn in changed.items()):
+            return None
+        n_drawn = sum(len(changed[cluNo]) if cluNo in changed else len(slot_ids[cluNo]) for cluNo in slots)
+        if 2 * n_drawn < sum(capacity for _, capacity in slots.values()):
+            return None
+        return changed
 
     def _build(self):
         self.grid.shape = (self.n_ch, self.clu.nclu)
-        # data = self.data
-        # self.box_index = np.vstack(self._box_)
-        # self.box_index = np.zeros((np.prod(self.spk.shape), 2)).astype(np.float32)
-        # _get_box_index(self.box_index, self.n_ch, self.clu.nclu, self.n_samples, list(self.clu.index.values()))
-
-        # self.depth = np.c_[self.x, self.y, np.zeros(*self.x.shape)].astype(np.float32)
-        self._depth[:, 1] = tc.from_numpy(self.y)
-        self._depth[:, 2] = 0
-        self.depth = self._depth.numpy()
-        # self._depth[:, 1] = tc.from_numpy(self.y)
-        # self.depth = self._depth.numpy()
-        
-        # self.color = np.repeat(self.color_index, self.n_samples, axis=0)
-        n = self.color_index.shape[0]
-        color_index = tc.from_numpy(self.color_index)
-        color_index.unsqueeze_(-1); # create the third dim, so you can expand on that dim
-        self.color = color_index.expand(n, 4, self.n_samples).transpose_(1,2).reshape(-1, 4).numpy()
-
-        # self.box_index = np.repeat(self.box_index, self.n_samples, axis=0)
-        n = self.box_index.shape[0]
-        box_index = tc.from_numpy(self.box_index)
-        box_index.unsqueeze_(-1);
-        self.box_index = box_index.expand(n, 2, self.n_samples).transpose_(1,2).reshape(-1, 2).numpy()
-
-        # self.color = np.repeat(np.vstack(self._color_), self.n_samples, axis=0)
-        # self.color = self.color_index
+        self.depth = self._layout['depth']
+        self.color = self._layout['color']
+        self.box_index = self._layout['box_index']
         self._cache_depth = self.depth.copy()
         self._cache_color = self.color.copy()
         self._cache_mask_ = np.array([])
@@ -189,44 +282,128 @@ class spike_view(View):
     def render(self, update=False):
         visual = visuals.PlotVisual()
         self.add_visual(visual)
-        
-        with Timer('[VIEW] Spikeview -- render - step 0: get data', verbose=conf.ENABLE_PROFILER):
-            self._get_data(self._data_bound)
 
-        with Timer('[VIEW] Spikeview -- render - step 1: set data', verbose=conf.ENABLE_PROFILER):
+        with Timer('[VIEW] Spikeview -- render - step 0: set data', verbose=conf.ENABLE_PROFILER):
             self._build()
 
-        with Timer('[VIEW] Spikeview -- render - step 2: gsgl update', verbose=conf.ENABLE_PROFILER):
+        with Timer('[VIEW] Spikeview -- render - step 1: gsgl update', verbose=conf.ENABLE_PROFILER):
             visual.program['a_position'] = self.depth
             visual.program['a_color'] = self.color
             visual.program['a_signal_index'] = self.signal_index
             visual.program['a_box_index'] = self.box_index
 
 
-    def rerender(self, clu=None, data_bound=None):
+    def rerender(self, clu=None, data_bound=None, relayout=False):
         '''
         called when you want to rerender the new clustering 
+        only the slots of the clusters changed since the last render are rewritten and uploaded,
+        the whole buffers when the slots have to be laid out again (or relayout is True)
         '''
         if clu is not None:
             self.clu = clu
-        nclu = self.clu.nclu
-        if data_bound is None:
-            data_bound = (-1,-1,1,1)
+        self._update_slots(None if relayout else self._changed_slots())
 
+    def _update_slots(self, changed):
+        '''
+        rewrite and upload the slots of changed ({cluNo: drawn spikes}), all slots if it is None
+        '''
         with Timer('[VIEW] Spikeview -- rerender - step 0: get data', verbose=conf.ENABLE_PROFILER):
-            self._get_data(data_bound)
-        
+            restored = _runs(self._cache_mask_) if changed is not None else []
+            if self._cache_mask_.shape[0] > 0:
+                # restore the highlighted spikes in place, they are uploaded with the changed slots
+                _cache_out(self._cache_mask_, self._cache_color, self.color)
+                _cache_out(self._cache_mask_, self._cache_depth, self.depth)
+            if changed is None:
+                self._layout = self._allocate(self.spk, self.clu, self._detail, self._pinned)
+                self.signal_index = self._layout['signal_index']
+            else:
+                blocks = [self._fill_slot(self._layout, cluNo, self.clu.index.get(cluNo, []), drawn) 
+                          for cluNo, drawn in changed.items()]
+
         with Timer('[VIEW] Spikeview -- rerender - step 1: set data', verbose=conf.ENABLE_PROFILER):
-            self._build()
+            self.grid.shape = (self.n_ch, self.clu.nclu)
+            if changed is None:
+                self._build()
+            else:
+                for block in blocks:
+                    self._cache_depth[block] = self.depth[block]
+                    self._cache_color[block] = self.color[block]
+                self._cache_mask_ = np.array([])
 
         with Timer('[VIEW] Spikeview -- rerender - step 2: gsgl update', verbose=conf.ENABLE_PROFILER):
-            # [self._a_pos, self._a_color, self._a_index] = _pv_set_data(self.visuals[0], **data)
-            self.visuals[0].program['a_position'] = self.depth
-            self.visuals[0].program['a_color'] = self.color
-            self.visuals[0].program['a_box_index'] = self.box_index
+            program = self.visuals[0].program
+            if changed is None:
+                program['a_signal_index'] = self.signal_index
+            for name, data in (('a_position', self.depth), ('a_color', self.color), ('a_box_index', self.box_index)):
+                if changed is None:
+                    program[name] = data
+                else:
+                    for block in blocks + (restored if name != 'a_box_index' else []):
+                        _set_subdata(program, name, data, block)
 
         self.update()
 
+    def _clusters_in_sight(self):
+        '''
+        the clusters (grid columns) in sight when zoomed in by more than lod_zoom, otherwise none
+        '''
+        panzoom = getattr(self, 'panzoom', None)
+        if panzoom is None or self._budget is None:
+            return set()
+        zoom, pan = np.asarray(panzoom.zoom, dtype=np.float64), np.asarray(panzoom.pan, dtype=np.float64)
+        if zoom[0] < self.lod_zoom:
+            return set()
+        lo, hi = -1/zoom[0] - pan[0], 1/zoom[0] - pan[0]
+        nclu = self.clu.nclu
+        left = -1 + 2*np.arange(nclu)/nclu
+        return set(self.clu.index_id[(left + 2/nclu > lo) & (left < hi)].tolist())
+
+    def _refill(self, clus):
+        '''
+        draw the clusters clus again with the current detail and pinned spikes,
+        return True if any slot changed (its highlight is then lost)
+        '''
+        changed = {}
+        for cluNo in clus:
+            if cluNo in self.clu.index:
+                drawn = self._slot_spikes(self.clu.index[cluNo], cluNo in self._detail, self._pinned.get(cluNo))
+                if not np.array_equal(drawn, self._layout['slot_ids'][cluNo]):
+                    changed[cluNo] = drawn
+        if not changed:
+            return False
+        self._update_slots(self._fit_slots(changed))
+        return True
+
+    def update_detail(self):
+        '''
+        full detail for the clusters in sight when zoomed in, sampled waveforms and envelopes when zoomed out
+        '''
+        detail = self._clusters_in_sight()
+        if detail != self._detail:
+            clus = detail.symmetric_difference(self._detail)
+            self._detail = detail
+            if self._refill(clus):
+                self.highlight(self._selected)
+
+    def _pin(self, selected, refresh=True):
+        '''
+        make sure the selected spikes ({cluNo: local ids}) are drawn in the sampled clusters,
+        return True if slots were refilled
+        '''
+        if self._budget is None:
+            return False
+        pinned = {} if refresh else dict(self._pinned)
+        missing = []
+        for cluNo, spkNolist in selected.items():
+            if cluNo not in self.clu.index or len(spkNolist) == 0:
+                continue
+            ids = self.clu.index[cluNo][np.array(list(spkNolist)).astype('int64')]
+            pinned[cluNo] = ids if cluNo not in pinned else np.union1d(pinned[cluNo], ids)
+            if not np.isin(ids, self._layout['slot_ids'][cluNo]).all():
+                missing.append(cluNo)
+        self._pinned = pinned
+        return self._refill(missing)
+
 
     def clear(self):
         """Reset the view."""
@@ -275,8 +452,9 @@ class spike_view(View):
             self._transparency = 0.9
         elif self._transparency <= 0.001:
             self._transparency = 0.001
-        self.color[:,-1] = self._transparency
-        self._cache_color[:,-1] = self._transparency
+        visible = self._layout['drawn']   # the unused rows and the envelopes keep their alpha
+        self.color[visible,-1] = self._transparency
+        self._cache_color[visible,-1] = self._transparency
         self.visuals[0].program['a_color'] = self.color
         self.update()
 
@@ -285,22 +463,19 @@ class spike_view(View):
     def _spkNo2maskNo(self, spkNolist, cluNo):
         '''
         only for highlight, calculate view mask
-        accelerated by numba
+        (the vertices of the spikes in the slot of cluNo)
         '''
-        spkNolist = np.array(list(spkNolist)).astype('int32')
-        n_signals=self.n_signals
-        n_samples=self.n_samples
-        n_ch     =self.n_ch
-        clu_offset = self.clu._clu_cumsum
-        N = n_samples*n_ch*len(spkNolist)
-        mask = np.zeros((N,)).astype('int64')
-        # below is a numba func
-        _spkNo2maskNo_numba(n_signals, n_samples, n_ch, clu_offset,
-                            cluNo, spkNolist, mask)
-        if any(mask) > 0:
-            return mask
-        else:
+        spkNolist = np.array(list(spkNolist)).astype('int64')
+        if cluNo not in self._layout['slots'] or len(spkNolist) == 0 or len(self._layout['slot_ids'][cluNo]) == 0:
             return np.array([])
+        offset, capacity = self._layout['slots'][cluNo]
+        slot_ids = self._layout['slot_ids'][cluNo]
+        ids = self.clu.index[cluNo][spkNolist]
+        row = np.minimum(np.searchsorted(slot_ids, ids), len(slot_ids) - 1)
+        row = row[slot_ids[row] == ids]       # the spikes not drawn are left out
+        rows = capacity + len(_ENVELOPE_Q)
+        starts = offset + (np.arange(self.n_ch)[None, :]*rows + row[:, None]) * self.n_samples
+        return (starts[..., None] + np.arange(self.n_samples)).ravel()
 
     # ---------------------------------------------
     def highlight(self, selected, external=False, refresh=True):
@@ -313,7 +488,12 @@ class spike_view(View):
                 self.clear_virtual()
 
         with Timer('[VIEW] Spikeview -- is refresh', verbose=conf.ENABLE_PROFILER):
-            if refresh:
+            if self._pin(selected, refresh):
+                # slots were refilled to draw the selected spikes, highlight all of them again
+                if not refresh:
+                    selected = {k: np.union1d(self._selected.get(k, []), v).astype('int64') 
+                                for k, v in list(self._selected.items()) + list(selected.items())}
+            elif refresh:
                 self._clear_highlight()
 
         with Timer('[VIEW] Spikeview -- do highlight', verbose=conf.ENABLE_PROFILER):
@@ -589,6 +769,8 @@ class spike_view(View):
         if modifiers is not ():
             if modifiers[0].name == 'Control':
                 self.transparency *= np.exp(e.delta[1]/4)
+        else:
+            self.update_detail()
 
 
 
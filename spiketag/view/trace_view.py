@@ -144,11 +144,17 @@ class Cross(object):
 
 class trace_view(scene.SceneCanvas):
 
-    def __init__(self, data, color=None, fs=25e3, spklen=19, ncols=1, gap_value=0.8*0.95, ls='-', time_slice=0):
+    def __init__(self, data, color=None, fs=25e3, spklen=19, ncols=1, gap_value=0.8*0.95, ls='-', time_slice=0, n_ch=None):
+        '''
+        data: the traces (nsamples, n_ch), or a function returning them that is only called
+              when a segment is drawn the first time (e.g. lambda: model.mua.data)
+        n_ch: number of channels of data, to set up the view before the data is loaded
+        '''
         scene.SceneCanvas.__init__(self, keys=None)
         self.unfreeze()
         
-        self.data = data
+        self._data = data
+        self._n_ch = n_ch
         self.fs = fs
         self.spklen = spklen
         self.grid1 = self.central_widget.add_grid(spacing=0, bgcolor='gray',
@@ -186,6 +192,12 @@ class trace_view(scene.SceneCanvas):
         self.timer_cursor = app.Timer(connect=self.update_cursor, interval=0.01, start=False)
         self.event = EventEmitter()
 
+    @property
+    def data(self):
+        if callable(self._data):
+            self._data = self._data()
+        return self._data
+
     def _render(self, data):
         '''
           For now,wave_visual is the best place  where store the view information,
@@ -209,13 +221,16 @@ class trace_view(scene.SceneCanvas):
         # self.data = np.fliplr(data) # trace_view displace reserved order, so flip back.
         self.chs = chs
         self.clu = clu
-        self.nCh = self.data.shape[1] 
+        self.nCh = self.data.shape[1] if self._n_ch is None else self._n_ch
         self.times = spk_times 
 
         #TODO: the cross object have something wrong dependency, only can initiate after have data.
         if not self._is_inited():
-            # just simple initialization rendering
-            self._render(self.data[0:200, self.chs[::-1]]) # reverse order display is correct
+            # just simple initialization rendering, a flat segment until the data is loaded
+            if callable(self._data):
+                self._render(np.zeros((200, len(self.chs)), dtype=np.float32))
+            else:
+                self._render(self.data[0:200, self.chs[::-1]]) # reverse order display is correct
 
             # initiate the cross 
             self.cross.attach(self.grid2)
@@ -376,8 +376,16 @@ class wave_view(scene.SceneCanvas):
         tmp = self._start_index + int(offset) * 10
 
         if tmp  >= 0 and tmp + self.pagesize < self.data.shape[0]:
+            step = int(tmp - self._start_index)
             self._start_index = tmp
-            self._render(self.data[int(self._start_index):int(self._start_index + self.pagesize), self._chs_idx])
+            page = self.data[int(tmp):int(tmp + self.pagesize), self._chs_idx]
+            if 0 < abs(step) < self.waves1.npts == self.pagesize and np.float32(page.max()) - np.float32(page.min()) == self.waves1._scale:
+                # only the points scrolled in are uploaded, as long as the page keeps its scale
+                end = int(self._start_index + self.pagesize)
+                new = self.data[end-step:end] if step > 0 else self.data[int(tmp):int(tmp)-step]
+                self.waves1.scroll(new[:, self._chs_idx], backward=step < 0)
+            else:
+                self._render(page)
             self.highlight_ch()
             self.cross.start_index_changed(self._start_index)
             self.cross.view_changed()